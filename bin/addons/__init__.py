@@ -436,16 +436,52 @@ def upgrade_graph(graph, cr, module_list, force=None):
     return result
 
 
-def init_module_objects(cr, module_name, obj_list):
+def model_fingerprints(cr):
+    """ The fingerprints of the models, per (module, model), as they were
+        when their tables were last created or updated by that module, or
+        None if the database predates their table (see base.sql)
+    """
+    cr.execute("SELECT relname FROM pg_class WHERE relkind='r' AND relname='ir_model_fingerprint'")
+    if not cr.fetchone():
+        logger.warning('table ir_model_fingerprint is missing, all the tables will be updated')
+        return None
+    cr.execute("SELECT module, model, fingerprint FROM ir_model_fingerprint")
+    return dict([((module, model), fp) for module, model, fp in cr.fetchall()])
+
+def init_module_objects(cr, module_name, obj_list, fingerprints=None, skip_unchanged=False):
+    """ Create or update the tables of the objects of a module
+
+        If fingerprints (see model_fingerprints()) are given, they are
+        kept up to date and, with skip_unchanged, the objects whose
+        fingerprint didn't change since are not updated, unless they
+        override _auto_init(): what it does is not in their fingerprint.
+    """
+    from osv import orm
+    default_auto_inits = (orm.orm_template._auto_init.im_func, orm.orm._auto_init.im_func)
     logger.info('module %s: creating or updating database tables' % module_name)
     todo = []
     for obj in obj_list:
-        try:
-            result = obj._auto_init(cr, {'module': module_name})
-        except Exception:
-            raise
-        if result:
-            todo += result
+        fingerprint = None
+        if fingerprints is not None and type(obj)._auto_init.im_func in default_auto_inits:
+            fingerprint = obj._fingerprint()
+        if skip_unchanged and fingerprint \
+                and fingerprints.get((module_name, obj._name)) == fingerprint:
+            logger.debug('module %s: object %s is unchanged, skipping its table',
+                        module_name, obj._name)
+        else:
+            try:
+                result = obj._auto_init(cr, {'module': module_name})
+            except Exception:
+                raise
+            if result:
+                todo += result
+            if fingerprint:
+                cr.execute("UPDATE ir_model_fingerprint SET fingerprint=%s "
+                            "WHERE module=%s AND model=%s", (fingerprint, module_name, obj._name))
+                if not cr.rowcount:
+                    cr.execute("INSERT INTO ir_model_fingerprint (module, model, fingerprint) "
+                                "VALUES (%s, %s, %s)", (module_name, obj._name, fingerprint))
+                fingerprints[(module_name, obj._name)] = fingerprint
         if hasattr(obj, 'init'):
             obj.init(cr)
         cr.commit()
@@ -543,7 +579,7 @@ class MigrationManager(object):
         mlog = logging.getLogger('migration')
 
         if not (hasattr(pkg, 'update') or pkg.state == 'to upgrade'):
-            return
+            return False
 
         def convert_version(version):
             if version.startswith(release.major_version) and version != release.major_version:
@@ -593,6 +629,7 @@ class MigrationManager(object):
         current_version = parse_version(convert_version(pkg.data.get('version', '0')))
 
         versions = _get_migration_versions(pkg)
+        migrated = False
 
         for version in versions:
             if parsed_installed_version < parse_version(convert_version(version)) <= current_version:
@@ -619,6 +656,7 @@ class MigrationManager(object):
                             mod = imp.load_source(name, pyfile, fp2)
                             mlog.info('module %(addon)s: Running migration %(version)s %(name)s' % mergedict({'name': mod.__name__}, strfmt))
                             mod.migrate(self.cr, pkg.installed_version)
+                            migrated = True
                         except ImportError:
                             mlog.error('module %(addon)s: Unable to load %(stage)s-migration file %(file)s' % mergedict({'file': pyfile}, strfmt))
                             raise
@@ -633,6 +671,7 @@ class MigrationManager(object):
                             fp2.close()
                         if mod:
                             del mod
+        return migrated
 
 log = logging.getLogger('init')
 
@@ -769,16 +808,27 @@ def load_module_graph(cr, graph, status=None, perform_checks=True, skip_modules=
     modobj = None
     logger.debug('loading %d packages..' % len(graph))
 
-    for package in graph:
-        if skip_modules and package.name in skip_modules:
-            continue
-        logger.info('module %s: loading objects' % package.name)
-        migrations.migrate_module(package, 'pre')
-        register_class(package.name)
-        modules = pool.instanciate(package.name, cr)
-        if hasattr(package, 'init') or hasattr(package, 'update') or package.state in ('to install', 'to upgrade'):
-            init_module_objects(cr, package.name, modules)
-        cr.commit()
+    # the tables are created or updated against one snapshot of the schema
+    pool.schema = tools.SchemaSnapshot()
+    fingerprints = None
+    if tools.config.get_misc('modules', 'skip_unchanged', False):
+        fingerprints = model_fingerprints(cr)
+    try:
+        for package in graph:
+            if skip_modules and package.name in skip_modules:
+                continue
+            logger.info('module %s: loading objects' % package.name)
+            if migrations.migrate_module(package, 'pre'):
+                pool.schema.reset()
+            register_class(package.name)
+            modules = pool.instanciate(package.name, cr)
+            if hasattr(package, 'init') or hasattr(package, 'update') or package.state in ('to install', 'to upgrade'):
+                # a module being installed must register all its objects
+                init_module_objects(cr, package.name, modules, fingerprints,
+                        skip_unchanged=not (hasattr(package, 'init') or package.state == 'to install'))
+            cr.commit()
+    finally:
+        pool.schema = None
 
     for package in graph:
         status['progress'] = (float(statusi)+0.1) / len(graph)
@@ -970,11 +1020,13 @@ def load_modules(db, force_demo=False, status=None, update_module=False, languag
                 if isinstance(model_obj, osv.osv.osv_memory):
                     logger.warning('In-memory object %s (%s) should not have explicit access rules!' % (model, name))
 
+            schema = tools.SchemaSnapshot()
+            schema.load(cr)
             cr.execute("SELECT model FROM ir_model")
             for (model,) in cr.fetchall():
                 obj = pool.get(model)
                 if obj:
-                    obj._check_removed_columns(cr, log=True)
+                    obj._check_removed_columns(cr, log=True, schema=schema)
                 else:
                     logger.warning("Model %s is referenced but not present in the orm pool!", model)
 
@@ -1019,6 +1071,9 @@ def load_modules(db, force_demo=False, status=None, update_module=False, languag
 
             cr.execute("UPDATE ir_module_module SET state=%s WHERE state=%s", ('uninstalled', 'to remove',))
             cr.commit()
+        # workflows and models may have changed as well as the views
+        pool.clear_view_cache(cr)
+        pool.get('ir.model.access').clear_access_cache(cr)
     finally:
         cr.close()
 
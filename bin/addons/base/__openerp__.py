@@ -98,6 +98,10 @@
         #                       it can't be run until the db is loaded
         'test/test_sequence.yml',
         'test/base_domain_exprs.yml',
+        'test/test_record_cache.yml',
+        'test/test_create_multi.yml',
+        'test/test_write_multi.yml',
+        'test/test_store_queue.yml',
     ],
     'installable': True,
     'active': True,
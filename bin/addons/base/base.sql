@@ -339,6 +339,15 @@ CREATE TABLE ir_model_data (
 CREATE INDEX ir_model_data_name_index ON ir_model_data (name);
 CREATE INDEX ir_model_data_model_index ON ir_model_data (model);
 
+-- fingerprints of the models whose tables were last updated by a module,
+-- see addons.init_module_objects()
+CREATE TABLE ir_model_fingerprint (
+    module character varying(64) NOT NULL,
+    model character varying(64) NOT NULL,
+    fingerprint character varying(32) NOT NULL,
+    PRIMARY KEY(module, model)
+) WITHOUT OIDS;
+
 ---------------------------------
 -- Users
 ---------------------------------
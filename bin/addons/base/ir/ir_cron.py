@@ -26,6 +26,7 @@ import netsvc
 import tools
 from tools.safe_eval import safe_eval as eval
 import pooler
+import sql_db
 from osv import fields, osv
 
 def str2tuple(s):
@@ -40,6 +41,20 @@ _intervalTypes = {
     'minutes': lambda interval: relativedelta(minutes=interval),
 }
 
+# the threads running the jobs of all the databases
+_workers = netsvc.WorkerPool('cron', int(tools.config.get_misc('cron', 'workers', 4)))
+
+# channel of the changes of the jobs, see update_running_cron()
+CHANNEL = 'ir_cron'
+
+def _notified(db_name, payload):
+    if db_name in pooler.pool_dic:
+        pooler.pool_dic[db_name].get('ir.cron').restart(db_name)
+
+# first key of the advisory locks of the jobs, locked as
+# (_LOCK_KEY + n, job id) by the n-th concurrent run of a job
+_LOCK_KEY = 0x4352
+
 class ir_cron(osv.osv, netsvc.Agent):
     """ This is the ORM object that periodically executes actions.
     
@@ -60,7 +75,9 @@ class ir_cron(osv.osv, netsvc.Agent):
         'model': fields.char('Object', size=64, help="Name of object whose function will be called when this scheduler will run. e.g. 'res.partner'"),
         'function': fields.char('Function', size=64, help="Name of the method to be called on the object when this scheduler is executed."),
         'args': fields.text('Arguments', help="Arguments to be passed to the method. e.g. (uid,)"),
-        'priority': fields.integer('Priority', help='0=Very Urgent\n10=Not urgent')
+        'priority': fields.integer('Priority', help='0=Very Urgent\n10=Not urgent'),
+        'max_concurrency': fields.integer('Max. Concurrent Runs',
+            help="Number of runs of this job that may take place at the same time, in all the server processes"),
     }
 
     _defaults = {
@@ -71,7 +88,8 @@ class ir_cron(osv.osv, netsvc.Agent):
         'interval_type' : 'months',
         'numbercall' : 1,
         'active' : 1,
-        'doall' : 1
+        'doall' : 1,
+        'max_concurrency' : 1,
     }
 
     def _check_args(self, cr, uid, ids, context=None):
@@ -96,9 +114,13 @@ class ir_cron(osv.osv, netsvc.Agent):
             except Exception, e:
                 cr.rollback()
                 self._logger.exception("Job call of self.pool.get('%s').%s(cr, uid, *%r) failed" % (model, func, args))
-
+                return False
+        return True
 
     def _poolJobs(self, db_name, check=False):
+        """ Queue the jobs of db_name that are due to the cron workers and
+            set the alarm of the next ones
+        """
         try:
             db, pool = pooler.get_db_and_pool(db_name)
         except:
@@ -106,36 +128,17 @@ class ir_cron(osv.osv, netsvc.Agent):
         cr = db.cursor()
         try:
             if not pool._init:
-                now = datetime.now()
-                cr.execute('SELECT * FROM ir_cron '
+                cr.execute('SELECT id, name, max_concurrency FROM ir_cron '
                         'WHERE numbercall<>0 AND active AND nextcall<=now() '
                         'ORDER BY priority', debug=self._debug)
-                for job in cr.dictfetchall():
-                    nextcall = datetime.strptime(job['nextcall'], '%Y-%m-%d %H:%M:%S')
-                    numbercall = job['numbercall']
-
-                    ok = False
-                    while nextcall < now and numbercall:
-                        if numbercall > 0:
-                            numbercall -= 1
-                        if not ok or job['doall']:
-                            self._callback(cr, job['user_id'], job['model'], job['function'], job['args'])
-                        if numbercall:
-                            nextcall += _intervalTypes[job['interval_type']](job['interval_number'])
-                        ok = True
-                    addsql = ''
-                    if not numbercall:
-                        addsql = ', active=False'
-                    cr.execute("UPDATE ir_cron "
-                                "SET nextcall=%s, numbercall=%s"+addsql+ \
-                                " WHERE id=%s", 
-                                (nextcall.strftime('%Y-%m-%d %H:%M:%S'), numbercall, job['id']),
-                                debug=self._debug)
-                    cr.commit()
-
+                for job_id, name, max_concurrency in cr.fetchall():
+                    _workers.submit((db_name, job_id), max_concurrency or 1,
+                            '%s: %s' % (db_name, name), self._run_job, db_name, job_id)
 
+            # the jobs due now were queued above: their next call is set
+            # when they run, which restarts this
             cr.execute('SELECT min(nextcall) AS min_next_call FROM ir_cron '
-                        'WHERE numbercall<>0 AND active ', debug=self._debug)
+                        'WHERE numbercall<>0 AND active AND nextcall>now() ', debug=self._debug)
             next_call = cr.dictfetchone()['min_next_call']
             if next_call:
                 next_call = time.mktime(time.strptime(next_call, '%Y-%m-%d %H:%M:%S'))
@@ -152,22 +155,113 @@ class ir_cron(osv.osv, netsvc.Agent):
             cr.commit()
             cr.close()
 
+    def _next_calls(self, job, now):
+        """ The nextcall and numbercall of job after each of the calls due
+            at now, whose number is the length of the result
+        """
+        nextcall = datetime.strptime(job['nextcall'], '%Y-%m-%d %H:%M:%S')
+        numbercall = job['numbercall']
+        steps = []
+        while nextcall < now and numbercall:
+            if numbercall > 0:
+                numbercall -= 1
+            if numbercall:
+                nextcall += _intervalTypes[job['interval_type']](job['interval_number'])
+            if not steps or job['doall']:
+                steps.append((nextcall, numbercall))
+            else:
+                steps[-1] = (nextcall, numbercall)
+        return steps
+
+    def _run_job(self, db_name, job_id):
+        """ Run the job job_id of db_name, if it is still due, in a cursor
+            of its own
+
+            The job runs under one of the max_concurrency advisory locks it
+            has. The next call of the job is set once each of its calls has
+            succeeded, in the transaction of that call, so that a call that
+            failed or was interrupted is made again at a later check of the
+            jobs. The update only applies if no other run of the job set the
+            next call meanwhile.
+
+            @return False if one of its calls failed
+        """
+        db = pooler.get_db_only(db_name)
+        cr = db.cursor()
+        lock = None
+        ok = True
+        try:
+            cr.execute('SELECT max_concurrency FROM ir_cron WHERE id=%s', (job_id,))
+            res = cr.fetchone()
+            for n in range(res and max(res[0] or 1, 1) or 0):
+                cr.execute('SELECT pg_try_advisory_lock(%s, %s)', (_LOCK_KEY + n, job_id))
+                if cr.fetchone()[0]:
+                    lock = _LOCK_KEY + n
+                    break
+            if lock is None:
+                # as many runs as allowed already take place
+                return True
+
+            cr.execute('SELECT * FROM ir_cron '
+                    'WHERE id=%s AND numbercall<>0 AND active AND nextcall<=now()',
+                    (job_id,), debug=self._debug)
+            job = cr.dictfetchone()
+            cr.commit()
+            if not job:
+                # run by another worker meanwhile
+                return True
+
+            previous = job['nextcall']
+            for nextcall, numbercall in self._next_calls(job, datetime.now()):
+                if not self._callback(cr, job['user_id'], job['model'], job['function'], job['args']):
+                    ok = False
+                    break
+                addsql = ''
+                if not numbercall:
+                    addsql = ', active=False'
+                nextcall = nextcall.strftime('%Y-%m-%d %H:%M:%S')
+                cr.execute("UPDATE ir_cron "
+                            "SET nextcall=%s, numbercall=%s"+addsql+ \
+                            " WHERE id=%s AND nextcall=%s",
+                            (nextcall, numbercall, job['id'], previous),
+                            debug=self._debug)
+                cr.commit()
+                previous = nextcall
+        finally:
+            try:
+                cr.rollback()
+                if lock is not None:
+                    cr.execute('SELECT pg_advisory_unlock(%s, %s)', (lock, job_id))
+                cr.commit()
+                cr.close()
+            finally:
+                if lock is not None and ok:
+                    # the next call of the job changed: the jobs must be
+                    # reconsidered. A job that failed is still due, and is
+                    # retried at the next check rather than right away.
+                    self.restart(db_name)
+        return ok
+
     def restart(self, dbname):
         self.cancel(dbname)
         # Reschedule cron processing job asap, but not in the current thread
         self.setAlarm(self._poolJobs, time.time(), dbname, dbname)
+        # and again whenever the jobs change, in any server process
+        sql_db.listen(dbname, CHANNEL, _notified)
 
     def update_running_cron(self, cr):
-        # Verify whether the server is already started and thus whether we need to commit
-        # immediately our changes and restart the cron agent in order to apply the change
-        # immediately. The commit() is needed because as soon as the cron is (re)started it
-        # will query the database with its own cursor, possibly before the end of the
-        # current transaction.
-        # This commit() is not an issue in most cases, but we must absolutely avoid it
-        # when the server is only starting or loading modules (hence the test on pool._init).
+        """ Have the cron of all the server processes reconsider the jobs,
+            as soon as the current transaction is committed
+
+            Nothing is sent while the server is only starting or loading
+            modules (hence the test on pool._init).
+        """
         if not self.pool._init:
-            cr.commit()
-            self.restart(cr.dbname)
+            cr.notify(CHANNEL)
+
+    def run_now(self, cr, uid, ids, context=None):
+        """ Have the jobs ids run once the current transaction is committed """
+        return self.write(cr, uid, ids, {'nextcall': time.strftime('%Y-%m-%d %H:%M:%S')}, context=context)
 
     def create(self, cr, uid, vals, context=None):
         res = super(ir_cron, self).create(cr, uid, vals, context=context)
@@ -265,7 +265,10 @@ class ir_model_fields(osv.osv):
         #
             #Removing _columns entry for that table
             self.pool.get(field.model)._columns.pop(field.name,None)
-        return super(ir_model_fields, self).unlink(cr, user, ids, context)
+        res = super(ir_model_fields, self).unlink(cr, user, ids, context)
+        self.pool.clear_view_cache(cr)
+        self.pool.get('ir.model.access').clear_access_cache(cr)
+        return res
 
     def create(self, cr, user, vals, context=None):
         if 'model_id' in vals:
@@ -299,6 +302,8 @@ class ir_model_fields(osv.osv):
             cr.rollback()
             raise
 
+        self.pool.clear_view_cache(cr)
+        self.pool.get('ir.model.access').clear_access_cache(cr)
         return res
 
     def write(self, cr, user, ids, vals, context=None):
@@ -430,6 +435,8 @@ class ir_model_fields(osv.osv):
                         log.debug('%s: setting %s.%s = %r', mkey, col_name, col_prop, val)
                     setattr(obj._columns[col_name], col_prop, val)
                 obj._auto_init(cr, ctx)
+        self.pool.clear_view_cache(cr)
+        self.pool.get('ir.model.access').clear_access_cache(cr)
         return res
 
 ir_model_fields()
@@ -446,6 +453,69 @@ class ir_model_access(osv.osv):
         'perm_unlink': fields.boolean('Delete Access'),
     }
 
+    _modes = ('read', 'write', 'create', 'unlink')
+
+    def clear_access_cache(self, cr):
+        """ Forget the access matrix and the groups of the users, after the
+            access rules, the groups or their members changed
+
+            The other server processes forget them as well, once the
+            transaction is committed (see tools.cache).
+        """
+        for method in (self._get_matrix, self.get_user_groups,
+                       self._get_user_access, self._get_group_id,
+                       self._hidden_fields):
+            method.clear_cache(cr.dbname)
+
+    @tools.cache()
+    def _get_matrix(self, cr):
+        """ {model: (modes of the generic rules, {gid: modes of the group rules})} """
+        matrix = {}
+        cr.execute('SELECT m.model, a.group_id, a.perm_read, a.perm_write, '
+                        'a.perm_create, a.perm_unlink '
+                   '  FROM ir_model_access a '
+                   '  JOIN ir_model m ON (m.id = a.model_id)', debug=self._debug)
+        for row in cr.fetchall():
+            modes = [mode for mode, perm in zip(self._modes, row[2:]) if perm]
+            generic, groups = matrix.setdefault(row[0], (set(), {}))
+            if row[1]:
+                groups.setdefault(row[1], set()).update(modes)
+            else:
+                generic.update(modes)
+        return matrix
+
+    @tools.cache()
+    def get_user_groups(self, cr, uid):
+        """ The ids of the groups of uid, as a frozenset """
+        cr.execute_prepared('ima_user_groups',
+                'SELECT gid FROM res_groups_users_rel WHERE uid=%s',
+                (uid,), debug=self._debug)
+        return frozenset([r[0] for r in cr.fetchall()])
+
+    @tools.cache()
+    def _get_user_access(self, cr, uid, model_name):
+        """ The modes uid has on model_name: those of the rules of its groups
+            if there are any, else those of the generic rules
+        """
+        generic, groups = self._get_matrix(cr).get(model_name, ((), {}))
+        specific = [groups[gid] for gid in self.get_user_groups(cr, uid)
+                        if gid in groups]
+        if specific:
+            return frozenset().union(*specific)
+        return frozenset(generic)
+
+    @tools.cache()
+    def _get_group_id(self, cr, group):
+        """ The id of the group of xml id group ('module.name'), or None """
+        if '.' not in group:
+            return None
+        module, name = group.split('.', 1)
+        cr.execute("SELECT res_id FROM ir_model_data "
+                    "WHERE model = 'res.groups' AND module = %s AND name = %s",
+                    (module, name), debug=self._debug)
+        res = cr.fetchone()
+        return res and res[0] or None
+
     def check_groups(self, cr, uid, group):
         """ check if uid belongs in 'group'
         
@@ -457,28 +527,25 @@ class ir_model_access(osv.osv):
             @return True or False
         """
         if isinstance(group, basestring):
-            return self._check_groups2(cr, uid, group)
-        elif isinstance(group, list):
-            for g in group:
-                # crude way, may be saved by cache..
-                if self._check_groups2(cr, uid, g):
-                    return True
-            return False
-        else:
+            group = [group]
+        elif not isinstance(group, list):
             raise NotImplementedError()
+        gids = self.get_user_groups(cr, uid)
+        for g in group:
+            if self._get_group_id(cr, g) in gids:
+                return True
+        return False
 
-    @tools.cache(timeout=10.0) # TODO find a way to clear the cache
-    def _check_groups2(self, cr, uid, group):
-        grouparr  = group.split('.')
-        if not grouparr:
-            return False
-        cr.execute_prepared('ima_check_groups2', 
-                "SELECT EXISTS (SELECT 1 FROM res_groups_users_rel AS ur, ir_model_data AS imd " \
-                " WHERE ur.uid=%s AND ur.gid = imd.res_id " \
-                " AND imd.model = 'res.groups' " \
-                " AND imd.module=%s AND imd.name=%s )", \
-                (uid, grouparr[0], grouparr[1],), debug=self._debug)
-        return bool(cr.fetchone()[0])
+    def hidden_fields(self, cr, uid, model_obj):
+        """ Names of the columns of model_obj that uid may not read, because
+            of their 'read' groups
+        """
+        return self._hidden_fields(cr, uid, model_obj._name)
+
+    @tools.cache()
+    def _hidden_fields(self, cr, uid, model_name):
+        return frozenset([name for name, column in self.pool.get(model_name)._columns.items()
+                if column.read and not self.check_groups(cr, uid, column.read)])
 
     def check_group(self, cr, uid, model, mode, group_ids):
         """ Check if a specific group has the access mode to the specified model"""
@@ -533,24 +600,9 @@ class ir_model_access(osv.osv):
         if isinstance(model_obj, osv.osv_memory):
             return True
 
-        # We check if a specific rule exists
-        cr.execute_prepared('ima_group_check_' + mode,
-                   'SELECT BOOL_OR(perm_' + mode + ') '
-                   '  FROM ir_model_access a '
-                   '  JOIN ir_model m ON (m.id = a.model_id) '
-                   '  LEFT JOIN res_groups_users_rel gu ON (gu.gid = a.group_id) '
-                   ' WHERE m.model = %s '
-                   '   AND (gu.uid = %s OR gu.uid IS NULL) '
-                   ' GROUP BY (gu.uid IS NULL) ORDER BY MIN(gu.uid) '
-                   , (model_name, uid,),
-                   debug= (model_obj and model_obj._debug) or self._debug
-                   )
-                   # GROUP BY makes sure we separate specific group rules from 
-                   # generic ones, and those groups are OR-ed together. 
-                   # ORDER tells the query to put the specific first.
-        r = cr.fetchone()
-        if r:
-            r = r[0]
+        # The rules of the groups of uid, if any, take precedence over the
+        # generic ones
+        r = mode in self._get_user_access(cr, uid, model_name)
 
         if not r and raise_exception:
             cr.execute('''select
@@ -571,9 +623,7 @@ class ir_model_access(osv.osv):
             }
 
             raise except_orm(_('AccessError'), msgs[mode] % (model_name, groups) )
-        return r or False
-
-    check = tools.cache()(check)
+        return r
 
     __cache_clearing_methods = []
 
@@ -588,7 +638,8 @@ class ir_model_access(osv.osv):
             pass
 
     def call_cache_clearing_methods(self, cr):
-        self.check.clear_cache(cr.dbname)    # clear the cache of check function
+        self.clear_access_cache(cr)
+        self.pool.clear_view_cache(cr)    # views depend on the write access
         for model, method in self.__cache_clearing_methods:
             object_ = self.pool.get(model)
             if object_:
@@ -598,18 +649,18 @@ class ir_model_access(osv.osv):
     # Check rights on actions
     #
     def write(self, cr, uid, *args, **argv):
-        self.call_cache_clearing_methods(cr)
         res = super(ir_model_access, self).write(cr, uid, *args, **argv)
+        self.call_cache_clearing_methods(cr)
         return res
 
     def create(self, cr, uid, *args, **argv):
-        self.call_cache_clearing_methods(cr)
         res = super(ir_model_access, self).create(cr, uid, *args, **argv)
+        self.call_cache_clearing_methods(cr)
         return res
 
     def unlink(self, cr, uid, *args, **argv):
-        self.call_cache_clearing_methods(cr)
         res = super(ir_model_access, self).unlink(cr, uid, *args, **argv)
+        self.call_cache_clearing_methods(cr)
         return res
 
 ir_model_access()
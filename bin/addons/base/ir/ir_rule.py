@@ -145,6 +145,63 @@ class ir_rule(osv.osv):
         
         return dom
 
+    def _is_static_domain(self, obj, dom):
+        """ Tell whether _where_calc() turns /dom/ into SQL on its own, without
+            searching other records (child_of, dotted paths, x2many, name
+            searches, fnct_search). The SQL of such domains only depends on
+            the rules themselves and may be kept across transactions.
+        """
+        for leaf in dom:
+            if not isinstance(leaf, (list, tuple)):
+                continue
+            left, operator, right = leaf
+            if '.' in left or operator.lower() in ('child_of', '|child_of'):
+                return False
+            if left == 'id':
+                continue
+            table = obj
+            while left not in table._columns and left in table._inherit_fields:
+                table = self.pool.get(table._inherit_fields[left][0])
+            field = table._columns.get(left)
+            if not field:
+                continue
+            if field._properties and not field.store:
+                return False
+            if field._type in ('one2many', 'many2many'):
+                return False
+            if field._type == 'many2one':
+                if isinstance(right, basestring):
+                    return False
+                if isinstance(right, (list, tuple)) and \
+                        [x for x in right if not isinstance(x, (int, long))]:
+                    return False
+        return True
+
+    def _domain_sql(self, cr, model_name, dom):
+        """ Compile /dom/ into SQL, see domain_get()
+        """
+        if dom:
+            # _where_calc is called as superuser. This means that rules can
+            # involve objects on which the real uid has no acces rights.
+            # This means also there is no implicit restriction (e.g. an object
+            # references another object the user can't see).
+            query = self.pool.get(model_name)._where_calc(cr, 1, dom, active_test=False)
+            return query.where_clause, query.where_clause_params, query.tables
+        return [], [], ['"'+self.pool.get(model_name)._table+'"']
+
+    # Only static domains are kept: the SQL of the others embeds the ids
+    # found by their sub-searches, possibly among uncommitted data. They
+    # are cleared with _compute_domain(), see clear_cache().
+    @tools.cache()
+    def _compute_domain_sql(self, cr, uid, model_name, mode="read"):
+        """ The SQL of _compute_domain(), or None when the domain is not
+            static and must be compiled again by every transaction
+        """
+        dom = self._compute_domain(cr, uid, model_name, mode=mode)
+        if dom and not self._is_static_domain(self.pool.get(model_name), dom):
+            return None
+        return self._domain_sql(cr, model_name, dom)
+
     def clear_cache(self, cr, uid):
         cr.execute("""SELECT DISTINCT m.model
                         FROM ir_rule r
@@ -159,8 +216,15 @@ class ir_rule(osv.osv):
                                         AND u_rel.uid = %s)
                     """, (uid,))
         models = map(itemgetter(0), cr.fetchall())
-        clear = partial(self._compute_domain.clear_cache, cr.dbname, uid)
-        [clear(model, mode) for model in models for mode in self._MODES]
+        for clear_fn in (self._compute_domain.clear_cache, self._compute_domain_sql.clear_cache):
+            clear = partial(clear_fn, cr.dbname, uid)
+            [clear(model, mode) for model in models for mode in self._MODES]
+
+    def clear_all_caches(self, cr):
+        """ Forget the domains of all the users, eg. when groups change
+        """
+        self._compute_domain.clear_cache(cr.dbname)
+        self._compute_domain_sql.clear_cache(cr.dbname)
 
     def domain_get(self, cr, uid, model_name, mode='read', context=None):
         """
@@ -169,32 +233,30 @@ class ir_rule(osv.osv):
             If needed, tables will contain any tables (including one for the
             model_name) needed in the FROM expression
         """
-        dom = self._compute_domain(cr, uid, model_name, mode=mode)
-        if dom:
-            # _where_calc is called as superuser. This means that rules can
-            # involve objects on which the real uid has no acces rights.
-            # This means also there is no implicit restriction (e.g. an object
-            # references another object the user can't see).
-            query = self.pool.get(model_name)._where_calc(cr, 1, dom, active_test=False)
-            return query.where_clause, query.where_clause_params, query.tables
-        return [], [], ['"'+self.pool.get(model_name)._table+'"']
+        res = self._compute_domain_sql(cr, uid, model_name, mode=mode)
+        if res is None:
+            res = self._domain_sql(cr, model_name,
+                    self._compute_domain(cr, uid, model_name, mode=mode))
+        clause, params, tables = res
+        # copies, because the callers may alter them
+        return list(clause), list(params), list(tables)
 
     def unlink(self, cr, uid, ids, context=None):
         res = super(ir_rule, self).unlink(cr, uid, ids, context=context)
         # Restart the cache on the _compute_domain method of ir.rule
-        self._compute_domain.clear_cache(cr.dbname)
+        self.clear_all_caches(cr)
         return res
 
     def create(self, cr, user, vals, context=None):
         res = super(ir_rule, self).create(cr, user, vals, context=context)
         # Restart the cache on the _compute_domain method of ir.rule
-        self._compute_domain.clear_cache(cr.dbname)
+        self.clear_all_caches(cr)
         return res
 
     def write(self, cr, uid, ids, vals, context=None):
         res = super(ir_rule, self).write(cr, uid, ids, vals, context=context)
         # Restart the cache on the _compute_domain method
-        self._compute_domain.clear_cache(cr.dbname)
+        self.clear_all_caches(cr)
         return res
 
 ir_rule()
@@ -21,6 +21,7 @@
 
 import time
 from osv import fields,osv
+import tools
 from tools.safe_eval import safe_eval
 from tools.misc import attrob
 import logging
@@ -53,8 +54,17 @@ class ir_sequence(osv.osv):
         'number_increment': fields.integer('Increment Number', required=True, help="The next number of the sequence will be incremented by this number"),
         'padding' : fields.integer('Number padding', required=True, help="OpenERP will automatically adds some '0' on the left of the 'Next Number' to get the required padding size."),
         'company_id': fields.many2one('res.company', 'Company'),
-        'condition': fields.char('Condition', size=250, help="If set, sequence will only be used in case this python expression matches, and will precede other sequences."),
-        'weight': fields.integer('Weight',required=True, help="If two sequences match, the highest weight will be used.")
+        'condition': fields.char('Condition', size=250, help="If set, sequence will only be used in case this python expression matches, and will precede other sequences. "
+            "The condition of a fast sequence cannot use its next number (this.number_next)."),
+        'weight': fields.integer('Weight',required=True, help="If two sequences match, the highest weight will be used."),
+        'implementation': fields.selection([('standard', 'Standard'), ('fast', 'Fast')],
+            'Implementation', required=True,
+            help="A standard sequence locks its row until the end of the transaction "
+                "that took a number, so that there is no gap between the numbers. "
+                "A fast one uses a postgres sequence, which is never locked but "
+                "leaves gaps when transactions are rolled back. Changing the next "
+                "number of a fast sequence is not undone if the transaction is "
+                "rolled back."),
     }
     _defaults = {
         'active': True,
@@ -63,8 +73,107 @@ class ir_sequence(osv.osv):
         'number_next': 1,
         'padding': 0,
         'weight': 10,
+        'implementation': 'standard',
     }
 
+    def _check_condition(self, cr, uid, ids, context=None):
+        """ The next number of a fast sequence cannot be known before it is
+            taken, other transactions take numbers meanwhile
+        """
+        for seq in self.read(cr, uid, ids, ['implementation', 'condition'], context=context):
+            if seq['implementation'] == 'fast' and 'number_next' in (seq['condition'] or ''):
+                return False
+        return True
+
+    _constraints = [
+        (_check_condition, 'The condition of a fast sequence cannot use its next number', ['condition', 'implementation']),
+    ]
+
+    def _seq_name(self, id):
+        return 'ir_sequence_%03d' % id
+
+    def _create_seq(self, cr, id, number_next, number_increment):
+        cr.execute('CREATE SEQUENCE %s INCREMENT BY %%s START WITH %%s' % self._seq_name(id),
+                    (number_increment, number_next), debug=self._debug)
+
+    def _peek_seq(self, cr, id):
+        """ The next number of the postgres sequence of id, left untouched """
+        cr.execute('SELECT last_value, increment_by, is_called FROM %s' % self._seq_name(id),
+                    debug=self._debug)
+        last_value, increment_by, is_called = cr.fetchone()
+        if is_called:
+            last_value += increment_by
+        return last_value
+
+    def _drop_seqs(self, cr, ids):
+        for id in ids:
+            cr.execute('DROP SEQUENCE IF EXISTS %s' % self._seq_name(id), debug=self._debug)
+
+    def create(self, cr, uid, vals, context=None):
+        id = super(ir_sequence, self).create(cr, uid, vals, context=context)
+        if vals.get('implementation') == 'fast':
+            seq = self.read(cr, uid, id, ['number_next', 'number_increment'], context=context)
+            self._create_seq(cr, id, seq['number_next'], seq['number_increment'])
+        self._get_candidates.clear_cache(cr.dbname)
+        return id
+
+    def write(self, cr, uid, ids, vals, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        old = []
+        if set(['implementation', 'number_next', 'number_increment']).intersection(vals):
+            old = self.read(cr, uid, ids, ['implementation', 'number_next', 'number_increment'], context=context)
+        res = super(ir_sequence, self).write(cr, uid, ids, vals, context=context)
+        for seq in old:
+            implementation = vals.get('implementation', seq['implementation'])
+            number_next = vals.get('number_next', seq['number_next'])
+            number_increment = vals.get('number_increment', seq['number_increment'])
+            if seq['implementation'] != 'fast':
+                if implementation == 'fast':
+                    self._create_seq(cr, seq['id'], number_next, number_increment)
+            elif implementation != 'fast':
+                # the standard implementation goes on from the postgres sequence
+                cr.execute('UPDATE ir_sequence SET number_next=%s WHERE id=%s',
+                            (number_next, seq['id']), debug=self._debug)
+                self._drop_seqs(cr, [seq['id']])
+            elif 'number_next' in vals or 'number_increment' in vals:
+                # not transactional: a rollback doesn't restore the number
+                query = 'ALTER SEQUENCE %s INCREMENT BY %%s' % self._seq_name(seq['id'])
+                params = (number_increment,)
+                if 'number_next' in vals:
+                    query += ' RESTART WITH %s'
+                    params += (number_next,)
+                cr.execute(query, params, debug=self._debug)
+        self._get_candidates.clear_cache(cr.dbname)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        fast_ids = [seq['id'] for seq in self.read(cr, uid, ids, ['implementation'], context=context)
+                        if seq['implementation'] == 'fast']
+        res = super(ir_sequence, self).unlink(cr, uid, ids, context=context)
+        self._drop_seqs(cr, fast_ids)
+        self._get_candidates.clear_cache(cr.dbname)
+        return res
+
+    def read(self, cr, uid, ids, fields=None, context=None, load='_classic_read'):
+        res = super(ir_sequence, self).read(cr, uid, ids, fields, context=context, load=load)
+        if fields and 'number_next' not in fields:
+            return res
+        seqs = [seq for seq in (isinstance(res, list) and res or [res]) if 'number_next' in seq]
+        if fields and 'implementation' not in fields and seqs:
+            cr.execute("SELECT id FROM ir_sequence WHERE id IN %s AND implementation='fast'",
+                        (tuple([seq['id'] for seq in seqs]),), debug=self._debug)
+            fast_ids = set([x[0] for x in cr.fetchall()])
+        else:
+            fast_ids = set([seq['id'] for seq in seqs if seq.get('implementation') == 'fast'])
+        for seq in seqs:
+            if seq['id'] in fast_ids:
+                # the next number is held by the postgres sequence
+                seq['number_next'] = self._peek_seq(cr, seq['id'])
+        return res
+
     def _process(self, s):
         if not s:
             return ''
@@ -91,62 +200,88 @@ class ir_sequence(osv.osv):
             raise Exception('The test "%s" is not valid for ir.sequence.get_id()' % test)
         return _irs_tests[test]
     
+    @tools.cache()
+    def _get_candidates(self, cr, uid, test, sequence_id):
+        """ The active sequences matching sequence_id for the companies of
+            uid, the preferred ones first, before their conditions are
+            evaluated
+        """
+        sql_test = self._get_test(test, None)
+        cr.execute("""SELECT id, prefix, suffix, padding, condition, implementation
+            FROM ir_sequence
+            WHERE """ + sql_test + """
+              AND active=%s
+              AND ( company_id IS NULL
+                    OR company_id IN ( SELECT company_id
+                                     FROM res_users
+                                    WHERE id = %s )
+                    OR company_id IN ( SELECT cid
+                                    FROM res_company_users_rel
+                                    WHERE user_id = %s
+                                    ))
+            ORDER BY company_id, weight DESC, length(COALESCE(condition,'')) DESC
+            """, (sequence_id, True, uid, uid), debug=self._debug)
+        return cr.dictfetchall()
+
     def get_id(self, cr, uid, sequence_id, test='id', context=None):
         if not context:
             context = {}
         log = logging.getLogger('orm')
-        try:
-            sql_test = self._get_test(test, context)
-            cr.execute("""SELECT id, number_next, prefix, suffix, padding, condition
-                FROM ir_sequence
-                WHERE """ + sql_test + """
-                  AND active=%s
-                  AND ( company_id IS NULL
-                        OR company_id IN ( SELECT company_id
-                                         FROM res_users
-                                        WHERE id = %s )
-                        OR company_id IN ( SELECT cid
-                                        FROM res_company_users_rel
-                                        WHERE user_id = %s
-                                        ))
-                ORDER BY company_id, weight DESC, length(COALESCE(condition,'')) DESC
-                FOR UPDATE """, (sequence_id, True, uid, uid), debug=self._debug)
-            for res in cr.dictfetchall():
-                if res['condition']:
-                    if self._debug:
-                        log.debug("ir_seq: %s has condition: %s" %(res['id'], res['condition']))
-                    try:
-                        ctx = context.copy()
-                        ctx['this'] = attrob(res)
-                        bo = safe_eval(res['condition'],ctx)
-                        if not bo:
-                            if self._debug:
-                                log.debug('ir_seq: %d not matched' % res['id'])
-                            continue
-                    except Exception,e:
-                        # it would be normal to have exceptions, because
-                        # the domain may contain errors
+        for res in self._get_candidates(cr, uid, test, sequence_id):
+            if res['condition']:
+                res = dict(res)
+                # fast sequences have no number_next before nextval(), see
+                # _check_condition()
+                if res['implementation'] != 'fast':
+                    # locks the row until the end of the transaction
+                    cr.execute('SELECT number_next FROM ir_sequence '
+                            'WHERE id=%s AND active=%s FOR UPDATE',
+                            (res['id'], True), debug=self._debug)
+                    number_next = cr.fetchone()
+                    if not number_next:
+                        # deactivated meanwhile
+                        continue
+                    res['number_next'] = number_next[0]
+                if self._debug:
+                    log.debug("ir_seq: %s has condition: %s" %(res['id'], res['condition']))
+                try:
+                    ctx = context.copy()
+                    ctx['this'] = attrob(res)
+                    bo = safe_eval(res['condition'],ctx)
+                    if not bo:
                         if self._debug:
-                            log.debug('ir_seq[%d]: Exception %s with context %s' % \
-                                                (res['id'], e, context), exc_info=True)
+                            log.debug('ir_seq: %d not matched' % res['id'])
                         continue
+                except Exception,e:
+                    # it would be normal to have exceptions, because
+                    # the domain may contain errors
                     if self._debug:
-                        log.debug('ir_seq: %d matched' % res['id'])
+                        log.debug('ir_seq[%d]: Exception %s with context %s' % \
+                                            (res['id'], e, context), exc_info=True)
+                    continue
+                if self._debug:
+                    log.debug('ir_seq: %d matched' % res['id'])
 
+            if res['implementation'] == 'fast':
+                cr.execute("SELECT nextval('%s')" % self._seq_name(res['id']),
+                            debug=self._debug)
+            else:
+                # locks the row until the end of the transaction
                 cr.execute('UPDATE ir_sequence '
                         'SET number_next=number_next+number_increment '
-                        'WHERE id=%s AND active=%s', 
+                        'WHERE id=%s AND active=%s '
+                        'RETURNING number_next-number_increment',
                         (res['id'], True),
                         debug=self._debug)
-                if res['number_next']:
-                    return self._process(res['prefix']) + '%%0%sd' % res['padding'] % res['number_next'] + self._process(res['suffix'])
-                else:
-                    return self._process(res['prefix']) + self._process(res['suffix'])
-            
-            # end for
-        finally:
-            # cr.commit()
-            pass
+            number_next = cr.fetchone()
+            if not number_next:
+                # deactivated meanwhile
+                continue
+            number_next = number_next[0]
+            if number_next:
+                return self._process(res['prefix']) + '%%0%sd' % res['padding'] % number_next + self._process(res['suffix'])
+            else:
+                return self._process(res['prefix']) + self._process(res['suffix'])
         return False
 
     def get(self, cr, uid, code, context=None):
@@ -61,6 +61,7 @@ class ir_translation_import_cursor(object):
         self._context = context
         self._overwrite = context.get('overwrite', False)
         self._debug = parent._debug
+        self._parent = parent
         self._parent_table = parent._table
 
         # Note that Postgres will NOT inherit the constraints or indexes
@@ -151,9 +152,39 @@ class ir_translation_import_cursor(object):
             logger.debug("ir.translation.cursor:  %d entries now in ir.translation, %d common entries with tmp", c1, c)
 
         # Step 4: cleanup
+        cr.execute("SELECT DISTINCT lang FROM %s" % self._table_name)
+        for (lang,) in cr.fetchall():
+            self._parent.clear_cache(cr, lang)
+        self._parent._get_ids.clear_cache(cr.dbname)
         cr.execute("DROP TABLE %s" % self._table_name)
         return True
 
+class translation_table(object):
+    """ The terms (translations of all types but 'model') of one language
+        of a database, read at once and indexed the ways _get_source() looks
+        them up. Never modified: ir_translation._get_terms() reads a new one
+        once they changed.
+    """
+    def __init__(self, cr, lang):
+        self.lang = lang
+        self.terms = {}     # { (type, name, src): value }
+        self.by_src = {}    # { (type, src): value }
+        self.by_name = {}   # { (type, name): value }
+        cr.execute("SELECT type, name, src, value FROM ONLY ir_translation "
+                    "WHERE lang=%s AND type != 'model' "
+                    "AND value IS NOT NULL AND value <> ''", (lang,))
+        for tt, name, src, value in cr.fetchall():
+            self.terms.setdefault((tt, name, src), value)
+            self.by_src.setdefault((tt, src), value)
+            self.by_name.setdefault((tt, name), value)
+
+    def get_term(self, tt, name, src):
+        if src and not name:
+            return self.by_src.get((tt, src))
+        elif src:
+            return self.terms.get((tt, name, src))
+        return self.by_name.get((tt, name))
+
 class ir_translation(osv.osv):
     _name = "ir.translation"
     _log_access = False
@@ -177,6 +208,39 @@ class ir_translation(osv.osv):
         'Language code of translation item must be among known languages' ), ]
 
 
+    # Above that many record translations changed at once, all of them
+    # are dropped rather than each one
+    REFRESH_MAX = 100
+
+    @tools.cache(size=int(tools.config.get_misc('cache', 'translation_langs', 4)))
+    def _get_terms(self, cr, lang):
+        """ The translation_table of lang """
+        return translation_table(cr, lang)
+
+    def clear_cache(self, cr, lang=None):
+        """ Forget the terms held in memory, of lang or of all the languages
+        """
+        if lang:
+            self._get_terms.clear_cache(cr.dbname, lang)
+        else:
+            self._get_terms.clear_cache(cr.dbname)
+        self.pool.clear_view_cache(cr)
+
+    def _refresh_cache(self, cr, trans_list):
+        """ Forget the translations held in memory after the ones in
+            trans_list (dicts of name, type, lang, src and res_id) changed
+        """
+        if len(trans_list) > self.REFRESH_MAX:
+            self._get_ids.clear_cache(cr.dbname)
+        else:
+            for trans in trans_list:
+                if trans['type'] == 'model':
+                    self._get_ids.clear_cache(cr.dbname, None, trans['name'], trans['type'],
+                                              trans['lang'], [trans['res_id']])
+        for lang in set([trans['lang'] for trans in trans_list if trans['type'] != 'model']):
+            # labels of fields and views are translated in the view cache too
+            self.clear_cache(cr, lang)
+
     def _auto_init(self, cr, context=None):
         super(ir_translation, self)._auto_init(cr, context)
         cr.execute('SELECT indexname FROM pg_indexes WHERE indexname = %s', ('ir_translation_ltnr',))
@@ -213,20 +277,16 @@ class ir_translation(osv.osv):
         return translations
 
     def _set_ids(self, cr, uid, name, tt, lang, ids, value, src=None):
-        # clear the caches
-        tr = self._get_ids(cr, uid, name, tt, lang, ids)
-        for res_id in tr:
-            if tr[res_id]:
-                self._get_source.clear_cache(cr.dbname, uid, name, tt, lang, tr[res_id])
-        self._get_source.clear_cache(cr.dbname, uid, name, tt, lang)
-        self._get_ids.clear_cache(cr.dbname, uid, name, tt, lang, ids)
-
         cr.execute('DELETE FROM ir_translation ' \
                 'WHERE lang=%s ' \
                     'AND type=%s ' \
                     'AND name=%s ' \
-                    'AND res_id = ANY (%s)',
+                    'AND res_id = ANY (%s) ' \
+                'RETURNING src, res_id',
                 (lang,tt,name, ids), debug=self._debug)
+        # create() refreshes the new ones
+        self._refresh_cache(cr, [{'lang': lang, 'type': tt, 'name': name, 'src': old_src, 'res_id': res_id}
+                                    for old_src, res_id in set(cr.fetchall())])
         for id in ids:
             self.create(cr, uid, {
                 'lang':lang,
@@ -238,13 +298,15 @@ class ir_translation(osv.osv):
                 })
         return len(ids)
 
-    @tools.cache(skiparg=3)
     def _get_source(self, cr, uid, name, types, lang, source=None):
         """
         Returns the translation for the given combination of name, type, language
         and source. All values passed to this method should be unicode (not byte strings),
         especially ``source``.
 
+        The terms of each language are held in memory, see translation_table,
+        unless [cache] enable is off.
+
         :param name: identification of the term to translate, such as field name (optional if source is passed)
         :param types: single string defining type of term to translate (see ``type`` field on ir.translation), or sequence of allowed types (strings)
         :param lang: language code of the desired translation
@@ -261,6 +323,23 @@ class ir_translation(osv.osv):
             types = [types,]
         else:
             types = list(types)
+        if 'model' in types or not tools.config.get_misc('cache', 'enable', True):
+            # translations of records are not kept by term
+            return self._get_source_db(cr, uid, name, types, lang, source)
+        table = self._get_terms(cr, lang)
+        if name:
+            name = tools.ustr(name)
+        if source:
+            source = tools.ustr(source)
+        for tt in types:
+            trad = table.get_term(tt, name, source)
+            if trad:
+                return trad
+        return u''
+
+    def _get_source_db(self, cr, uid, name, types, lang, source=None):
+        """ _get_source(), straight from the database
+        """
         if source and not name:
             cr.execute_prepared('ir_trans_get_src0',
                     'SELECT value ' \
@@ -389,9 +468,7 @@ class ir_translation(osv.osv):
         if not context:
             context = {}
         ids = super(ir_translation, self).create(cursor, user, vals, context=context)
-        for trans_obj in self.read(cursor, user, [ids], ['name','type','res_id','src','lang'], context=context):
-            self._get_source.clear_cache(cursor.dbname, user, trans_obj['name'], trans_obj['type'], trans_obj['lang'], source=trans_obj['src'])
-            self._get_ids.clear_cache(cursor.dbname, user, trans_obj['name'], trans_obj['type'], trans_obj['lang'], [trans_obj['res_id']])
+        self._refresh_cache(cursor, self.read(cursor, user, [ids], ['name','type','src','lang','res_id'], context=context))
         return ids
 
     def write(self, cursor, user, ids, vals, context=None):
@@ -399,10 +476,9 @@ class ir_translation(osv.osv):
             context = {}
         if isinstance(ids, (int, long)):
             ids = [ids]
+        before = self.read(cursor, user, ids, ['name','type','src','lang','res_id'], context=context)
         result = super(ir_translation, self).write(cursor, user, ids, vals, context=context)
-        for trans_obj in self.read(cursor, user, ids, ['name','type','res_id','src','lang'], context=context):
-            self._get_source.clear_cache(cursor.dbname, user, trans_obj['name'], trans_obj['type'], trans_obj['lang'], source=trans_obj['src'])
-            self._get_ids.clear_cache(cursor.dbname, user, trans_obj['name'], trans_obj['type'], trans_obj['lang'], [trans_obj['res_id']])
+        self._refresh_cache(cursor, before + self.read(cursor, user, ids, ['name','type','src','lang','res_id'], context=context))
         return result
 
     def unlink(self, cursor, user, ids, context=None):
@@ -410,10 +486,9 @@ class ir_translation(osv.osv):
             context = {}
         if isinstance(ids, (int, long)):
             ids = [ids]
-        for trans_obj in self.read(cursor, user, ids, ['name','type','res_id','src','lang'], context=context):
-            self._get_source.clear_cache(cursor.dbname, user, trans_obj['name'], trans_obj['type'], trans_obj['lang'], source=trans_obj['src'])
-            self._get_ids.clear_cache(cursor.dbname, user, trans_obj['name'], trans_obj['type'], trans_obj['lang'], [trans_obj['res_id']])
+        before = self.read(cursor, user, ids, ['name','type','src','lang','res_id'], context=context)
         result = super(ir_translation, self).unlink(cursor, user, ids, context=context)
+        self._refresh_cache(cursor, before)
         return result
 
     def _get_import_cursor(self, cr, uid, context=None):
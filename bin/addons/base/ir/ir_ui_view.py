@@ -98,10 +98,16 @@ class view(osv.osv):
     ]
 
 
+    def create(self, cr, uid, vals, context=None):
+        result = super(view, self).create(cr, uid, vals, context)
+        self.pool.clear_view_cache(cr)
+        return result
+
     def write(self, cr, uid, ids, vals, context={}):
         if not isinstance(ids, (list, tuple)):
             ids = [ids]
         result = super(view, self).write(cr, uid, ids, vals, context)
+        self.pool.clear_view_cache(cr)
 
         # drop the corresponding view customizations (used for dashboards for example), otherwise
         # not all users would see the updated views
@@ -112,6 +118,11 @@ class view(osv.osv):
 
         return result
 
+    def unlink(self, cr, uid, ids, context=None):
+        result = super(view, self).unlink(cr, uid, ids, context)
+        self.pool.clear_view_cache(cr)
+        return result
+
     def graph_get(self, cr, uid, id, model, node_obj, conn_obj, src_node, des_node,label,scale,context=None):
         if not label:
             label = []
@@ -40,9 +40,10 @@ class workflow(osv.osv):
     def write(self, cr, user, ids, vals, context=None):
         if not context:
             context={}
+        res = super(workflow, self).write(cr, user, ids, vals, context=context)
         wf_service = netsvc.LocalService("workflow")
         wf_service.clear_cache(cr, user)
-        return super(workflow, self).write(cr, user, ids, vals, context=context)
+        return res
 
     def get_active_workitems(self, cr, uid, res, res_id, context=None):
 
@@ -106,9 +107,16 @@ class workflow(osv.osv):
     def create(self, cr, user, vals, context=None):
         if not context:
             context={}
+        res = super(workflow, self).create(cr, user, vals, context=context)
         wf_service = netsvc.LocalService("workflow")
         wf_service.clear_cache(cr, user)
-        return super(workflow, self).create(cr, user, vals, context=context)
+        return res
+
+    def unlink(self, cr, user, ids, context=None):
+        res = super(workflow, self).unlink(cr, user, ids, context=context)
+        wf_service = netsvc.LocalService("workflow")
+        wf_service.clear_cache(cr, user)
+        return res
 
 workflow()
 
@@ -140,6 +148,22 @@ class wkf_activity(osv.osv):
         'split_mode': 'XOR',
     }
 
+    # the workflow service keeps the activities and transitions in memory
+    def create(self, cr, user, vals, context=None):
+        res = super(wkf_activity, self).create(cr, user, vals, context=context)
+        netsvc.LocalService("workflow").clear_cache(cr, user)
+        return res
+
+    def write(self, cr, user, ids, vals, context=None):
+        res = super(wkf_activity, self).write(cr, user, ids, vals, context=context)
+        netsvc.LocalService("workflow").clear_cache(cr, user)
+        return res
+
+    def unlink(self, cr, user, ids, context=None):
+        res = super(wkf_activity, self).unlink(cr, user, ids, context=context)
+        netsvc.LocalService("workflow").clear_cache(cr, user)
+        return res
+
 wkf_activity()
 
 class wkf_transition(osv.osv):
@@ -167,6 +191,22 @@ class wkf_transition(osv.osv):
     _defaults = {
         'condition': 'True',
     }
+
+    # the workflow service keeps the activities and transitions in memory
+    def create(self, cr, user, vals, context=None):
+        res = super(wkf_transition, self).create(cr, user, vals, context=context)
+        netsvc.LocalService("workflow").clear_cache(cr, user)
+        return res
+
+    def write(self, cr, user, ids, vals, context=None):
+        res = super(wkf_transition, self).write(cr, user, ids, vals, context=context)
+        netsvc.LocalService("workflow").clear_cache(cr, user)
+        return res
+
+    def unlink(self, cr, user, ids, context=None):
+        res = super(wkf_transition, self).unlink(cr, user, ids, context=context)
+        netsvc.LocalService("workflow").clear_cache(cr, user)
+        return res
 wkf_transition()
 
 class wkf_instance(osv.osv):
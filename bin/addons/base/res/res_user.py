@@ -23,7 +23,14 @@
 from osv import fields,osv
 from osv.orm import browse_record, orm_deprecated
 import tools
+from tools.lru import LRU
 from functools import partial
+import hashlib
+import hmac
+import os
+import threading
+import time
+import sql_db
 import pytz
 import pooler
 from tools.translate import _
@@ -58,6 +65,8 @@ class groups(osv.osv):
                         _('The name of the group can not start with "-"'))
         res = super(groups, self).write(cr, uid, ids, vals, context=context)
         self.pool.get('ir.model.access').call_cache_clearing_methods(cr)
+        # the rules and the users of the groups may have changed
+        self.pool.get('ir.rule').clear_all_caches(cr)
         return res
 
     def create(self, cr, uid, vals, context=None):
@@ -74,6 +83,8 @@ class groups(osv.osv):
             aid = user_obj.browse(cr, 1, user_obj._get_admin_id(cr))
             if aid:
                 aid.write({'groups_id': [(4, gid)]})
+        if vals.get('users'):
+            self.pool.get('ir.model.access').call_cache_clearing_methods(cr)
         return gid
 
     def get_extended_interface_group(self, cr, uid, context=None):
@@ -114,9 +125,72 @@ def _lang_get(self, cr, uid, context=None):
 def _tz_get(self,cr,uid, context=None):
     return [(x, x) for x in pytz.all_timezones]
 
+class auth_cache(object):
+    """ The (uid, password) pairs recently checked, per database
+
+        At most [cache] auth_size users are kept per database, for [cache]
+        auth_timeout seconds. Only a keyed hash of the passwords is kept.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._secret = os.urandom(32)
+        self._size = int(tools.config.get_misc('cache', 'auth_size', 1000))
+        self._timeout = float(tools.config.get_misc('cache', 'auth_timeout', 600))
+        self._dbs = {}  # {db: LRU({uid: (digest, expiry)})}
+
+    def _digest(self, uid, passwd):
+        return hmac.new(self._secret, '%s:%s' % (uid, tools.ustr(passwd).encode('utf-8')),
+                        hashlib.sha256).digest()
+
+    def check(self, db, uid, passwd):
+        users = self._dbs.get(db)
+        if users is None:
+            return False
+        try:
+            digest, expiry = users[uid]
+        except KeyError:
+            return False
+        if expiry < time.time():
+            self.invalidate(db, [uid])
+            return False
+        return digest == self._digest(uid, passwd)
+
+    def add(self, db, uid, passwd):
+        self._lock.acquire()
+        try:
+            users = self._dbs.get(db)
+            if users is None:
+                users = self._dbs[db] = LRU(self._size)
+        finally:
+            self._lock.release()
+        users[uid] = (self._digest(uid, passwd), time.time() + self._timeout)
+
+    def invalidate(self, db, uids=None):
+        """ Forget the users uids of db, or all of them """
+        if uids is None:
+            self._dbs.pop(db, None)
+            return
+        users = self._dbs.get(db)
+        if users is None:
+            return
+        for uid in uids:
+            try:
+                del users[uid]
+            except KeyError:
+                pass
+
+    def notified(self, db, payload):
+        """ Listener of the 'res_users_auth' notifications, whose payload
+            is the comma-separated ids of the users (all of them if empty)
+        """
+        if payload:
+            self.invalidate(db, [int(uid) for uid in payload.split(',')])
+        else:
+            self.invalidate(db)
+
 class users(osv.osv):
     __admin_ids = {}
-    _uid_cache = {}
+    _auth_cache = auth_cache()
     _name = "res.users"
     _order = 'name'
 
@@ -381,6 +455,17 @@ class users(osv.osv):
         'menu_tips':True
     }
 
+    def __init__(self, pool, cr):
+        super(users, self).__init__(pool, cr)
+        if tools.config.get_misc('cache', 'notify', True):
+            # the passwords changed by the other processes
+            sql_db.listen(cr.dbname, 'res_users_auth', self._auth_cache.notified)
+
+    def _invalidate_auth(self, cr, ids):
+        """ Forget the passwords of ids, in all the processes """
+        self._auth_cache.invalidate(cr.dbname, ids)
+        cr.notify('res_users_auth', ','.join(map(str, ids)))
+
     @tools.cache()
     def company_get(self, cr, uid, uid2, context=None):
         return self._get_company(cr, uid, context=context, uid2=uid2)
@@ -405,25 +490,20 @@ class users(osv.osv):
 
         # clear caches linked to the users
         self.company_get.clear_cache(cr.dbname)
+        if 'company_id' in values or 'company_ids' in values:
+            self.pool.get('ir.sequence')._get_candidates.clear_cache(cr.dbname)
         self.pool.get('ir.model.access').call_cache_clearing_methods(cr)
         clear = partial(self.pool.get('ir.rule').clear_cache, cr)
         map(clear, ids)
-        db = cr.dbname
-        if db in self._uid_cache:
-            for id in ids:
-                if id in self._uid_cache[db]:
-                    del self._uid_cache[db][id]
+        if 'password' in values or 'active' in values:
+            self._invalidate_auth(cr, ids)
 
         return res
 
     def unlink(self, cr, uid, ids, context=None):
         if 1 in ids:
             raise osv.except_osv(_('Can not remove root user!'), _('You can not remove the admin user as it is used internally for resources created by OpenERP (updates, module installation, ...)'))
-        db = cr.dbname
-        if db in self._uid_cache:
-            for id in ids:
-                if id in self._uid_cache[db]:
-                    del self._uid_cache[db][id]
+        self._invalidate_auth(cr, ids)
         return super(users, self).unlink(cr, uid, ids, context=context)
 
     def name_search(self, cr, user, name='', args=None, operator='ilike', context=None, limit=100):
@@ -516,7 +596,7 @@ class users(osv.osv):
         if not passwd:
             # empty passwords disallowed for obvious security reasons
             raise security.ExceptionNoTb('AccessDenied')
-        if self._uid_cache.get(db, {}).get(uid) == passwd:
+        if self._auth_cache.check(db, uid, passwd):
             return True
         cr = pooler.get_db(db).cursor()
         try:
@@ -525,11 +605,7 @@ class users(osv.osv):
             res = cr.fetchone()
             if not (res and res[0]):
                 raise security.ExceptionNoTb('AccessDenied')
-            if self._uid_cache.has_key(db):
-                ulist = self._uid_cache[db]
-                ulist[uid] = passwd
-            else:
-                self._uid_cache[db] = {uid:passwd}
+            self._auth_cache.add(db, uid, passwd)
             return True
         finally:
             cr.close()
@@ -639,7 +715,9 @@ class groups2(osv.osv):
                         _('Group(s) %s cannot be deleted, because some user(s) still belong to them: %s !') % \
                             ( ', '.join(['"%s"' % g for g in group_names]),
                                 ', '.join(user_names)))
-        return super(groups2, self).unlink(cr, uid, ids, context=context)
+        res = super(groups2, self).unlink(cr, uid, ids, context=context)
+        self.pool.get('ir.rule').clear_all_caches(cr)
+        return res
 
 groups2()
 
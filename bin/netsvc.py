@@ -537,7 +537,9 @@ class Agent(object):
     @classmethod
     def runner(cls):
         """Neverending function (intended to be ran in a dedicated thread) that
-           checks every 60 seconds tasks to run. TODO: make configurable
+           starts each task in a thread of its own when it is due. It sleeps
+           until the next task, at most 600 seconds, and is woken up by
+           setAlarm() and cancel().
         """
         def pretty_args(args, kwargs, trunc=None):
             """ Format the arguments like we would write them at python
@@ -590,7 +592,6 @@ class Agent(object):
                 thr = threading.Thread(target=function, args=args, kwargs=kwargs)
                 thr.setDaemon(True)
                 thr.start()
-                time.sleep(1)
                 thr = None
                 cls._lock.acquire()
             
@@ -598,8 +599,8 @@ class Agent(object):
             wtime = 600.0
             if cls.__tasks:
                 wtime = cls.__tasks[0][0] - time.time()
-                if wtime < 1.0:
-                    wtime = 1.0
+                if wtime < 0.0:
+                    wtime = 0.0
                 elif wtime > 600.0:
                     wtime = 600.0
             cls._logger.debug("sleeping for %.3f seconds", wtime)
@@ -607,6 +608,118 @@ class Agent(object):
             cls._lock.release()
         cls._logger.debug("thread ended")
 
+class WorkerPool(object):
+    """ A fixed number of threads running the functions queued to them
+
+        Each function is queued under a key, at most `limit` times: that
+        many calls of the same key may be queued or running at once. The
+        pool keeps the count and the run times of the calls of each key.
+
+        The threads are started on the first call queued. They are daemon
+        threads: what they run must not need to complete at exit.
+    """
+    __pools = []
+    _logger = logging.getLogger('netsvc.workers')
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = max(int(size), 1)
+        self._lock = threading.Condition()
+        self._queue = []
+        self._busy = {}        # {key: calls queued or running}
+        self._running = 0
+        self._threads = []
+        #: {key: [label, runs, failures, total time, max time, last time, last start]}
+        self._stats = {}
+        WorkerPool.__pools.append(self)
+
+    def submit(self, key, limit, label, function, *args, **kwargs):
+        """ Queue function(*args, **kwargs), unless limit calls of key are
+            already queued or running
+
+            label names key in the statistics. A call fails when function
+            raises or returns False.
+
+            @return whether the call was queued
+        """
+        self._lock.acquire()
+        try:
+            if self._busy.get(key, 0) >= max(limit, 1):
+                return False
+            self._busy[key] = self._busy.get(key, 0) + 1
+            self._queue.append((key, label, function, args, kwargs))
+            while len(self._threads) < self.size:
+                thr = threading.Thread(target=self._work,
+                        name='netsvc.WorkerPool.%s.%d' % (self.name, len(self._threads)))
+                thr.setDaemon(True)
+                thr.start()
+                self._threads.append(thr)
+            self._lock.notify()
+            return True
+        finally:
+            self._lock.release()
+
+    def busy(self, key):
+        """ The number of calls of key queued or running """
+        return self._busy.get(key, 0)
+
+    def _work(self):
+        while True:
+            self._lock.acquire()
+            try:
+                while not self._queue:
+                    self._lock.wait()
+                key, label, function, args, kwargs = self._queue.pop(0)
+                self._running += 1
+            finally:
+                self._lock.release()
+
+            start = time.time()
+            ok = False
+            try:
+                ok = function(*args, **kwargs) is not False
+            except Exception:
+                self._logger.exception("%s: %s failed", self.name, label)
+            duration = time.time() - start
+
+            self._lock.acquire()
+            try:
+                self._running -= 1
+                self._busy[key] -= 1
+                if not self._busy[key]:
+                    del self._busy[key]
+                st = self._stats.setdefault(key, [label, 0, 0, 0.0, 0.0, 0.0, 0.0])
+                st[0] = label
+                st[1] += 1
+                if not ok:
+                    st[2] += 1
+                st[3] += duration
+                st[4] = max(st[4], duration)
+                st[5] = duration
+                st[6] = start
+            finally:
+                self._lock.release()
+            self._logger.debug("%s: %s done in %.3fs", self.name, label, duration)
+
+    def stats(self):
+        """ Return a human-readable summary of the pool and of its calls """
+        self._lock.acquire()
+        try:
+            res = "Worker pool %s: %d threads, %d running, %d queued\n" % \
+                    (self.name, len(self._threads), self._running, len(self._queue))
+            for key, st in sorted(self._stats.items(), key=lambda x: x[1][0]):
+                res += "    %s: %d runs (%d failed, %d running), time: avg %.3fs, max %.3fs, last %.3fs at %s\n" % \
+                        (st[0], st[1], st[2], self._busy.get(key, 0),
+                         st[3] / st[1], st[4], st[5],
+                         time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(st[6])))
+            return res
+        finally:
+            self._lock.release()
+
+    @classmethod
+    def allStats(cls):
+        return ''.join([pool.stats() for pool in cls.__pools])
+
 agent_runner = threading.Thread(target=Agent.runner, name="netsvc.Agent.runner")
 # the agent runner is a typical daemon thread, that will never quit and must be
 # terminated when the main process exits - with no consequence (the processing
@@ -44,6 +44,7 @@
 import calendar
 import copy
 import datetime
+import hashlib
 import logging
 import warnings
 import operator
@@ -101,6 +102,10 @@ AUTO_SELECT_COLS = 4
 """ Columns of table to prefetch by default
 """
 
+ITER_CHUNK_SIZE = 1000
+""" Records fetched at a time by search_read_iter() and export_data()
+"""
+
 # not used yet AUTO_SELECT_WRAP = 1000000 # prevent integer overflow, wrap at that num.
 
 def last_day_of_current_month():
@@ -572,6 +577,56 @@ def get_pg_type(f):
     return f_type
 
 
+class StoreQueue(object):
+    """ Deferred recomputation of stored function fields, for one cursor
+
+        The triggers returned by orm._store_get_values() are accumulated
+        per (model, fields), with their ids merged, so that a loop of writes
+        recomputes each record only once. The cursor flushes the queue
+        before it commits, and the ORM flushes the part of it a read or
+        search depends on.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self._todo = {}     # { (priority, model, fields): set(ids) }
+        self._context = None
+
+    def __nonzero__(self):
+        return bool(self._todo)
+
+    def add(self, result, context=None):
+        for order, object, ids, fields in result:
+            fields = list(fields)
+            fields.sort()
+            self._todo.setdefault((order, object, tuple(fields)), set()).update(ids)
+        if self._context is None:
+            self._context = context
+
+    def pending(self, model, fields=None):
+        """ Tell whether stored fields of model (among fields, if given) are
+            waiting to be recomputed
+        """
+        for order, object, store_fields in self._todo:
+            if object == model and (fields is None or intersect(store_fields, fields)):
+                return True
+        return False
+
+    def flush(self, cr):
+        """ Recompute all the queued fields, by priority
+        """
+        while self._todo:
+            todo = self._todo.items()
+            todo.sort()
+            self._todo = {}
+            for (order, object, fields), ids in todo:
+                obj = self.pool.get(object)
+                # some of the records may have been deleted meanwhile
+                cr.execute('SELECT id FROM "' + obj._table + '" WHERE id = ANY(%s)', (list(ids),))
+                rids = [x[0] for x in cr.fetchall()]
+                if rids:
+                    obj._store_set_values(cr, 1, rids, list(fields), self._context or {})
+        self._context = None
+
 class orm_template(object):
     """ THE base of all ORM models
     """
@@ -620,46 +675,52 @@ class orm_template(object):
     def read_group(self, cr, uid, domain, fields, groupby, offset=0, limit=None, context=None, orderby=False):
         raise NotImplementedError(_('The read_group method is not implemented on this object !'))
 
-    def _field_create(self, cr, context=None):
+    def _schema(self, cr):
+        """ The schema snapshot shared by the current module load, or a new
+            one of this model only (eg. when a custom field is added)
+        """
+        schema = getattr(self.pool, 'schema', None)
+        if schema is None:
+            schema = tools.SchemaSnapshot()
+            schema.load(cr, model=self._name, table=self._table)
+        else:
+            schema.load(cr)
+        return schema
+
+    def _field_create(self, cr, context=None, schema=None):
         if context is None:
             context = {}
-        cr.execute("SELECT id FROM ir_model WHERE model=%s", (self._name,), debug=self._debug)
-        if not cr.rowcount:
+        if schema is None:
+            schema = self._schema(cr)
+        model_id = schema.models.get(self._name)
+        if not model_id:
             cr.execute("INSERT INTO ir_model (model, name, info, state) "
                         "VALUES (%s, %s, %s, %s) "
                         "RETURNING id",
                 (self._name, self._description, self.__doc__, 'base'),
                 debug=self._debug)
-            model_id = cr.fetchone()[0]
-        else:
-            model_id = cr.fetchone()[0]
+            model_id = schema.models[self._name] = cr.fetchone()[0]
         if self._debug:
             _logger.debug("Field create for %s.%s", context.get('module','<module>'), self._name)
     
         if 'module' in context:
             name_id = 'model_'+self._name.replace('.','_')
-            cr.execute('SELECT id FROM ir_model_data '
-                "WHERE name=%s AND model = 'ir.model' AND res_id=%s "
-                " AND module=%s",
-                (name_id, model_id, context['module']))
+            data_key = (context['module'], 'ir.model', name_id, model_id)
 
             # We do allow multiple modules to have references to the same model
             # through ir.model.data . This, however, would never break those
             # who belong to an earlier module, which now doesn't contain that
             # model. Almost harmless, because the reference will point to the 
             # right model (BUT may behave different at next db installation!).
-            if not cr.rowcount:
+            if data_key not in schema.model_data:
                 cr.execute("INSERT INTO ir_model_data (name,date_init,date_update,module,model,res_id) VALUES (%s, now(), now(), %s, %s, %s)", \
                     (name_id, context['module'], 'ir.model', model_id), debug=self._debug)
+                schema.model_data.add(data_key)
 
         cr.commit()
 
-        cr.execute("SELECT * FROM ir_model_fields WHERE model=%s", (self._name,) , 
-                        debug=self._debug)
-        cols = {}
-        for rec in cr.dictfetchall():
-            cols[rec['name']] = rec
-
+        cols = schema.model_fields.setdefault(self._name, {})
+        to_update = []
         for (k, f) in self._columns.items():
             vals = {
                 'model_id': model_id,
@@ -695,16 +756,19 @@ class orm_template(object):
                     debug=self._debug)
                 id = cr.fetchone()[0]
                 vals['id'] = id
+                # as in the table: readonly, required and selectable are not set
+                cols[k] = dict(vals, state='base', readonly=None, required=None,
+                                selectable=None)
                 if 'module' in context:
                     name1 = 'field_' + self._table + '_' + k
-                    cr.execute("select name from ir_model_data where name=%s", 
-                        (name1,), debug=self._debug)
-                    if cr.fetchone():
+                    if name1 in schema.data_names:
                         name1 = name1 + "_" + str(id)
                     cr.execute("INSERT INTO ir_model_data (name,date_init,date_update,module,model,res_id)"
                                "VALUES (%s, now(), now(), %s, %s, %s)", \
                                (name1, context['module'], 'ir.model.fields', id),
                                debug=self._debug )
+                    schema.model_data.add((context['module'], 'ir.model.fields', name1, id))
+                    schema.data_names.add(name1)
             else:
                 if self._debug:
                     _logger.debug("Field %s.%s found in db", self._name, k)
@@ -712,26 +776,64 @@ class orm_template(object):
                     if cols[k][key] != vals[key]:
                         if self._debug:
                             _logger.debug("Column %s[%s] differs: %r != %r", k, key, cols[k][key], vals[key])
-                        # cr.execute('UPDATE ir_model_fields SET field_description=%s WHERE model=%s AND name=%s', (vals['field_description'], vals['model'], vals['name']))
-                        # cr.commit()
-                        cr.execute("UPDATE ir_model_fields SET "
-                            "model_id=%s, field_description=%s, ttype=%s, relation=%s, "
-                            "view_load=%s, select_level=%s, readonly=%s ,required=%s,  "
-                            "selectable=%s, relation_field=%s, translate=%s "
-                            " WHERE model=%s AND name=%s", 
-                            ( vals['model_id'], vals['field_description'], vals['ttype'],
-                                vals['relation'], 
-                                vals['view_load'], vals['select_level'], vals['readonly'],vals['required'],
-                                vals['selectable'],vals['relation_field'], vals['translate'],
-                                vals['model'], vals['name'] ),
-                                debug=self._debug)
+                        to_update.append(vals)
+                        cols[k].update(vals)
                         # Don't check any more attributes, we're up-to-date now.
                         break
+
+        # all the changed fields of the model, in one query
+        for sub_update in tools.misc.split_every(cr.IN_MAX, to_update):
+            params = []
+            for vals in sub_update:
+                params.extend([vals['model_id'], vals['field_description'], vals['ttype'],
+                               vals['relation'], vals['view_load'], vals['select_level'],
+                               vals['readonly'], vals['required'], vals['selectable'],
+                               vals['relation_field'], vals['translate'], vals['name']])
+            cr.execute("UPDATE ir_model_fields SET "
+                "model_id=v.model_id, field_description=v.field_description, ttype=v.ttype, "
+                "relation=v.relation, view_load=v.view_load, select_level=v.select_level, "
+                "readonly=v.readonly, required=v.required, selectable=v.selectable, "
+                "relation_field=v.relation_field, translate=v.translate "
+                "FROM (VALUES " + ', '.join(["(%s::int4, %s, %s, %s, %s::bool, %s, "
+                                            "%s::bool, %s::bool, %s::bool, %s, %s::bool, %s)"] * len(sub_update)) +
+                ") AS v(model_id, field_description, ttype, relation, view_load, select_level, "
+                "       readonly, required, selectable, relation_field, translate, name) "
+                "WHERE ir_model_fields.model=%s AND ir_model_fields.name=v.name",
+                params + [self._name],
+                debug=self._debug)
         cr.commit()
 
     def _auto_init(self, cr, context=None):
         self._field_create(cr, context=context)
 
+    def _fingerprint(self):
+        """ A digest of the definitions _auto_init() builds the table and the
+            ir_model_fields rows from: when it is unchanged, so are they
+        """
+        cols = []
+        for k, f in sorted(self._columns.items()):
+            desc = [k, f.__class__.__name__, f._type, f.string, f._obj, f.view_load,
+                    f.select, f.readonly, f.required, f.selectable, f.translate,
+                    getattr(f, 'ondelete', None), getattr(f, 'oldname', None),
+                    getattr(f, 'nodrop', False), getattr(f, '_fields_id', None),
+                    getattr(f, '_rel', None), getattr(f, '_id1', None), getattr(f, '_id2', None)]
+            if isinstance(f, fields.function):
+                # the functions themselves don't matter, only what triggers them
+                store = f.store
+                if isinstance(store, dict):
+                    store = sorted([(obj, tuple(spec[1:])) for obj, spec in store.items()])
+                desc.append(store)
+            if (not isinstance(f, fields.function) or f.store) \
+                    and f._type not in ('one2many', 'many2many'):
+                desc.append(get_pg_type(f))
+            cols.append(desc)
+        data = [self._name, self._table, self._description, getattr(self, '_auto', True),
+                getattr(self, '_log_access', None), self._parent_store, self._parent_name,
+                sorted(self._inherits.items()), self._vtable, getattr(self, '_sql', None),
+                [(key, con) for key, con, msg in getattr(self, '_sql_constraints', [])],
+                cols]
+        return hashlib.md5(repr(data)).hexdigest()
+
     def __init__(self, cr):
         if not self._name and not hasattr(self, '_inherit'):
             name = type(self).__name__.split('.')[0]
@@ -945,20 +1047,40 @@ class orm_template(object):
         """
         if context is None:
             context = {}
-        cols = self._columns.copy()
-        for f in self._inherit_fields:
-            cols.update({f: self._inherit_fields[f][2]})
+        return {'datas': list(self._export_rows(cr, uid, ids, fields_to_export, context))}
+
+    def export_data_iter(self, cr, uid, domain, fields_to_export, order=None, context=None):
+        """
+        Same as :py:meth:`export_data`, for the records matching domain, but
+        return a generator of the rows: the ids are streamed by
+        :py:meth:`search_read_iter`, for exports too big to be held in memory.
+
+        The cursor must not be committed until the generator is exhausted.
+        """
+        if context is None:
+            context = {}
+        ids = (r['id'] for r in self.search_read_iter(cr, uid, domain, order=order,
+                                    fields=['id'], context=context))
+        return self._export_rows(cr, uid, ids, fields_to_export, context)
+
+    def _export_rows(self, cr, uid, ids, fields_to_export, context):
+        """ Yield the rows of export_data() for ids, which may be any iterable
+
+        The records are browsed ITER_CHUNK_SIZE at a time, and the record
+        cache of the cursor is emptied after each chunk, so that neither
+        holds all the exported records (and their related ones).
+        """
         def fsplit(x):
             if x=='.id': return [x]
             return x.replace(':id','/id').replace('.id','/.id').split('/')
         fields_to_export = map(fsplit, fields_to_export)
-        fields_export = fields_to_export + []
-        warning = ''
-        warning_fields = []
-        datas = []
-        for row in self.browse(cr, uid, ids, context):
-            datas += self.__export_row(cr, uid, row, fields_to_export, context)
-        return {'datas': datas}
+        for chunk in tools.misc.split_every(ITER_CHUNK_SIZE, ids, list):
+            for row in self.browse(cr, uid, chunk, context):
+                for line in self.__export_row(cr, uid, row, fields_to_export, context):
+                    yield line
+            rcache = getattr(cr, 'record_cache', None)
+            if rcache:
+                rcache.clear()
 
     def import_data(self, cr, uid, fields, datas, mode='init', current_module='', noupdate=False, context=None, filename=None):
         """ Import given data in given module
@@ -1144,8 +1266,32 @@ class orm_template(object):
             data = pickle.load(file(config.get('import_partial')))
             original_value = data.get(filename, 0)
 
+        # Lines that just create new records (no xml or database id) are
+        # buffered and then created together through create_multi(). If
+        # that fails, the transaction is rolled back and the lines are
+        # imported again one by one from the last commit, so that the
+        # error tells the line at fault.
+        batch_size = int(config.get_misc('import', 'batch_size', 100))
+        batch = []
+        def _flush_batch():
+            rows = batch[:]
+            del batch[:]
+            try:
+                self.create_multi(cr, uid, rows, context=context)
+            except Exception:
+                logger.debug('Creating %d imported records at once failed, '
+                             'importing them one by one', len(rows), exc_info=True)
+                cr.rollback()
+                return False
+            return True
+
+        committed = 0
         position = 0
-        while position<len(datas):
+        while position<len(datas) or batch:
+            if position >= len(datas):
+                if not _flush_batch():
+                    position, batch_size = committed, 0
+                continue
             res = {}
 
             (res, position, warning, res_id, xml_id) = \
@@ -1154,20 +1300,34 @@ class orm_template(object):
                 cr.rollback()
                 return (-1, res, 'Line ' + str(position) +' : ' + '!\n'.join(warning), '')
 
-            try:
-                id = ir_model_data_obj._update(cr, uid, self._name,
-                     current_module, res, mode=mode, xml_id=xml_id,
-                     noupdate=noupdate, res_id=res_id, context=context)
-            except Exception, e:
-                return (-1, res, 'Line ' + str(position) +' : ' + tools.ustr(e), '')
+            if batch_size > 1 and mode == 'init' and ir_model_data_obj.doinit \
+                    and not (xml_id or res_id):
+                batch.append(res)
+                if len(batch) >= batch_size and not _flush_batch():
+                    position, batch_size = committed, 0
+                    continue
+            else:
+                if batch and not _flush_batch():
+                    position, batch_size = committed, 0
+                    continue
+                try:
+                    id = ir_model_data_obj._update(cr, uid, self._name,
+                         current_module, res, mode=mode, xml_id=xml_id,
+                         noupdate=noupdate, res_id=res_id, context=context)
+                except Exception, e:
+                    return (-1, res, 'Line ' + str(position) +' : ' + tools.ustr(e), '')
 
             if config.get('import_partial', False) and filename and (not (position%100)):
+                if batch and not _flush_batch():
+                    position, batch_size = committed, 0
+                    continue
                 data = pickle.load(file(config.get('import_partial')))
                 data[filename] = position
                 pickle.dump(data, file(config.get('import_partial'),'wb'))
                 if context.get('defer_parent_store_computation'):
                     self._parent_store_compute(cr)
                 cr.commit()
+                committed = position
 
         if context.get('defer_parent_store_computation'):
             self._parent_store_compute(cr)
@@ -1215,6 +1375,29 @@ class orm_template(object):
         """
         raise NotImplementedError(_('The search_read method is not implemented on this object !'))
 
+    def search_read_iter(self, cr, user, domain, offset=0, limit=None, order=None, fields=None,
+                         context=None, load='_classic_read', chunk_size=None):
+        """
+        Same as :py:meth:`search_read`, but return a generator of the records,
+        for results too big to be held in memory at once.
+
+        This generic version searches all the ids at once, then reads them
+        chunk_size (default: ITER_CHUNK_SIZE) at a time.
+
+        :param chunk_size: number of records to read at a time
+        """
+        chunk_size = chunk_size or ITER_CHUNK_SIZE
+        ids = self.search(cr, user, domain, offset=offset, limit=limit, order=order,
+                          context=context)
+        for i in range(0, len(ids), chunk_size):
+            sub_ids = ids[i:i+chunk_size]
+            result = self.read(cr, user, sub_ids, fields, context=context, load=load)
+            # keep the order of the search
+            positions = dict([(id, pos) for pos, id in enumerate(sub_ids)])
+            result.sort(key=lambda r: positions[r['id']])
+            for r in result:
+                yield r
+
     def get_invalid_fields(self, cr, uid):
         return list(self._invalids)
 
@@ -1383,6 +1566,25 @@ class orm_template(object):
     def create(self, cr, user, vals, context=None):
         raise NotImplementedError(_('The create method is not implemented on this object !'))
 
+    def write_multi(self, cr, user, id_vals, context=None):
+        """ Write, for each {id: vals} item of id_vals, vals on that record
+
+            Objects may implement that more efficiently, this one just
+            calls write() in turn.
+        """
+        for id, vals in id_vals.items():
+            self.write(cr, user, [int(id)], vals, context=context)
+        return True
+
+    def create_multi(self, cr, user, vals_list, context=None):
+        """ Create one record for each of the vals_list dictionaries
+
+            Objects may implement that more efficiently, this one just
+            calls create() in turn.
+            @return the list of new ids, in the order of vals_list
+        """
+        return [self.create(cr, user, vals, context=context) for vals in vals_list]
+
     def fields_get_keys(self, cr, user, context=None):
         res = self._columns.keys()
         for parent in self._inherits:
@@ -1806,6 +2008,63 @@ class orm_template(object):
     #
     # if view_id, view_type is not required
     #
+    def _view_cache_key(self, cr, user, view_id, view_type, context):
+        """ Key of the result of fields_view_get() in the view cache of the
+            pool, or None when the view must be computed at every call.
+
+            Besides the view itself, the result depends on the language and
+            on the groups of the user (field and button groups, write access)
+        """
+        if self.pool.view_cache is None:
+            return None
+        view_ref = None
+        if not view_id:
+            view_ref = context.get(view_type + '_view_ref', None)
+        cr.execute('SELECT gid FROM res_groups_users_rel WHERE uid=%s ORDER BY gid',
+                    (user,), debug=self._debug)
+        gids = tuple([r[0] for r in cr.fetchall()])
+        return (self._name, view_id or False, view_type, view_ref,
+                context.get('lang', False), user == 1, gids)
+
+    def _view_dynamic_fields(self, fields_def):
+        """ Find the fields of a view result whose attributes cannot be kept
+
+            :return: list of (model, column, attributes) for the fields that
+                     have a dynamic selection, or None if the view as a
+                     whole cannot be cached
+        """
+        cls = self.__class__
+        if cls.view_header_get.im_func is not orm_template.view_header_get.im_func \
+                or cls.fields_get.im_func not in (orm_template.fields_get.im_func, orm.fields_get.im_func):
+            # overridden, the result may depend on the context
+            return None
+        res = []
+        for name, attrs in fields_def.items():
+            if name == 'id':
+                continue
+            if name in self._columns:
+                model, column = self, self._columns[name]
+            elif name in self._inherit_fields:
+                model = self.pool.get(self._inherit_fields[name][0])
+                column = self._inherit_fields[name][2]
+            else:
+                # field of another model, eg. a diagram node
+                return None
+            if attrs.get('relation') and 'selection' in attrs:
+                # widget="selection", the records are searched for
+                return None
+            if callable(getattr(column, 'selection', None)):
+                res.append((model, column, attrs))
+            for view in attrs.get('views', {}).values():
+                relation = self.pool.get(attrs.get('relation'))
+                if relation is None:
+                    return None
+                sub_res = relation._view_dynamic_fields(view.get('fields', {}))
+                if sub_res is None:
+                    return None
+                res.extend(sub_res)
+        return res
+
     def fields_view_get(self, cr, user, view_id=None, view_type='form', context=None, toolbar=False, submenu=False):
         """
         Get the detailed composition of the requested view like fields, model, view architecture
@@ -1823,6 +2082,86 @@ class orm_template(object):
                             * if some tag other than 'position' is found in parent view
         :raise Invalid ArchitectureError: if there is view type other than form, tree, calendar, search etc defined on the structure
 
+        """
+        if not context:
+            context = {}
+
+        key = self._view_cache_key(cr, user, view_id, view_type, context)
+        cached = None
+        if key is not None:
+            try:
+                cached = self.pool.view_cache[key]
+            except KeyError:
+                pass
+        if cached is not None:
+            result, dynamic = copy.deepcopy(cached)
+            if dynamic:
+                for model, column, attrs in self._view_dynamic_fields(result['fields']):
+                    attrs['selection'] = column.selection(model, cr, user, context)
+        else:
+            result = self._fields_view_get_arch(cr, user, view_id, view_type, context)
+            if key is not None:
+                dynamic = self._view_dynamic_fields(result['fields'])
+                if dynamic is not None and result['type'] != 'diagram':
+                    self.pool.view_cache[key] = (copy.deepcopy(result), bool(dynamic))
+
+        if submenu:
+            if context and context.get('active_id', False):
+                data_menu = self.pool.get('ir.ui.menu').browse(cr, user, context['active_id'], context).action
+                if data_menu:
+                    act_id = data_menu.id
+                    if act_id:
+                        data_action = self.pool.get('ir.actions.act_window').browse(cr, user, [act_id], context)[0]
+                        result['submenu'] = getattr(data_action, 'menus', False)
+        if toolbar:
+            def clean(x):
+                x = x[2]
+                for key in ('report_sxw_content', 'report_rml_content',
+                        'report_sxw', 'report_rml',
+                        'report_sxw_content_data', 'report_rml_content_data'):
+                    if key in x:
+                        del x[key]
+                return x
+            ir_values_obj = self.pool.get('ir.values')
+            resprint = ir_values_obj.get(cr, user, 'action',
+                    'client_print_multi', [(self._name, False)], False,
+                    context)
+            resaction = ir_values_obj.get(cr, user, 'action',
+                    'client_action_multi', [(self._name, False)], False,
+                    context)
+
+            resrelate = ir_values_obj.get(cr, user, 'action',
+                    'client_action_relate', [(self._name, False)], False,
+                    context)
+
+            if self._debug:
+                if resprint:
+                    logging.getLogger('orm').debug('%s: client_print_multi actions: %r', self._name,
+                            [ '%s: %s' % (x[0], x[1]) for x in resprint])
+                if resaction:
+                    logging.getLogger('orm').debug('%s: client_action_multi actions: %r', self._name,
+                            [ '%s: %s' % (x[0], x[1]) for x in resaction])
+                if resrelate:
+                    logging.getLogger('orm').debug('%s: client_action_relate actions: %r', self._name,
+                            [ '%s: %s' % (x[0], x[1]) for x in resrelate])
+            resprint = map(clean, resprint)
+            resaction = map(clean, resaction)
+            resaction = filter(lambda x: not x.get('multi', False), resaction)
+            resprint = filter(lambda x: not x.get('multi', False), resprint)
+            resrelate = map(lambda x: x[2], resrelate)
+
+            for x in resprint + resaction + resrelate:
+                x['string'] = x['name']
+
+            result['toolbar'] = {
+                'print': resprint,
+                'action': resaction,
+                'relate': resrelate
+            }
+        return result
+
+    def _fields_view_get_arch(self, cr, user, view_id=None, view_type='form', context=None):
+        """ Compute the architecture and fields of a view for fields_view_get()
         """
         if not context:
             context = {}
@@ -2115,60 +2454,6 @@ class orm_template(object):
         xarch, xfields = self.__view_look_dom_arch(cr, user, result['arch'], view_id, context=ctx)
         result['arch'] = xarch
         result['fields'] = xfields
-
-        if submenu:
-            if context and context.get('active_id', False):
-                data_menu = self.pool.get('ir.ui.menu').browse(cr, user, context['active_id'], context).action
-                if data_menu:
-                    act_id = data_menu.id
-                    if act_id:
-                        data_action = self.pool.get('ir.actions.act_window').browse(cr, user, [act_id], context)[0]
-                        result['submenu'] = getattr(data_action, 'menus', False)
-        if toolbar:
-            def clean(x):
-                x = x[2]
-                for key in ('report_sxw_content', 'report_rml_content',
-                        'report_sxw', 'report_rml',
-                        'report_sxw_content_data', 'report_rml_content_data'):
-                    if key in x:
-                        del x[key]
-                return x
-            ir_values_obj = self.pool.get('ir.values')
-            resprint = ir_values_obj.get(cr, user, 'action',
-                    'client_print_multi', [(self._name, False)], False,
-                    context)
-            resaction = ir_values_obj.get(cr, user, 'action',
-                    'client_action_multi', [(self._name, False)], False,
-                    context)
-
-            resrelate = ir_values_obj.get(cr, user, 'action',
-                    'client_action_relate', [(self._name, False)], False,
-                    context)
-
-            if self._debug:
-                if resprint:
-                    logging.getLogger('orm').debug('%s: client_print_multi actions: %r', self._name,
-                            [ '%s: %s' % (x[0], x[1]) for x in resprint])
-                if resaction:
-                    logging.getLogger('orm').debug('%s: client_action_multi actions: %r', self._name,
-                            [ '%s: %s' % (x[0], x[1]) for x in resaction])
-                if resrelate:
-                    logging.getLogger('orm').debug('%s: client_action_relate actions: %r', self._name,
-                            [ '%s: %s' % (x[0], x[1]) for x in resrelate])
-            resprint = map(clean, resprint)
-            resaction = map(clean, resaction)
-            resaction = filter(lambda x: not x.get('multi', False), resaction)
-            resprint = filter(lambda x: not x.get('multi', False), resprint)
-            resrelate = map(lambda x: x[2], resrelate)
-
-            for x in resprint + resaction + resrelate:
-                x['string'] = x['name']
-
-            result['toolbar'] = {
-                'print': resprint,
-                'action': resaction,
-                'relate': resrelate
-            }
         return result
 
     _view_look_dom_arch = __view_look_dom_arch
@@ -2338,7 +2623,7 @@ class orm_template(object):
                 self.pool.get(table).write_string(cr, uid, id, langs, vals, context)
         return True
 
-    def _check_removed_columns(self, cr, log=False):
+    def _check_removed_columns(self, cr, log=False, schema=None):
         raise NotImplementedError()
 
     def _add_missing_default_values(self, cr, uid, values, context=None):
@@ -2669,7 +2954,7 @@ class orm_memory(orm_template):
             })
         return result
 
-    def _check_removed_columns(self, cr, log=False):
+    def _check_removed_columns(self, cr, log=False, schema=None):
         # nothing to check in memory...
         pass
 
@@ -2986,27 +3271,25 @@ class orm(orm_template):
         raise except_orm(_('ValidateError'),
                          _('The value "%s" for the field "%s" is not in the selection') % (value, field))
 
-    def _check_removed_columns(self, cr, log=False):
+    def _check_removed_columns(self, cr, log=False, schema=None):
         # iterate on the database columns to drop the NOT NULL constraints
         # of fields which were required but have been removed (or will be added by another module)
         columns = [c for c in self._columns if not (isinstance(self._columns[c], fields.function) and not self._columns[c].store)]
         columns += ('id', 'write_uid', 'write_date', 'create_uid', 'create_date') # openerp access columns
         if self._vtable:
             columns.append('_vptr')
-        cr.execute("SELECT a.attname, a.attnotnull"
-                   "  FROM pg_class c, pg_attribute a"
-                   " WHERE c.relname=%s"
-                   "   AND c.oid=a.attrelid"
-                   "   AND c.relnamespace IN (SELECT oid from pg_namespace WHERE nspname = ANY(current_schemas(false)))"
-                   "   AND a.attisdropped=%s"
-                   "   AND pg_catalog.format_type(a.atttypid, a.atttypmod) NOT IN ('cid', 'tid', 'oid', 'xid')"
-                   "   AND a.attname NOT IN %s" ,(self._table, False, tuple(columns))),
-
-        for column in cr.dictfetchall():
+        if schema is None:
+            schema = self._schema(cr)
+
+        for column in (schema.table_columns(cr, self._table) or {}).values():
+            if column['attname'] in columns \
+                    or column['typname'] in ('cid', 'tid', 'oid', 'xid'):
+                continue
             if log:
                 self.__logger.debug("column %s is in the table %s but not in the corresponding object %s",
                                     column['attname'], self._table, self._name)
             if column['attnotnull']:
+                schema.forget(self._table)
                 cr.execute('ALTER TABLE "%s" ALTER COLUMN "%s" DROP NOT NULL' % \
                             (self._table, column['attname']), debug=self._debug)
 
@@ -3018,28 +3301,25 @@ class orm(orm_template):
         todo_end = []
         if context is None:
             context = {}
-        self._field_create(cr, context=context)
+        # the catalog and ir_model_fields are read once for all the models
+        # of a module load, see tools.SchemaSnapshot
+        schema = self._schema(cr)
+        self._field_create(cr, context=context, schema=schema)
         if getattr(self, '_auto', True):
             # We only query and get the columns of a table once.
             # If there is no columns, there must be no table, either.
-            cr.execute("""SELECT c.relname,
-                    a.attname, a.attlen, a.atttypmod, a.attnotnull,
-                    a.atthasdef, t.typname,
-                    CASE WHEN a.attlen=-1 THEN a.atttypmod-4 ELSE a.attlen END as size
-                FROM pg_class c, pg_attribute a LEFT JOIN pg_type t ON (a.atttypid=t.oid)
-                WHERE c.relname=%s AND relkind IN ('r','v')
-                  AND c.relnamespace IN (SELECT oid from pg_namespace WHERE nspname = ANY(current_schemas(false)))
-                  AND c.oid=a.attrelid """, (self._table,), debug=self._debug)
+            col_data = schema.table_columns(cr, self._table)
             
-            if not cr.rowcount:
+            if col_data is None:
                 cr.execute('CREATE TABLE "%s" (id SERIAL NOT NULL, PRIMARY KEY(id)) WITHOUT OIDS' % (self._table,), debug=self._debug)
                 cr.execute("COMMENT ON TABLE \"%s\" IS %%s" % (self._table),
                             (self._description,), debug=self._debug)
+                schema.forget(self._table)
                 create = True
                 col_data = { 'id': True }
                 # True in col_data means we just created that column and is ok
             else:
-                col_data = dict(map(lambda x: (x['attname'], x),cr.dictfetchall()))
+                col_data = dict((name, col.copy()) for name, col in col_data.items())
 
             cr.commit()
             if self._parent_store:
@@ -3056,6 +3336,7 @@ class orm(orm_template):
                                             self._table)
                     if self._columns[self._parent_name].ondelete != 'cascade':
                         _logger.error( "the columns %s on object must be set as ondelete='cascasde'" % (self._name, self._parent_name))
+                    schema.forget(self._table)
                     cr.execute('ALTER TABLE "%s" ADD COLUMN "parent_left" INTEGER' % (self._table,), debug=self._debug)
                     cr.execute('ALTER TABLE "%s" ADD COLUMN "parent_right" INTEGER' % (self._table,), debug=self._debug)
                     col_data['parent_left'] = True
@@ -3072,18 +3353,20 @@ class orm(orm_template):
                 }
                 for k in logs:
                     if k not in col_data:
+                        schema.forget(self._table)
                         cr.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s' % (self._table, k, logs[k]), debug=self._debug)
                         col_data[k] = True
                         cr.commit()
 
             if self._vtable:
                     if '_vptr' not in col_data:
+                        schema.forget(self._table)
                         cr.execute('ALTER TABLE "%s" ADD COLUMN "_vptr" VARCHAR(64)' % \
                             (self._table,), debug=self._debug)
                         col_data[k] = True
                         cr.commit()
 
-            self._check_removed_columns(cr, log=False)
+            self._check_removed_columns(cr, log=False, schema=schema)
 
             # iterate on the "object columns"
             todo_update_store = []
@@ -3109,19 +3392,11 @@ class orm(orm_template):
                             if not self.pool.get(f._obj)._inherits or (f._fields_id not in self.pool.get(f._obj)._inherit_fields.keys()):
                                 raise except_orm('Programming Error', ("There is no reference field '%s' found for '%s'") % (f._fields_id,f._obj,))
 
-                    cr.execute("""SELECT relname, a.attname 
-                            FROM pg_class c LEFT JOIN pg_attribute a
-                                    ON ( a.attname=%s AND c.oid=a.attrelid)
-                            WHERE c.relname=%s
-                              AND c.relnamespace IN (SELECT oid from pg_namespace WHERE nspname = ANY(current_schemas(false)))
-                              """, (f._fields_id, f._obj))
-                    res = cr.fetchone()
-                    if res and not res[1]:
+                    res = schema.table_columns(cr, f._obj)
+                    if res is not None and f._fields_id not in res:
                         cr.execute('ALTER TABLE "%s" ADD FOREIGN KEY (%s) REFERENCES "%s" ON DELETE SET NULL' % (self._obj, f._fields_id, f._table), debug=self._debug)
                 elif isinstance(f, fields.many2many):
-                    cr.execute("SELECT relname FROM pg_class WHERE relkind IN ('r','v') AND relname=%s "
-                        "AND relnamespace IN (SELECT oid from pg_namespace WHERE nspname = ANY(current_schemas(false)))", (f._rel,), debug=self._debug)
-                    if not cr.dictfetchall():
+                    if not schema.has_table(cr, f._rel):
                         if not self.pool.get(f._obj):
                             raise except_orm('Programming Error', ('There is no reference available for %s') % (f._obj,))
                         ref = self.pool.get(f._obj)._table
@@ -3136,6 +3411,7 @@ class orm(orm_template):
                     if not res and hasattr(f,'oldname') \
                             and f.oldname in col_data:
                         _logger.debug('trying to rename %s(%s) to %s'% (self._table, f.oldname, k))
+                        schema.forget(self._table)
                         cr.execute('ALTER TABLE "%s" RENAME "%s" TO "%s"' % ( self._table,f.oldname, k), debug=self._debug)
                         res = col_data[f.oldname]
                         res['attname'] = k
@@ -3156,6 +3432,7 @@ class orm(orm_template):
                                                 (k, f.string, self._table))
                             else:
                                 _logger.info('column %s (%s) in table %s removed: converted to a function !' % (k, f.string, self._table))
+                                schema.forget(self._table)
                                 cr.execute('ALTER TABLE "%s" DROP COLUMN "%s" CASCADE'% (self._table, k), debug=self._debug)
                                 cr.commit()
                             f_obj_type = None
@@ -3214,6 +3491,7 @@ class orm(orm_template):
                                         # Postgres promises to be able to alter a column's
                                         # type (including size) in one command. 
                                         # See sql-altertable.html, valid at least since v8.0
+                                        schema.forget(self._table)
                                         cr.execute('ALTER TABLE "%s" ALTER COLUMN "%s" TYPE %s' % \
                                                     (self._table, k, c[2]), debug=self._debug)
                                         cr.commit()
@@ -3228,6 +3506,7 @@ class orm(orm_template):
                                             break
                                         i+=1
                                     _logger.warning("column '%s' in table '%s' has changed type (DB=%s, def=%s), data moved to table %s !" % (k, self._table, f_pg_type, f._type, newname))
+                                    schema.forget(self._table)
                                     if f_pg_notnull:
                                         cr.execute('ALTER TABLE "%s" ALTER COLUMN "%s" DROP NOT NULL' % (self._table, k), debug=self._debug)
                                     cr.execute('ALTER TABLE "%s" RENAME COLUMN "%s" TO "%s"' % (self._table, k, newname), debug=self._debug)
@@ -3251,6 +3530,7 @@ class orm(orm_template):
                                 # add the NOT NULL constraint
                                 cr.commit()
                                 try:
+                                    schema.forget(self._table)
                                     cr.execute('ALTER TABLE "%s" ALTER COLUMN "%s" SET NOT NULL' % (self._table, k), debug=self._debug)
                                     cr.commit()
                                 except DatabaseError, e:
@@ -3260,15 +3540,16 @@ class orm(orm_template):
                                             self._table, k, e, self._table, k)
                                 cr.commit()
                             elif not f.required and f_pg_notnull == 1:
+                                schema.forget(self._table)
                                 cr.execute('ALTER TABLE "%s" ALTER COLUMN "%s" DROP NOT NULL' % (self._table, k), debug=self._debug)
                                 cr.commit()
 
                             # Verify index
                             indexname = '%s_%s_index' % (self._table, k)
-                            cr.execute("SELECT indexname FROM pg_indexes WHERE indexname = %s and tablename = %s", (indexname, self._table), debug=self._debug)
-                            res2 = cr.dictfetchall()
+                            res2 = schema.indexes.get(indexname) == self._table
                             if not res2 and f.select:
                                 cr.execute('CREATE INDEX "%s_%s_index" ON "%s" ("%s")' % (self._table, k, self._table, k), debug=self._debug)
+                                schema.note_index(indexname, self._table)
                                 cr.commit()
                                 if f._type == 'text':
                                     # FIXME: for fields.text columns we should try creating GIN indexes instead (seems most suitable for an ERP context)
@@ -3277,6 +3558,7 @@ class orm(orm_template):
                                         "Use a search view instead if you simply want to make the field searchable." % (k, f._type, self._table))
                             if res2 and not f.select:
                                 cr.execute('DROP INDEX "%s_%s_index"' % (self._table, k), debug=self._debug)
+                                schema.note_index(indexname, self._table, drop=True)
                                 cr.commit()
                                 _logger.warning("Dropping index for column '%s' of type '%s' in table '%s' as it is not required anymore" % (k, f._type, self._table))
 
@@ -3285,35 +3567,21 @@ class orm(orm_template):
                                 assert self.pool.get(f._obj), f._obj
                                 ref = self.pool.get(f._obj)._table
                                 if ref != 'ir_actions':
-                                    cr.execute('SELECT confdeltype, conname FROM pg_constraint as con, pg_class as cl1, pg_class as cl2, '
-                                                'pg_attribute as att1, pg_attribute as att2 '
-                                            'WHERE con.conrelid = cl1.oid '
-                                                'AND cl1.relnamespace IN (SELECT oid from pg_namespace WHERE nspname = ANY(current_schemas(false)))'
-                                                'AND cl2.relnamespace IN (SELECT oid from pg_namespace WHERE nspname = ANY(current_schemas(false)))'
-                                                'AND cl1.relname = %s '
-                                                'AND con.confrelid = cl2.oid '
-                                                'AND cl2.relname = %s '
-                                                'AND array_lower(con.conkey, 1) = 1 '
-                                                'AND con.conkey[1] = att1.attnum '
-                                                'AND att1.attrelid = cl1.oid '
-                                                'AND att1.attname = %s '
-                                                'AND array_lower(con.confkey, 1) = 1 '
-                                                'AND con.confkey[1] = att2.attnum '
-                                                'AND att2.attrelid = cl2.oid '
-                                                'AND att2.attname = %s '
-                                                "AND con.contype = 'f'", (self._table, ref, k, 'id'))
-                                    res2 = cr.dictfetchall()
+                                    res2 = schema.get_fkey(cr, self._table, k, ref)
                                     if res2:
-                                        if res2[0]['confdeltype'] != POSTGRES_CONFDELTYPES.get(f.ondelete.upper(), 'a'):
-                                            conname = str(res2[0]['conname'])
+                                        confdeltype = POSTGRES_CONFDELTYPES.get(f.ondelete.upper(), 'a')
+                                        if res2[0] != confdeltype:
+                                            conname = str(res2[1])
                                             cr.execute('ALTER TABLE "%s" DROP CONSTRAINT "%s"' % (self._table, conname), debug=self._debug)
                                             cr.execute('ALTER TABLE "%s" ADD FOREIGN KEY ("%s") REFERENCES "%s" ON DELETE %s' % \
                                                     (self._table,k,ref,f.ondelete), debug=self._debug)
+                                            schema.note_fkey(self._table, k, ref, confdeltype)
                                             cr.commit()
                     if not res:
                         if not isinstance(f, fields.function) or f.store:
 
                             # add the missing field
+                            schema.forget(self._table)
                             cr.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s' % \
                                         (self._table, k, get_pg_type(f)[1]), debug=self._debug)
                             cr.execute("COMMENT ON COLUMN %s.%s IS %%s" % \
@@ -3349,11 +3617,15 @@ class orm(orm_template):
                                 # ir_actions is inherited so foreign key doesn't work on it
                                 if ref != 'ir_actions':
                                     cr.execute('ALTER TABLE "%s" ADD FOREIGN KEY ("%s") REFERENCES "%s" ON DELETE %s' % (self._table, k, ref, f.ondelete), debug=self._debug)
+                                    schema.note_fkey(self._table, k, ref,
+                                            POSTGRES_CONFDELTYPES.get(f.ondelete.upper(), 'a'))
                             if f.select:
                                 cr.execute('CREATE INDEX "%s_%s_index" ON "%s" ("%s")' % (self._table, k, self._table, k), debug=self._debug)
+                                schema.note_index('%s_%s_index' % (self._table, k), self._table)
                             if f.required:
                                 try:
                                     cr.commit()
+                                    schema.forget(self._table)
                                     cr.execute('ALTER TABLE "%s" ALTER COLUMN "%s" SET NOT NULL' % (self._table, k), debug=self._debug)
                                 except Exception:
                                     _logger.warning('WARNING: unable to set column %s of table %s not null !\nTry to re-run: openerp-server.py --update=module\nIf it doesn\'t work, update records and execute manually:\nALTER TABLE %s ALTER COLUMN %s SET NOT NULL' % (k, self._table, self._table, k))
@@ -3371,18 +3643,15 @@ class orm(orm_template):
                                 'i': self._inherits[inh], 'self': self._name },
                             debug=self._debug)
         else:
-            cr.execute("SELECT relname FROM pg_class WHERE relkind IN ('r','v') AND relname=%s"
-                " AND relnamespace IN (SELECT oid from pg_namespace WHERE nspname = ANY(current_schemas(false)))",
-                (self._table,))
-            create = not bool(cr.fetchone())
+            create = not schema.has_table(cr, self._table)
 
         cr.commit()     # start a new transaction
 
         for (key, con, _) in self._sql_constraints:
             conname = '%s_%s' % (self._table, key)
 
-            cr.execute("SELECT conname, pg_catalog.pg_get_constraintdef(oid, true) as condef FROM pg_constraint where conname=%s", (conname,))
-            existing_constraints = cr.dictfetchall()
+            existing_constraints = [{'conname': conname, 'condef': condef}
+                                    for condef in schema.constraints.get(conname, [])]
 
             # FIXME This code must be rewritten, more cleanly
             sql_actions = {
@@ -3422,6 +3691,8 @@ class orm(orm_template):
                 try:
                     cr.execute(sql_action['query'])
                     cr.commit()
+                    # the definition Postgres gives back may be spelled otherwise
+                    schema.note_constraint(conname, con, drop=(sql_action['order'] == 1))
                 except Exception:
                     _logger.warning('unable to add \'%s\' constraint on table %s !\n'\
                         'If you want to have it, you should update the '
@@ -3645,6 +3916,10 @@ class orm(orm_template):
             if self._vtable:
                 fields.append('_vptr')
 
+        store_queue = getattr(cr, 'store_queue', None)
+        if store_queue and store_queue.pending(self._name):
+            store_queue.flush(cr)
+
         query = self._where_calc(cr, user, domain, context=context)
         # Not needed so far, because _read_flat consults ir.rule.domain_get()
         # self._apply_ir_rules(cr, user, query, 'read', context=context)
@@ -3664,6 +3939,48 @@ class orm(orm_template):
 
         return result
 
+    def search_read_iter(self, cr, user, domain, offset=0, limit=None, order=None,
+                         fields=None, context=None, load='_classic_read', chunk_size=None):
+        """ Search and read, yielding the records one by one
+
+        The ids are streamed from a server-side cursor, and the records are
+        read chunk_size (default: ITER_CHUNK_SIZE) at a time, so that only
+        one chunk is held in memory. The cursor must not be committed until
+        the generator is exhausted.
+        See orm_template.search_read_iter().
+        """
+        if context is None:
+            context = {}
+        chunk_size = chunk_size or ITER_CHUNK_SIZE
+        self.pool.get('ir.model.access').check(cr, user, self._name, 'read', context=context)
+
+        store_queue = getattr(cr, 'store_queue', None)
+        if store_queue and store_queue.pending(self._name):
+            store_queue.flush(cr)
+
+        query = self._where_calc(cr, user, domain, context=context)
+        self._apply_ir_rules(cr, user, query, 'read', context=context)
+        order_by = self._generate_order_by(order, query)
+        from_clause, where_clause, where_clause_params = query.get_sql()
+
+        limit_str = limit and ' LIMIT %d' % limit or ''
+        offset_str = offset and ' OFFSET %d' % offset or ''
+        where_str = where_clause and (" WHERE %s" % where_clause) or ''
+
+        if self._debug:
+            _logger.debug("%s.search_read_iter(%s, fields=%r)", self._name, query, fields)
+        for rows in cr.execute_iter('SELECT "%s".id FROM ' % self._table + from_clause +
+                                    where_str + order_by + limit_str + offset_str,
+                                    where_clause_params, chunk_size=chunk_size,
+                                    debug=self._debug):
+            ids = [x[0] for x in rows]
+            result = self.read(cr, user, ids, fields, context=context, load=load)
+            # keep the order of the search
+            positions = dict([(id, i) for i, id in enumerate(ids)])
+            result.sort(key=lambda r: positions[r['id']])
+            for r in result:
+                yield r
+
     def _read_flat(self, cr, user, ids, fields_to_read, context=None, load='_classic_read'):
         """ Perform the SQL query for reading data
           @param ids can be a list of integers, *or* a tuple of (query, order, limit, offset)
@@ -3685,6 +4002,10 @@ class orm(orm_template):
             if self._vtable:
                 fields_to_read.append('_vptr')
 
+        store_queue = getattr(cr, 'store_queue', None)
+        if store_queue and store_queue.pending(self._name, fields_to_read):
+            store_queue.flush(cr)
+
         # Construct a clause for the security rules.
         # 'tables' hold the list of tables necessary for the SELECT including the ir.rule clauses,
         # or will at least contain self._table.
@@ -3700,8 +4021,41 @@ class orm(orm_template):
             _logger.debug('%s.read_flat: tables=%s, fields_pre=%s' %
                 (self._name, tables, fields_pre))
 
+        # The raw rows are shared through the cursor's record cache. Only
+        # order-insensitive reads (browse, single ids) may be served from it,
+        # since the others expect the rows sorted by the SQL query.
+        rcache = getattr(cr, 'record_cache', None)
+        if self.CONCURRENCY_CHECK_FIELD in fields_pre or context.get('bin_size', False):
+            rcache = None
         res = []
-        if s_query or len(fields_pre):
+        if rcache is not None and ids and fields_pre \
+                and (load == '_classic_write' or len(ids) == 1):
+            cached_rows = rcache.get(self._table, user)
+            miss_ids = []
+            seen = set()
+            # in the order of ids, the rows read below are merged in it
+            order_ids = [id for id in ids if not (id in seen or seen.add(id))]
+            for id in order_ids:
+                row = cached_rows.get(id)
+                if row is None:
+                    miss_ids.append(id)
+                    continue
+                for f in fields_pre:
+                    if f not in row:
+                        miss_ids.append(id)
+                        break
+                else:
+                    r = dict([(f, row[f]) for f in fields_pre])
+                    r['id'] = id
+                    res.append(r)
+            if res and self._debug:
+                _logger.debug('%s.read_flat: %d rows from record cache', self._name, len(res))
+            ids = miss_ids
+
+        if not (s_query or len(fields_pre)):
+            # can only happen w/o s_query
+            res = [{'id': x} for x in ids]
+        elif s_query or ids:
             if len(tables) > 1 or (s_query and (len(s_query.tables) > 1)):
                 table_prefix = self._table + '.'
             else:
@@ -3789,10 +4143,16 @@ class orm(orm_template):
                     raise except_orm(_('AccessError'),
                                          _('Operation prohibited by access rules, or performed on an already deleted document (Operation: %s, Document type: %s).')
                                          % ( _('read'), self._description,))
-            res.extend(cr.dictfetchall())
-        else:
-            # can only happen w/o s_query
-            res = [{'id': x} for x in ids]
+            res_sql = cr.dictfetchall()
+            if rcache is not None:
+                rcache.store(self._table, user, res_sql)
+            if res and res_sql:
+                # some rows came from the record cache: keep the order of ids
+                positions = dict([(id, i) for i, id in enumerate(order_ids)])
+                res.extend(res_sql)
+                res.sort(key=lambda r: positions[r['id']])
+            else:
+                res.extend(res_sql)
 
         tmp_ids = [x['id'] for x in res]
         tmp_fs = []
@@ -3906,28 +4266,20 @@ class orm(orm_template):
                         else:
                             record[f] = []
 
-        ima_obj = self.pool.get('ir.model.access')
         no_perm = "=No Permission=" # TODO translate, outside of this fn
-        for vals in res:
-            for field in vals:
-                fobj = None
-                if field in self._columns:
-                    fobj = self._columns[field]
-
-                if not fobj:
+        hidden = self.pool.get('ir.model.access').hidden_fields(cr, user, self)
+        for field in hidden:
+            for vals in res:
+                if field not in vals:
                     continue
-                groups = fobj.read
-                if groups:
-                    edit = ima_obj.check_groups(cr, user, groups)
-                    if not edit:
-                        if isinstance(vals[field], list):
-                            vals[field] = []
-                        elif isinstance(vals[field], (float, int, long)): # FIXME: have False
-                            vals[field] = 0
-                        elif isinstance(vals[field], basestring):
-                            vals[field] = no_perm
-                        else:
-                            vals[field] = False
+                if isinstance(vals[field], list):
+                    vals[field] = []
+                elif isinstance(vals[field], (float, int, long)): # FIXME: have False
+                    vals[field] = 0
+                elif isinstance(vals[field], basestring):
+                    vals[field] = no_perm
+                else:
+                    vals[field] = False
         return res
 
     def perm_read(self, cr, user, ids, context=None, details=True):
@@ -4073,8 +4425,14 @@ class orm(orm_template):
         self.check_access_rule(cr, uid, ids, 'unlink', context=context)
         pool_model_data = self.pool.get('ir.model.data')
         pool_ir_values = self.pool.get('ir.values')
+        rcache = getattr(cr, 'record_cache', None)
+        if rcache:
+            # the ON DELETE actions of foreign keys may update other tables
+            rcache.clear(keep=self._table)
+            rcache.invalidate(self._table, ids)
         cr.execute('DELETE FROM ' + self._table + ' ' \
-                       'WHERE id = ANY(%s)', (ids,), debug=self._debug)
+                       'WHERE id = ANY(%s)', (ids,), debug=self._debug,
+                       _invalidated=True)
 
 
         # Removing the ir_model_data reference if the record being deleted is a record created by xml/csv file,
@@ -4089,13 +4447,15 @@ class orm(orm_template):
                     (self._name, list(ids), ['%s,%s' % (self._name, sid) for sid in ids]),
                     debug=self._debug)
 
+        todo_store = []
         for order, object, store_ids, fields in result_store:
             if object != self._name:
                 obj =  self.pool.get(object)
                 cr.execute('SELECT id FROM '+obj._table+' WHERE id = ANY(%s)', (store_ids,))
                 rids = map(lambda x: x[0], cr.fetchall())
                 if rids:
-                    obj._store_set_values(cr, uid, rids, fields, context)
+                    todo_store.append((order, object, rids, fields))
+        self._store_process(cr, uid, todo_store, context)
 
         return True
 
@@ -4234,9 +4594,13 @@ class orm(orm_template):
 
         if len(upd0):
             self.check_access_rule(cr, user, ids, 'write', context=context)
+            rcache = getattr(cr, 'record_cache', None)
+            if rcache:
+                rcache.invalidate(self._table, ids)
             for sub_ids in cr.split_for_in_conditions(ids):
                 cr.execute('update ' + self._table + ' set ' + ','.join(upd0) + ' ' \
-                           'where id in %s', upd1 + [sub_ids], debug=self._debug) # TODO
+                           'where id in %s', upd1 + [sub_ids], debug=self._debug,
+                           _invalidated=True) # TODO
                 if cr.rowcount != len(sub_ids):
                     raise except_orm(_('AccessError'),
                                      _('One of the records you are trying to modify has already been deleted (Document type: %s).') % self._description)
@@ -4343,23 +4707,148 @@ class orm(orm_template):
                         cr.execute('UPDATE '+self._table+' SET parent_left=parent_left-%s, parent_right=parent_right-%s WHERE parent_left >= %s AND parent_left < %s', (pleft-position+distance,pleft-position+distance, pleft+distance, pright+distance))
 
         result += self._store_get_values(cr, user, ids, vals.keys(), context)
-        result.sort()
+        self._store_process(cr, user, result, context)
 
-        done = {}
-        for order, object, ids_r, fields_r in result:
-            key = (object,tuple(fields_r))
-            done.setdefault(key, {})
-            # avoid to do several times the same computation
-            todo = []
-            for id in ids_r:
-                if id not in done[key]:
-                    done[key][id] = True
-                    todo.append(id)
-            self.pool.get(object)._store_set_values(cr, user, todo, fields_r, context)
+        wf_service = netsvc.LocalService("workflow")
+        wf_service.trg_write_multi(user, self._name, ids, cr)
+        return True
+
+    def _write_values(self, cr, cols, rows, set_extra=None, params_extra=None, only_changed=False):
+        """ Update several rows of the table, each with its own values
+
+            This issues one ``UPDATE .. FROM (VALUES ..)`` per IN_MAX rows.
+            The record cache is invalidated for all the rows.
+
+            @param cols the names of the (classic, local) columns to set
+            @param rows list of (id, value1, value2..) tuples, the values being
+                already converted through the _symbol_set of the columns
+            @param set_extra list of further SQL assignments for all the rows,
+                like 'write_date=now()'
+            @param params_extra parameters for the set_extra assignments
+            @param only_changed skip the rows whose columns already hold
+                these values
+            @return the number of rows updated
+        """
+        casts = ['%s::int4'] + ['%%s::%s' % get_pg_type(self._columns[c])[0] for c in cols]
+        row_fmt = '(' + ','.join(casts) + ')'
+        upd0 = ['"%s"=v."%s"' % (c, c) for c in cols] + (set_extra or [])
+        qry_cols = ', '.join(['id'] + ['"%s"' % c for c in cols])
+        qry_where = '"%s".id = v.id' % self._table
+        if only_changed:
+            qry_where += ' AND (' + ' OR '.join(['"%s"."%s" IS DISTINCT FROM v."%s"' % (self._table, c, c) \
+                                            for c in cols]) + ')'
+        rcache = getattr(cr, 'record_cache', None)
+        if rcache:
+            rcache.invalidate(self._table, [r[0] for r in rows])
+        count = 0
+        for sub_rows in tools.misc.split_every(cr.IN_MAX, rows):
+            params = list(params_extra or [])
+            for r in sub_rows:
+                params.extend(r)
+            cr.execute('UPDATE "%s" SET %s FROM (VALUES %s) AS v(%s) WHERE %s' % \
+                        (self._table, ','.join(upd0), ', '.join([row_fmt] * len(sub_rows)),
+                        qry_cols, qry_where),
+                        params, debug=self._debug, _invalidated=True)
+            count += cr.rowcount
+        return count
+
+    def write_multi(self, cr, user, id_vals, context=None):
+        """
+        Update several records, each with its own values
+
+        Equivalent to calling :py:meth:`write` for every (id, vals) pair
+        of **id_vals**, but the records are grouped by the set of written
+        columns and each group is updated with a single statement, having
+        its access rules, constraints, stored functions and workflows
+        processed once.
+
+        Only the local, classic columns can be written that way. Records
+        that also write relational, inherited, translated or parent fields
+        fall back to a write() of their own, as all of them do when the
+        object overrides write().
+
+        :param cr: database cursor
+        :param user: current user id
+        :param id_vals: dictionary of {id: {'field_name': field_value, ...}}
+        :param context: optional context arguments
+        :return: True
+        """
+        if not context:
+            context = {}
+        if not id_vals:
+            return True
+        if self._overridden('write'):
+            return super(orm, self).write_multi(cr, user, id_vals, context=context)
+        # ids come as strings through XML-RPC
+        id_vals = dict([(int(id), vals) for id, vals in id_vals.items()])
+        totranslate = context.get('lang', False) and (context['lang'] != 'en_US')
+        fast_cols = {}
+        def _is_fast(field):
+            if field not in fast_cols:
+                col = self._columns.get(field)
+                fast_cols[field] = bool(col and col._classic_write \
+                        and not hasattr(col, '_fnct_inv') \
+                        and not (totranslate and col.translate) \
+                        and col._symbol_set[0] == '%s' \
+                        and get_pg_type(col) \
+                        and field not in ('parent_left', 'parent_right') \
+                        and not (self._parent_store and field == self._parent_name))
+            return fast_cols[field]
+
+        groups = {}
+        for id, vals in id_vals.items():
+            cols = vals.keys()
+            if cols and not filter(lambda f: not _is_fast(f), cols):
+                cols.sort()
+                groups.setdefault(tuple(cols), []).append(id)
+            else:
+                self.write(cr, user, [id], vals, context=context)
+        if not groups:
+            return True
+
+        all_ids = []
+        for ids in groups.values():
+            all_ids.extend(ids)
+        self._check_concurrency(cr, all_ids, context)
+        self.pool.get('ir.model.access').check(cr, user, self._name, 'write', context=context)
+        self.check_access_rule(cr, user, all_ids, 'write', context=context)
+
+        ima_obj = self.pool.get('ir.model.access')
+        set_extra = []
+        params_extra = []
+        if self._log_access:
+            set_extra = ['write_uid=%s', 'write_date=now()']
+            params_extra = [user]
+
+        result = []
+        for cols, ids in groups.items():
+            # fields restricted to some groups are silently ignored, as in write()
+            cols = [c for c in cols if not self._columns[c].write \
+                        or ima_obj.check_groups(cr, user, self._columns[c].write)]
+            if not cols:
+                continue
+            result += self._store_get_values(cr, user, ids, cols, context) or []
+            rows = []
+            for id in ids:
+                vals = id_vals[id]
+                row = [id]
+                for c in cols:
+                    if hasattr(self._columns[c], 'selection') and vals[c]:
+                        self._check_selection_field_value(cr, user, c, vals[c], context=context)
+                    row.append(self._columns[c]._symbol_set[1](vals[c]))
+                rows.append(row)
+            if self._debug:
+                _logger.debug('%s.write_multi(#%s, %r)', self._name, ids, cols)
+            if self._write_values(cr, cols, rows, set_extra, params_extra) != len(ids):
+                raise except_orm(_('AccessError'),
+                                 _('One of the records you are trying to modify has already been deleted (Document type: %s).') % self._description)
+            result += self._store_get_values(cr, user, ids, cols, context)
+
+        self._validate(cr, user, all_ids, context)
+        self._store_process(cr, user, result, context)
 
         wf_service = netsvc.LocalService("workflow")
-        for id in ids:
-            wf_service.trg_write(user, self._name, id, cr)
+        wf_service.trg_write_multi(user, self._name, all_ids, cr)
         return True
 
     #
@@ -4527,12 +5016,7 @@ class orm(orm_template):
 
         if not context.get('no_store_function', False):
             result += self._store_get_values(cr, user, [id_new], vals.keys(), context)
-            result.sort()
-            done = []
-            for order, object, ids, fields2 in result:
-                if not (object, ids, fields2) in done:
-                    self.pool.get(object)._store_set_values(cr, user, ids, fields2, context)
-                    done.append((object, ids, fields2))
+            self._store_process(cr, user, result, context)
 
         if self._log_create and not (context and context.get('no_store_function', False)):
             message = self._description + \
@@ -4544,6 +5028,178 @@ class orm(orm_template):
         wf_service.trg_create(user, self._name, id_new, cr)
         return id_new
 
+    def _overridden(self, method):
+        """ Whether the class of the object overrides orm.<method>, which
+            its bulk variant then cannot bypass
+        """
+        return getattr(type(self), method).im_func is not getattr(orm, method).im_func
+
+    def create_multi(self, cr, user, vals_list, context=None):
+        """
+        Create several records at once
+
+        Equivalent to calling :py:meth:`create` for each of the dictionaries
+        in **vals_list**, but the ids are allocated in one query, the rows are
+        inserted with one multi-row INSERT per set of columns and the access
+        rules, constraints, stored functions and workflows are processed once
+        for all the new records.
+
+        Objects that override create(), or that have ``_inherits`` or a
+        parent store that is neither deferred nor computed at init, fall
+        back to one create() per record.
+
+        :param cr: database cursor
+        :param user: current user id
+        :param vals_list: list of field values dictionaries, as for create()
+        :param context: optional context arguments
+        :return: list of the new ids, in the order of **vals_list**
+        """
+        if not vals_list:
+            return []
+        if not context:
+            context = {}
+        if self._overridden('create') or self._inherits \
+                or (self._parent_store and not self.pool._init \
+                    and not context.get('defer_parent_store_computation')):
+            return super(orm, self).create_multi(cr, user, vals_list, context=context)
+
+        self.pool.get('ir.model.access').check(cr, user, self._name, 'create', context=context)
+
+        bool_fields = [x for x in self._columns.keys() if self._columns[x]._type=='boolean']
+        allowed = {}
+        all_fields = set()
+        todo_vals = []  # [(vals, upd_todo)] per record
+        groups = {}     # { (column, ...): [record positions] }
+        for vals in vals_list:
+            vals = self._add_missing_default_values(cr, user, dict(vals), context)
+            for field in vals.keys():
+                if field != '_vptr' and field not in self._columns:
+                    del vals[field]
+                elif field not in allowed:
+                    fobj = self._columns.get(field)
+                    allowed[field] = not (fobj and fobj.write) or \
+                            self.pool.get('ir.model.access').check_groups(cr, user, fobj.write)
+                    if not allowed[field]:
+                        del vals[field]
+                elif not allowed[field]:
+                    del vals[field]
+            for bool_field in bool_fields:
+                if bool_field not in vals:
+                    vals[bool_field] = False
+
+            upd0 = []
+            upd_todo = []
+            for field in vals:
+                if field == '_vptr' or self._columns[field]._classic_write:
+                    upd0.append(field)
+                elif not isinstance(self._columns[field], fields.related):
+                    upd_todo.append(field)
+                if field in self._columns \
+                        and hasattr(self._columns[field], 'selection') \
+                        and vals[field]:
+                    self._check_selection_field_value(cr, user, field, vals[field], context=context)
+            upd0.sort()
+            groups.setdefault(tuple(upd0), []).append(len(todo_vals))
+            todo_vals.append((vals, upd_todo))
+            all_fields.update(vals.keys())
+
+        cr.execute('SELECT nextval(%s) FROM generate_series(1, %s)',
+                    (self._sequence, len(todo_vals)), debug=self._debug)
+        new_ids = [x[0] for x in cr.fetchall()]
+
+        for cols, positions in groups.items():
+            upd0 = ['id']
+            upd1 = ['%s']
+            for field in cols:
+                if field == '_vptr':
+                    upd0.append('_vptr')
+                    upd1.append('%s')
+                else:
+                    upd0.append('"' + field + '"')
+                    upd1.append(self._columns[field]._symbol_set[0])
+            if self._log_access:
+                upd0 += ['create_uid', 'create_date']
+                upd1 += ['%s', 'now()']
+            row_fmt = '(' + ','.join(upd1) + ')'
+            for sub_positions in tools.misc.split_every(cr.IN_MAX, positions):
+                rows = []
+                params = []
+                for pos in sub_positions:
+                    vals = todo_vals[pos][0]
+                    rows.append(row_fmt)
+                    params.append(new_ids[pos])
+                    for field in cols:
+                        if field == '_vptr':
+                            params.append(vals[field] or None)
+                        else:
+                            params.append(self._columns[field]._symbol_set[1](vals[field]))
+                    if self._log_access:
+                        params.append(user)
+                cr.execute('INSERT INTO "%s" (%s) VALUES %s' % \
+                            (self._table, ', '.join(upd0), ', '.join(rows)),
+                            params, debug=self._debug)
+
+        self.check_access_rule(cr, user, new_ids, 'create', context=context)
+
+        if self._parent_store and not context.get('defer_parent_store_computation'):
+            # only reached at init, see above
+            self.pool._init_parent[self._name] = True
+
+        # default element in context must be removed when call a one2many or many2many
+        rel_context = context.copy()
+        for c in context.items():
+            if c[0].startswith('default_'):
+                del rel_context[c[0]]
+
+        result = []
+        for id_new, (vals, upd_todo) in zip(new_ids, todo_vals):
+            upd_todo.sort(lambda x, y: self._columns[x].priority-self._columns[y].priority)
+            for field in upd_todo:
+                result += self._columns[field].set(cr, self, id_new, field, vals[field], user, rel_context) or []
+        self._validate(cr, user, new_ids, context)
+
+        if not context.get('no_store_function', False):
+            result += self._store_get_values(cr, user, new_ids, list(all_fields), context)
+            self._store_process(cr, user, result, context)
+
+            if self._log_create:
+                for id_new, name in self.name_get(cr, user, new_ids, context=context):
+                    message = self._description + " '" + name + "' " + _("created.")
+                    self.log(cr, user, id_new, message, True, context=context)
+
+        wf_service = netsvc.LocalService("workflow")
+        wf_service.trg_create_multi(user, self._name, new_ids, cr)
+        return new_ids
+
+    def _store_process(self, cr, uid, result, context):
+        """ Recompute the stored function fields listed in result, as returned
+            by _store_get_values(), each record only once per (object, fields).
+
+            If the context has 'defer_store_function' set, or the cursor has
+            its defer_store attribute set, they are queued on the cursor
+            instead, to be computed together before the next commit or read
+            of them. See StoreQueue.
+        """
+        if not result:
+            return
+        if (context and context.get('defer_store_function')) or getattr(cr, 'defer_store', False):
+            if getattr(cr, 'store_queue', None) is None:
+                cr.store_queue = StoreQueue(self.pool)
+            cr.store_queue.add(result, context)
+            return
+        result.sort()
+        done = {}
+        for order, object, ids_r, fields_r in result:
+            key = (object,tuple(fields_r))
+            done.setdefault(key, {})
+            # avoid to do several times the same computation
+            todo = []
+            for id in ids_r:
+                if id not in done[key]:
+                    done[key][id] = True
+                    todo.append(id)
+            self.pool.get(object)._store_set_values(cr, uid, todo, fields_r, context)
+
     def _store_get_values(self, cr, uid, ids, fields, context):
         """Returns an ordered list of fields.functions to call due to
            an update operation on ``fields`` of records with ``ids``,
@@ -4593,27 +5249,25 @@ class orm(orm_template):
 
     def _store_set_values(self, cr, uid, ids, fields, context):
         """Calls the fields.function's "implementation function" for all ``fields``, on records with ``ids`` (taking care of
-           respecting ``multi`` attributes), and stores the resulting values in the database directly."""
+           respecting ``multi`` attributes), and stores the resulting values in the database directly.
+           The values are written back in bulk, skipping the records whose columns already hold them."""
         if not ids:
             return True
-        field_flag = False
+        # Stored functions with a time-length are not recomputed for the
+        # records written less than that many hours ago
         field_dict = {}
         if self._log_access:
-            cr.execute('SELECT id,write_date FROM '+self._table+' WHERE id = ANY (%s)', (map(int, ids),))
-            res = cr.fetchall()
-            for r in res:
-                if r[1]:
-                    field_dict.setdefault(r[0], [])
-                    res_date = time.strptime((r[1])[:19], '%Y-%m-%d %H:%M:%S')
-                    write_date = datetime.datetime.fromtimestamp(time.mktime(res_date))
-                    for i in self.pool._store_function.get(self._name, []):
-                        if i[5]:
-                            up_write_date = write_date + datetime.timedelta(hours=i[5])
-                            if datetime.datetime.now() < up_write_date:
-                                if i[1] in fields:
-                                    field_dict[r[0]].append(i[1])
-                                    if not field_flag:
-                                        field_flag = True
+            lengths = {}
+            for i in self.pool._store_function.get(self._name, []):
+                if i[5] and i[1] in fields:
+                    lengths.setdefault(i[5], []).append(i[1])
+            for length, length_fields in lengths.items():
+                cr.execute('SELECT id FROM "' + self._table + '" WHERE id = ANY (%s) ' \
+                            'AND write_date + interval \'1 hour\' * %s > now()',
+                            (map(int, ids), length), debug=self._debug)
+                for r in cr.fetchall():
+                    field_dict.setdefault(r[0], []).extend(length_fields)
+
         todo = {}
         keys = []
         for f in fields:
@@ -4621,53 +5275,56 @@ class orm(orm_template):
                 keys.append(self._columns[f]._multi)
             todo.setdefault(self._columns[f]._multi, [])
             todo[self._columns[f]._multi].append(f)
+
+        # { id: { field: value to store } }
+        values = {}
         for key in keys:
             val = todo[key]
             if key:
                 # uid == 1 for accessing objects having rules defined on store fields
                 result = self._columns[val[0]].get(cr, self, ids, val, 1, context=context)
                 for id, value in result.items():
-                    if field_flag:
-                        for f in value.keys():
-                            if f in field_dict[id]:
-                                value.pop(f)
-                    upd0 = []
-                    upd1 = []
                     for v in value:
-                        if v not in val:
-                            continue
-                        if self._columns[v]._type in ('many2one', 'one2one'):
-                            try:
-                                value[v] = value[v][0]
-                            except:
-                                pass
-                        upd0.append('"'+v+'"='+self._columns[v]._symbol_set[0])
-                        upd1.append(self._columns[v]._symbol_set[1](value[v]))
-                    upd1.append(id)
-                    if upd0 and upd1:
-                        cr.execute('UPDATE "' + self._table + '" SET ' + \
-                            ','.join(upd0) + ' WHERE id = %s', upd1,
-                            debug=self._debug)
-
+                        if v in val:
+                            values.setdefault(id, {})[v] = value[v]
             else:
                 for f in val:
                     # uid == 1 for accessing objects having rules defined on store fields
                     result = self._columns[f].get(cr, self, ids, f, 1, context=context)
-                    for r in result.keys():
-                        if field_flag:
-                            if r in field_dict.keys():
-                                if f in field_dict[r]:
-                                    result.pop(r)
                     for id, value in result.items():
-                        if self._columns[f]._type in ('many2one', 'one2one'):
-                            try:
-                                value = value[0]
-                            except:
-                                pass
-                        cr.execute('UPDATE "' + self._table + '" SET ' + \
-                            '"'+f+'"='+self._columns[f]._symbol_set[0] + ' WHERE id = %s', 
-                                (self._columns[f]._symbol_set[1](value),id),
-                                debug=self._debug)
+                        values.setdefault(id, {})[f] = value
+
+        # group the records by the set of columns to write
+        groups = {}
+        for id, value in values.items():
+            for f in field_dict.get(id, []):
+                value.pop(f, None)
+            row = [id]
+            cols = value.keys()
+            cols.sort()
+            for f in cols:
+                v = value[f]
+                if self._columns[f]._type in ('many2one', 'one2one'):
+                    try:
+                        v = v[0]
+                    except:
+                        pass
+                row.append(self._columns[f]._symbol_set[1](v))
+            if cols:
+                groups.setdefault(tuple(cols), []).append(row)
+
+        rcache = getattr(cr, 'record_cache', None)
+        for cols, rows in groups.items():
+            if filter(lambda f: self._columns[f]._symbol_set[0] != '%s' or not get_pg_type(self._columns[f]), cols):
+                # cannot be cast in a VALUES list, one UPDATE per record
+                upd0 = ','.join(['"'+f+'"='+self._columns[f]._symbol_set[0] for f in cols])
+                for row in rows:
+                    if rcache:
+                        rcache.invalidate(self._table, [row[0]])
+                    cr.execute('UPDATE "' + self._table + '" SET ' + upd0 + ' WHERE id = %s',
+                            row[1:] + row[:1], debug=self._debug, _invalidated=True)
+            else:
+                self._write_values(cr, list(cols), rows, only_changed=True)
         return True
 
     #
@@ -4865,6 +5522,10 @@ class orm(orm_template):
             context = {}
         self.pool.get('ir.model.access').check(cr, access_rights_uid or user, self._name, 'read', context=context)
 
+        store_queue = getattr(cr, 'store_queue', None)
+        if store_queue and store_queue.pending(self._name):
+            store_queue.flush(cr)
+
         query = self._where_calc(cr, user, args, context=context)
         self._apply_ir_rules(cr, user, query, 'read', context=context)
         order_by = self._generate_order_by(order, query)
@@ -27,7 +27,9 @@ import netsvc
 import pooler
 import copy
 from psycopg2 import IntegrityError, errorcodes
+from tools.config import config
 from tools.func import wraps
+from tools.lru import LRU
 from tools.translate import translate
 
 module_list = []
@@ -272,6 +274,8 @@ class object_proxy(netsvc.Service):
 object_proxy()
 
 class osv_pool(object):
+    VIEW_CHANNEL = 'view_cache'
+
     def __init__(self):
         self._ready = False
         self.obj_pool = {}
@@ -284,6 +288,25 @@ class osv_pool(object):
         self.logger = logging.getLogger("pool")
         #: Store some values, temprarily, for the init phase
         self._init_values = {}
+        #: tools.SchemaSnapshot shared by the _auto_init() of a module load
+        self.schema = None
+        #: results of fields_view_get(), see orm_template._view_cache_key()
+        self.view_cache = None
+        view_cache_size = int(config.get_misc('cache', 'views', 1024))
+        if view_cache_size > 0:
+            self.view_cache = LRU(view_cache_size)
+
+    def clear_view_cache(self, cr=None):
+        """ Forget the results of fields_view_get(), after views, fields,
+            their translations or access rights changed
+
+            With cr, the other server processes forget theirs when its
+            transaction is committed (see pooler)
+        """
+        if self.view_cache is not None:
+            self.view_cache.clear()
+        if cr is not None and config.get_misc('cache', 'notify', True):
+            cr.notify(self.VIEW_CHANNEL)
 
     def init_set(self, cr, mode):
         different = mode != self._init
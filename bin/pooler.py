@@ -63,12 +63,27 @@ def get_db_and_pool(db_name, force_demo=False, status=None, update_module=False,
         finally:
             cr.close()
 
+        if config.get_misc('cache', 'notify', True):
+            # the caches cleared by the other processes
+            import sql_db
+            import tools
+            sql_db.listen(db_name, tools.cache.CHANNEL, tools.cache.notified)
+            sql_db.listen(db_name, pool.VIEW_CHANNEL, _view_cache_notified)
+
         if pooljobs:
             pool.get('ir.cron').restart(db.dbname)
         log.info('Successfuly loaded database \"%s\"' % db_name)
     return db, pool
 
 
+def _view_cache_notified(db_name, payload):
+    """ Another process changed the views of db_name, or notifications
+        were missed """
+    pool = pool_dic.get(db_name)
+    if pool is not None:
+        pool.clear_view_cache()
+
+
 def restart_pool(db_name, force_demo=False, status=None, update_module=False, languages=False):
     if db_name in pool_dic:
         del pool_dic[db_name]
@@ -60,7 +60,9 @@ class TinySocketClientThread(threading.Thread, netsvc.OpenERPDispatcher):
     def run(self):
         self.running = True
         try:
-            ts = tiny_socket.mysocket(self.sock)
+            ts = tiny_socket.mysocket(self.sock,
+                    compress_threshold=int(tools.config.get_misc('netrpcd', 'compress_threshold',
+                                                tiny_socket.COMPRESS_THRESHOLD)))
         except Exception:
             self.threads.remove(self)
             self.running = False
@@ -74,6 +76,10 @@ class TinySocketClientThread(threading.Thread, netsvc.OpenERPDispatcher):
             except socket.timeout:
                 #terminate this channel because other endpoint is gone
                 break
+            except tiny_socket.FrameError:
+                #terminate this channel, the rest of the stream is unusable
+                logging.getLogger('web-services').warning("netrpc: invalid message received", exc_info=True)
+                break
             except netsvc.OpenERPDispatcherException, e:
                 try:
                     new_e = Exception(e.compat_string()) # avoid problems of pickeling
@@ -685,6 +685,10 @@ GNU Public Licence.
         res += netsvc.Server.allStats()
         res += "\n"
         res += netsvc.ExportService.allStats()
+        res += "\n"
+        res += sql_db._Pool.stats()
+        res += tools.cache.all_stats()
+        res += netsvc.WorkerPool.allStats()
         try:
             import gc
             if gc.isenabled():
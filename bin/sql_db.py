@@ -33,7 +33,7 @@ See also: the `pooler` module
 #.apidoc add-functions: print_stats
 #.apidoc add-classes: Cursor Connection ConnectionPool
 
-__all__ = ['db_connect', 'close_db']
+__all__ = ['db_connect', 'close_db', 'listen']
 
 import logging
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, ISOLATION_LEVEL_READ_COMMITTED, ISOLATION_LEVEL_SERIALIZABLE
@@ -70,7 +70,10 @@ from tools.func import wraps, frame_codeinfo
 from netsvc import Agent
 from datetime import datetime as mdt
 from datetime import timedelta
+import os
+import select
 import threading
+import time
 from inspect import currentframe
 
 import re
@@ -98,6 +101,8 @@ re_queries = [
         ('select', re.compile(r'select (nextval)\(%s\)', re.I)),
     ]
 
+re_dml_table = re.compile(r'\s*(update|delete\s+from)\s+"?([a-z_0-9]+)"?', re.I)
+
 sql_counter = 0
 
 def print_stats(stats, logger):
@@ -137,6 +142,63 @@ def print_stats(stats, logger):
     logger.debug("Sum of all ops: %s/%s",
                         all_sum[0], timedelta(microseconds=all_sum[1]))
 
+class RecordCache(object):
+    """ Transaction-scoped cache of the raw table rows read by the ORM
+
+        Rows are kept per table and per uid, since they have passed the
+        ir.rules of that user:
+            { table: { uid: { id: {field: value, ...} } } }
+
+        It only lives as long as the transaction: the cursor discards it on
+        commit() and rollback(). The ORM invalidates the records it modifies,
+        any other UPDATE on a cached table drops that table and any other
+        DELETE (which may cascade through foreign keys) drops everything.
+
+        At most size rows are kept per table and uid: above, the rows of
+        that table and uid are dropped before the new ones are stored.
+    """
+    def __init__(self, size=10000):
+        self._tables = {}
+        self.size = size
+
+    def __nonzero__(self):
+        return bool(self._tables)
+
+    def get(self, table, uid):
+        """ Return the (mutable) dict of rows cached for table, uid
+        """
+        return self._tables.setdefault(table, {}).setdefault(uid, {})
+
+    def store(self, table, uid, rows):
+        """ Add (the columns of) rows, dicts having an 'id', to the cache
+        """
+        cached = self.get(table, uid)
+        if len(cached) + len([r for r in rows if r['id'] not in cached]) > self.size:
+            cached.clear()
+            if len(rows) > self.size:
+                return
+        for r in rows:
+            cached.setdefault(r['id'], {}).update(r)
+
+    def invalidate(self, table, ids=None):
+        """ Forget the rows of table, or only those of ids if given
+        """
+        if table not in self._tables:
+            return
+        if ids is None:
+            del self._tables[table]
+            return
+        for rows in self._tables[table].values():
+            for id in ids:
+                rows.pop(id, None)
+
+    def clear(self, keep=None):
+        """ Forget all rows, except for the table named in keep
+        """
+        for table in self._tables.keys():
+            if table != keep:
+                del self._tables[table]
+
 class Cursor(object):
     """ Cursor is an open transaction to Postgres, utilizing a TCP connection
     
@@ -148,6 +210,7 @@ class Cursor(object):
     IN_MAX = 1000 # decent limit on size of IN queries - guideline = Oracle limit
     __logger = logging.getLogger('db.cursor')
     __pgmode = None
+    __iter_count = 0
 
     def check(f):
         @wraps(f)
@@ -167,6 +230,12 @@ class Cursor(object):
         self.sql_log = self.__logger.isEnabledFor(logging.DEBUG_SQL)
 
         self.sql_log_count = 0
+        self.record_cache = None
+        # Deferred recomputation of stored function fields, see orm.StoreQueue
+        self.defer_store = False
+        self.store_queue = None
+        #: the workflows, as changed by this transaction (see wkf_graph.get())
+        self.workflow_graph = None
         self.__closed = True    # avoid the call of close() (by __del__) if an exception
                                 # is raised by any of the following initialisations
         self._pool = pool
@@ -210,10 +279,13 @@ class Cursor(object):
             self.__logger.warn(msg)
             self._close(True)
 
-    def execute(self, query, params=None, debug=False, log_exceptions=True, _fast=False):
+    def execute(self, query, params=None, debug=False, log_exceptions=True, _fast=False,
+                _invalidated=False):
         """ Execute some SQL command
             @param debug   Verbosely log the query being sent (not results, yet)
             @param log_exceptions ignored, left there mainly for API compatibility with trunk
+            @param _invalidated the caller has already invalidated the
+                record_cache for the rows this query modifies
         """
             
         if params and not _fast:
@@ -222,6 +294,14 @@ class Cursor(object):
         if self.__closed:
             raise psycopg2.OperationalError('Unable to use the cursor after having closed it')
 
+        if self.record_cache and not _invalidated:
+            res_m = re_dml_table.match(query)
+            if res_m:
+                if res_m.group(1).lower() == 'update':
+                    self.record_cache.invalidate(res_m.group(2))
+                else:
+                    self.record_cache.clear()
+
         if self.sql_log or debug:
             now = mdt.now()
 
@@ -272,6 +352,37 @@ class Cursor(object):
         return res
 
 
+    @check
+    def execute_iter(self, query, params=None, chunk_size=1000, debug=False):
+        """ Execute a query through a named (server-side) cursor and iterate
+            over its results, fetching chunk_size rows at a time
+
+            Unlike execute(), the results are not transferred all at once, so
+            that huge ones do not need to fit in memory. The cursor can still
+            be used for other queries while iterating, but not committed.
+
+            @return generator of lists of (up to chunk_size) row tuples
+        """
+        Cursor.__iter_count += 1
+        cur = self._cnx.cursor('oe_iter_%d' % Cursor.__iter_count)
+        try:
+            if self.sql_log or debug:
+                self.__logger.debug("Q (iter): %s", query)
+            self.sql_log_count += 1
+            cur.execute(query, params or None)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            if not cur.closed:
+                try:
+                    cur.close()
+                except psycopg2.Error:
+                    # the transaction has already ended
+                    pass
+
     def split_for_in_conditions(self, ids):
         """Split a list of identifiers into one or more smaller tuples
            safe for IN conditions, after uniquifying them."""
@@ -360,7 +471,7 @@ class Cursor(object):
         self.__closed = True
 
         if leak:
-            self._cnx.leaked = True
+            self._pool.leaked(self._cnx)
         else:
             keep_in_pool = self.dbname not in ('template1', 'template0', 'postgres')
             self._pool.give_back(self._cnx, keep_in_pool=keep_in_pool)
@@ -369,19 +480,48 @@ class Cursor(object):
     def autocommit(self, on):
         offlevel = [ISOLATION_LEVEL_READ_COMMITTED, ISOLATION_LEVEL_SERIALIZABLE][bool(self._serialized)]
         self._cnx.set_isolation_level([offlevel, ISOLATION_LEVEL_AUTOCOMMIT][bool(on)])
+        # Without a transaction, rows may change between any two statements
+        if on or not tools.config.get_misc('cache', 'records', True):
+            self.record_cache = None
+        else:
+            self.record_cache = RecordCache(int(tools.config.get_misc('cache', 'record_rows', 10000)))
 
     @check
     def commit(self):
         """ Perform an SQL `COMMIT`
         """
+        if self.store_queue:
+            self.store_queue.flush(self)
+        if self.record_cache:
+            self.record_cache.clear()
+        self.workflow_graph = None
+        tools.cache.publish(self)
         return self._cnx.commit()
 
     @check
     def rollback(self):
         """ Perform an SQL `ROLLBACK`
         """
+        self.store_queue = None
+        if self.record_cache:
+            self.record_cache.clear()
+        self.workflow_graph = None
+        tools.cache.discard(self)
         return self._cnx.rollback()
 
+    @check
+    def notify(self, channel, payload=None):
+        """ Send a notification to the processes listening to channel (see
+            listen()), when the transaction is committed
+
+            The payload needs postgres 9.0; before, the listeners receive
+            an empty one.
+        """
+        if payload is not None and self.__pgmode not in ('pg84', 'pgsql'):
+            self.execute('SELECT pg_notify(%s, %s)', (channel, payload))
+        else:
+            self.execute('NOTIFY "%s"' % channel)
+
     @check
     def __getattr__(self, name):
         if name == 'server_version':
@@ -413,9 +553,14 @@ class ConnectionPool(object):
     
         Keep a set of connections to pg databases open, and reuse them
         to open cursors for all transactions.
-        
-        The connections are *not* automatically closed. Only a close_db()
-        can trigger that.
+
+        The idle connections are queued per database (dsn), so that finding
+        one does not need to scan the others. A periodic job, run by the
+        Agent, closes those idle for longer than [db_pool] idle_timeout
+        seconds (keeping min_idle of them per database) and checks that the
+        others are still alive. At most max_idle connections are kept idle
+        per database.
+        Otherwise, the connections are only closed by a close_db().
     """
     __logger = logging.getLogger('db.connection_pool')
 
@@ -431,24 +576,40 @@ class ConnectionPool(object):
 
 
     def __init__(self, maxconn=64, pgmode=None):
-        self._connections = []
+        self._idle = {}     # { dsn key: [(connection, idle since), ...] }, oldest first
+        self._used = {}     # { connection: dsn key }
+        self._keys = {}     # { dsn: dsn key }, so that each dsn is parsed once
+        self._leaked = []   # connections of cursors that were never closed
+        self._num_idle = 0
+        self._num_checked = 0   # idle connections being checked
         self._maxconn = max(maxconn, 1)
-        self._lock = threading.Lock()
+        self._min_idle = int(tools.config.get_misc('db_pool', 'min_idle', 0))
+        self._max_idle = int(tools.config.get_misc('db_pool', 'max_idle', self._maxconn))
+        self._idle_timeout = int(tools.config.get_misc('db_pool', 'idle_timeout', 600))
+        self._check_interval = int(tools.config.get_misc('db_pool', 'check_interval', 60))
+        self._wait_timeout = float(tools.config.get_misc('db_pool', 'wait_timeout', 10))
+        self._waiters = []  # requests waiting for a connection, in turn
+        self._maintained = False
+        self._lock = threading.Condition(threading.Lock())
         self._debug_pool = tools.config.get_misc('debug', 'db_pool', False)
         self.sql_stats = {}
+        self.reset_pool_stats()
         if pgmode: # not None or False
             Cursor.set_pgmode(pgmode)
 
     def __del__(self):
         # explicitly free them
-        del self._connections
+        del self._idle
+        del self._used
         if self.sql_stats:
             self.print_all_stats()
 
     def __repr__(self):
-        used = len([1 for c, u in self._connections[:] if u])
-        count = len(self._connections)
-        return "ConnectionPool(used=%d/count=%d/max=%d)" % (used, count, self._maxconn)
+        return "ConnectionPool(used=%d/count=%d/max=%d)" % \
+                (len(self._used), self._count(), self._maxconn)
+
+    def _count(self):
+        return len(self._used) + self._num_idle + self._num_checked
 
     def _debug(self, msg, *args):
         if self._debug_pool:
@@ -480,100 +641,294 @@ class ConnectionPool(object):
         self._debug_pool = do_debug
         self.__logger.info("Debugging set to %s" % str(do_debug))
 
-    @locked
-    def borrow(self, dsn, do_cursor=False):
-        self._debug_dsn('Borrow connection to %r', dsn)
+    def reset_pool_stats(self):
+        self._stats = {
+            'checkouts': 0,     # successful borrow()s
+            'reused': 0,        # .. served by an idle connection
+            'created': 0,       # new connections opened
+            'evicted': 0,       # idle ones closed: timeout, max_idle or room for others
+            'broken': 0,        # dead ones found and dropped
+            'borrow_time': 0.0, # total and max seconds spent in borrow()
+            'borrow_max': 0.0,
+            'waits': 0,         # borrow()s that had to wait for the pool
+            'timeouts': 0,      # .. and gave up
+            'wait_time': 0.0,   # total and max seconds of the successful waits
+            'wait_max': 0.0,
+            }
+
+    def stats(self):
+        """ Return a human-readable summary of the pool usage
+        """
+        st = self._stats
+        res = "DB pool: %d used, %d idle in %d databases, max %d\n" % \
+                (len(self._used), self._num_idle, len(self._idle), self._maxconn)
+        res += "    checkouts: %d (%d reused), created: %d, evicted: %d, broken: %d\n" % \
+                (st['checkouts'], st['reused'], st['created'], st['evicted'], st['broken'])
+        res += "    borrow time: avg %.3fms, max %.3fms\n" % \
+                (st['checkouts'] and (st['borrow_time'] * 1000.0 / st['checkouts']) or 0.0,
+                 st['borrow_max'] * 1000.0)
+        res += "    waits: %d (%d waiting now), timeouts: %d, wait time: avg %.3fms, max %.3fms\n" % \
+                (st['waits'], len(self._waiters), st['timeouts'],
+                 (st['waits'] - st['timeouts']) and \
+                    (st['wait_time'] * 1000.0 / (st['waits'] - st['timeouts'])) or 0.0,
+                 st['wait_max'] * 1000.0)
+        return res
 
-        # free leaked connections
-        for i, (cnx, _) in tools.reverse_enumerate(self._connections):
-            if getattr(cnx, 'leaked', False):
-                delattr(cnx, 'leaked')
-                self._connections.pop(i)
-                self._connections.append((cnx, False))
-                self._debug_dsn('Free leaked connection to %r', cnx.dsn)
+    def _dsn_key(self, dsn):
+        key = self._keys.get(dsn)
+        if key is None:
+            key = self._keys[dsn] = dsn_key(dsn)
+        return key
+
+    def _close_cnx(self, cnx):
+        try:
+            if not cnx.closed:
+                cnx.close()
+        except Exception:
+            pass
 
-        result = None
-        for i, (cnx, used) in enumerate(self._connections):
-            if not used and dsn_are_equals(cnx.dsn, dsn):
-                self._connections.pop(i)
+    def _evict_oldest(self):
+        """ Close the connection idle for the longest time, of any database
+
+            @return False if there was no idle connection
+        """
+        oldest = None
+        for key, idle in self._idle.items():
+            if idle and (oldest is None or idle[0][1] < self._idle[oldest][0][1]):
+                oldest = key
+        if oldest is None:
+            return False
+        cnx, since = self._idle[oldest].pop(0)
+        self._num_idle -= 1
+        self._stats['evicted'] += 1
+        self._debug_dsn('Removing old connection: %r', cnx.dsn)
+        self._close_cnx(cnx)
+        return True
+
+    def leaked(self, connection):
+        """ Mark a connection as free, from a cursor that was not closed
+
+            This can be called by the garbage collector, at any time, so it
+            does not take the lock: the connection is freed at next borrow().
+        """
+        self._leaked.append(connection)
+
+    def _start_maintenance(self):
+        if not self._maintained and self._check_interval > 0:
+            self._maintained = True
+            Agent.setAlarm(self._maintain, time.time() + self._check_interval, None)
+
+    def _borrow_idle(self, key, do_cursor):
+        """ Take an idle connection to key out of the pool, if there is a
+            working one
+        """
+        idle = self._idle.get(key)
+        # the most recently used connections first, they are the least
+        # likely to have been dropped by the server
+        while idle:
+            cnx, since = idle.pop()
+            self._num_idle -= 1
+            try:
+               if psycopg2.__version__ >= '2.2' :
+                    pr = cnx.poll()
+                    self._debug("Poll: %d", pr)
+            except OperationalError, e:
+                self._debug("Error in poll: %s" % e)
+                self._stats['broken'] += 1
+                self._close_cnx(cnx)
+                continue
+            
+            if cnx.closed or not cnx.status:
+                # something is wrong with that connection, let it out
+                self._debug("Troubled connection ")
+                self._stats['broken'] += 1
+                continue
+            
+            self._debug('Existing connection found')
+            if do_cursor:
                 try:
-                   if psycopg2.__version__ >= '2.2' :
-                        pr = cnx.poll()
-                        self._debug("Poll: %d", pr)
-                except OperationalError, e:
-                    self._debug("Error in poll: %s" % e)
-                    continue
-                
-                if cnx.closed or not cnx.status:
-                    # something is wrong with that connection, let it out
-                    self._debug("Troubled connection ")
-                    continue
-                
-                self._debug('Existing connection found at index %d', i)
-                if do_cursor:
-                    try:
-                        cur = cnx.cursor(cursor_factory=psycopg1cursor)
-                        if psycopg2.__version__ < '2.2' and not cur.isready():
-                            continue
-                        if cur.closed:
-                            continue
-                        self._connections.insert(i,(cnx, True))
-
-                        result = (cnx, cur)
-                    except OperationalError:
+                    cur = cnx.cursor(cursor_factory=psycopg1cursor)
+                    if (psycopg2.__version__ < '2.2' and not cur.isready()) or cur.closed:
+                        self._stats['broken'] += 1
+                        self._close_cnx(cnx)
                         continue
-                else:
-                    self._connections.insert(i,(cnx, True))
-                    result = cnx
-                break
-        if result:
-            return result
-
-        if len(self._connections) >= self._maxconn:
-            # try to remove the oldest connection not used
-            for i, (cnx, used) in enumerate(self._connections):
-                if not used:
-                    self._connections.pop(i)
-                    self._debug_dsn('Removing old connection at index %d: %r', i, cnx.dsn, dsn_pos=1)
-                    break
+                    result = (cnx, cur)
+                except OperationalError:
+                    self._stats['broken'] += 1
+                    self._close_cnx(cnx)
+                    continue
             else:
-                # note: this code is called only if the for loop has completed (no break)
-                raise PoolError('The Connection Pool Is Full')
+                result = cnx
+            self._used[cnx] = key
+            self._stats['reused'] += 1
+            return result
+        return None
 
+    def _connect(self, dsn, key, do_cursor):
         try:
-            result = psycopg2.connect(dsn=dsn, connection_factory=PsycoConnection)
+            cnx = psycopg2.connect(dsn=dsn, connection_factory=PsycoConnection)
         except psycopg2.Error, e:
             self.__logger.exception('Connection to the database failed')
             raise
-        self._connections.append((result, True))
+        self._used[cnx] = key
+        self._stats['created'] += 1
         self._debug('Create new connection')
+        self._start_maintenance()
         if do_cursor:
-            cur = result.cursor(cursor_factory=psycopg1cursor)
-            return (result, cur)
+            return (cnx, cnx.cursor(cursor_factory=psycopg1cursor))
+        return cnx
+
+    @locked
+    def borrow(self, dsn, do_cursor=False):
+        """ Get a connection to dsn (and a cursor on it, if do_cursor)
+
+            When all the connections are used, wait up to [db_pool]
+            wait_timeout seconds for one to be given back, in turn with the
+            other waiting requests, before raising PoolError.
+        """
+        self._debug_dsn('Borrow connection to %r', dsn)
+        t0 = time.time()
+
+        # free leaked connections
+        while self._leaked:
+            cnx = self._leaked.pop()
+            if cnx in self._used:
+                self._give_back(cnx)
+                self._debug_dsn('Free leaked connection to %r', cnx.dsn)
+
+        key = self._dsn_key(dsn)
+        ticket = None
+        try:
+            while True:
+                # when others are waiting already, only the first one may go
+                if not self._waiters or (ticket is not None and self._waiters[0] is ticket):
+                    result = self._borrow_idle(key, do_cursor)
+                    if result:
+                        break
+                    if self._count() < self._maxconn or self._evict_oldest():
+                        result = self._connect(dsn, key, do_cursor)
+                        break
+                if ticket is None:
+                    if self._wait_timeout <= 0:
+                        raise PoolError('The Connection Pool Is Full')
+                    ticket = object()
+                    self._waiters.append(ticket)
+                    deadline = t0 + self._wait_timeout
+                    self._stats['waits'] += 1
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    self.__logger.warning("No connection to %s available after %.3fs, %r",
+                                dict(key).get('dbname'), self._wait_timeout, self)
+                    raise PoolError('The Connection Pool Is Full')
+                self._lock.wait(remaining)
+        finally:
+            if ticket is not None:
+                self._waiters.remove(ticket)
+                # let the next one in line have its chance
+                self._lock.notify_all()
+
+        delay = time.time() - t0
+        if ticket is not None:
+            self._stats['wait_time'] += delay
+            if delay > self._stats['wait_max']:
+                self._stats['wait_max'] = delay
+            self.__logger.info("Waited %.3fs for a connection to %s", delay, dict(key).get('dbname'))
+        self._stats['checkouts'] += 1
+        self._stats['borrow_time'] += delay
+        if delay > self._stats['borrow_max']:
+            self._stats['borrow_max'] = delay
         return result
 
+    def _give_back(self, connection, keep_in_pool=True):
+        key = self._used.pop(connection, None)
+        if key is None:
+            raise PoolError('This connection does not below to the pool')
+        if keep_in_pool and not (connection.closed or not connection.status):
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self._max_idle:
+                idle.append((connection, time.time()))
+                self._num_idle += 1
+                self._debug_dsn('Put connection to %r back in pool', connection.dsn)
+                return
+            self._stats['evicted'] += 1
+        self._close_cnx(connection)
+        self._debug_dsn('Forgot connection to %r', connection.dsn)
+
     @locked
     def give_back(self, connection, keep_in_pool=True):
         self._debug_dsn('Give back connection to %r', connection.dsn)
-        for i, (cnx, used) in enumerate(self._connections):
-            if cnx is connection:
-                self._connections.pop(i)
-                if keep_in_pool and not (cnx.closed or not cnx.status):
-                    self._connections.insert(i,(cnx, False))
-                    self._debug_dsn('Put connection to %r back in pool', cnx.dsn)
-                else:
-                    self._debug_dsn('Forgot connection to %r', cnx.dsn)
-                break
-        else:
-            raise PoolError('This connection does not below to the pool')
+        self._give_back(connection, keep_in_pool=keep_in_pool)
+        if self._waiters:
+            self._lock.notify_all()
 
     @locked
     def close_all(self, dsn):
         self._debug_dsn('Close all connections to %r', dsn)
-        for i, (cnx, used) in tools.reverse_enumerate(self._connections):
-            if dsn_are_equals(cnx.dsn, dsn):
-                cnx.close()
-                self._connections.pop(i)
+        key = self._dsn_key(dsn)
+        for cnx, since in self._idle.pop(key, []):
+            self._num_idle -= 1
+            self._close_cnx(cnx)
+        for cnx, cnx_key in self._used.items():
+            if cnx_key == key:
+                del self._used[cnx]
+                self._close_cnx(cnx)
+        if self._waiters:
+            self._lock.notify_all()
+
+    def _maintain(self):
+        """ Periodic job: close the connections idle for too long, and
+            check that the remaining idle ones are still alive
+        """
+        now = time.time()
+        to_check = []
+        self._lock.acquire()
+        try:
+            for key, idle in self._idle.items():
+                while self._idle_timeout and len(idle) > self._min_idle \
+                        and idle[0][1] < now - self._idle_timeout:
+                    cnx, since = idle.pop(0)
+                    self._num_idle -= 1
+                    self._stats['evicted'] += 1
+                    self._close_cnx(cnx)
+                # take the others out of the pool while they are checked
+                while idle and idle[0][1] < now - self._check_interval:
+                    to_check.append((key, idle.pop(0)))
+                    self._num_idle -= 1
+                    self._num_checked += 1
+                if not idle:
+                    del self._idle[key]
+        finally:
+            self._lock.release()
+
+        alive = []
+        for key, (cnx, since) in to_check:
+            try:
+                cur = cnx.cursor()
+                cur.execute('SELECT 1')
+                cur.close()
+                cnx.rollback()
+                alive.append((key, (cnx, since)))
+            except psycopg2.Error:
+                self._close_cnx(cnx)
+
+        self._lock.acquire()
+        try:
+            self._num_checked -= len(to_check)
+            self._stats['broken'] += len(to_check) - len(alive)
+            for key, item in alive:
+                idle = self._idle.setdefault(key, [])
+                idle.append(item)
+                idle.sort(key=lambda x: x[1])
+                self._num_idle += 1
+            if to_check and self._waiters:
+                self._lock.notify_all()
+        finally:
+            self._lock.release()
+        if to_check:
+            self._debug('Checked %d idle connections, %d alive', len(to_check), len(alive))
+
+        Agent.setAlarm(self._maintain, time.time() + self._check_interval, None)
 
     def print_all_stats(self):
         logger = logging.getLogger('db.cursor') # shall be the same..
@@ -618,12 +973,17 @@ for p in ('host', 'port', 'user', 'password'):
 def dsn(db_name):
     return '%sdbname=%s' % (_dsn, db_name)
 
+def dsn_key(dsn):
+    """ Parse a dsn into a hashable key, that identifies the database
+    """
+    k = dict(x.split('=', 1) for x in dsn.strip().split())
+    k.pop('password', None) # password is not relevant
+    k = k.items()
+    k.sort()
+    return tuple(k)
+
 def dsn_are_equals(first, second):
-    def key(dsn):
-        k = dict(x.split('=', 1) for x in dsn.strip().split())
-        k.pop('password', None) # password is not relevant
-        return k
-    return key(first) == key(second)
+    return dsn_key(first) == dsn_key(second)
 
 
 _Pool = ConnectionPool(int(tools.config['db_maxconn']), 
@@ -633,9 +993,178 @@ def db_connect(db_name):
     return Connection(_Pool, db_name)
 
 def close_db(db_name):
+    _Listener.forget(db_name)
     _Pool.close_all(dsn(db_name))
     Agent.cancel(db_name)
-    tools.cache.clean_caches_for_db(db_name)
+    tools.cache.clean_caches_for_db(db_name, publish=False)
+
+
+class Listener(object):
+    """ Receive the notifications (LISTEN/NOTIFY) of postgres
+
+        A single thread waits on one dedicated connection per database, and
+        calls the callbacks registered for the channels as callback(db_name,
+        payload). When a connection is lost, notifications may have been
+        missed, so the callbacks are called with a None payload.
+    """
+    __logger = logging.getLogger('db.listener')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = {}    # {db_name: {channel: [callback]}}
+        self._cnxs = {}         # {db_name: connection}
+        self._dirty = set()     # databases whose connection must be set up
+        self._thread = None
+        self._wake_r, self._wake_w = os.pipe()
+
+    def _wake(self):
+        os.write(self._wake_w, '.')
+
+    def listen(self, db_name, channel, callback):
+        self._lock.acquire()
+        try:
+            callbacks = self._callbacks.setdefault(db_name, {}).setdefault(channel, [])
+            if callback in callbacks:
+                return
+            callbacks.append(callback)
+            self._dirty.add(db_name)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db.listener')
+                self._thread.setDaemon(True)
+                self._thread.start()
+        finally:
+            self._lock.release()
+        self._wake()
+
+    def forget(self, db_name):
+        """ Stop listening on db_name, and close its connection at once
+            (so that the database can be dropped)
+        """
+        self._lock.acquire()
+        try:
+            self._callbacks.pop(db_name, None)
+            self._dirty.discard(db_name)
+            cnx = self._cnxs.pop(db_name, None)
+        finally:
+            self._lock.release()
+        if cnx is not None:
+            try:
+                cnx.close()
+            except Exception:
+                pass
+            self._wake()
+
+    def _dispatch(self, db_name, channel, payload):
+        self._lock.acquire()
+        try:
+            channels = self._callbacks.get(db_name, {})
+            if channel is None:
+                callbacks = sum(channels.values(), [])
+            else:
+                callbacks = list(channels.get(channel, []))
+        finally:
+            self._lock.release()
+        for callback in callbacks:
+            try:
+                callback(db_name, payload)
+            except Exception:
+                self.__logger.exception('Notification of %s on %s failed', channel, db_name)
+
+    def _setup(self, db_name):
+        self._lock.acquire()
+        try:
+            channels = self._callbacks.get(db_name, {}).keys()
+            cnx = self._cnxs.get(db_name)
+        finally:
+            self._lock.release()
+        if not channels:
+            return
+        if cnx is None:
+            cnx = psycopg2.connect(dsn=dsn(db_name))
+            cnx.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        cur = cnx.cursor()
+        for channel in channels:
+            cur.execute('LISTEN "%s"' % channel)
+        cur.close()
+        self._lock.acquire()
+        try:
+            if db_name in self._callbacks:
+                self._cnxs[db_name] = cnx
+                cnx = None
+        finally:
+            self._lock.release()
+        if cnx is not None:
+            # forgotten meanwhile
+            cnx.close()
+
+    def _lost(self, db_name):
+        self._lock.acquire()
+        try:
+            cnx = self._cnxs.pop(db_name, None)
+            if db_name in self._callbacks:
+                self._dirty.add(db_name)
+        finally:
+            self._lock.release()
+        if cnx is not None:
+            try:
+                cnx.close()
+            except Exception:
+                pass
+        self._dispatch(db_name, None, None)
+
+    def _run(self):
+        while True:
+            self._lock.acquire()
+            try:
+                dirty, self._dirty = self._dirty, set()
+            finally:
+                self._lock.release()
+            for db_name in dirty:
+                try:
+                    self._setup(db_name)
+                except Exception:
+                    self.__logger.warning('Cannot listen to notifications of %s', db_name, exc_info=True)
+                    self._lost(db_name)
+            self._lock.acquire()
+            try:
+                cnxs = dict([(cnx.fileno(), (db_name, cnx)) for db_name, cnx in self._cnxs.items()])
+            finally:
+                self._lock.release()
+            timeout = None
+            if self._dirty:
+                # retry to connect in a while
+                timeout = 10
+            try:
+                ready = select.select([self._wake_r] + cnxs.keys(), [], [], timeout)[0]
+            except (select.error, ValueError):
+                # a connection was closed by forget()
+                continue
+            for fd in ready:
+                if fd == self._wake_r:
+                    os.read(self._wake_r, 512)
+                    continue
+                db_name, cnx = cnxs[fd]
+                try:
+                    cnx.poll()
+                except Exception:
+                    self.__logger.warning('Connection listening to %s lost', db_name)
+                    self._lost(db_name)
+                    continue
+                while cnx.notifies:
+                    notify = cnx.notifies.pop(0)
+                    if isinstance(notify, tuple):
+                        # psycopg2 < 2.3: (pid, channel)
+                        self._dispatch(db_name, notify[1], '')
+                    else:
+                        self._dispatch(db_name, notify.channel, notify.payload)
+
+_Listener = Listener()
+
+def listen(db_name, channel, callback):
+    """ Call callback(db_name, payload) for each notification on channel
+        of db_name, see Cursor.notify()
+    """
+    _Listener.listen(db_name, channel, callback)
 
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
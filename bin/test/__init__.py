@@ -21,3 +21,6 @@
 
 from test_osv import *
 from test_translate import *
+from test_tiny_socket import *
+from test_cache import *
+from test_auth_cache import *
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import unittest
+from addons.base.res import res_user
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+class AuthCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self._time = res_user.time
+        res_user.time = self.clock
+        self.cache = res_user.auth_cache()
+        self.cache._timeout = 10
+        self.cache._size = 2
+
+    def tearDown(self):
+        res_user.time = self._time
+
+    def test_check(self):
+        self.cache.add('db1', 1, 'secret')
+        self.assertTrue(self.cache.check('db1', 1, 'secret'))
+        self.assertFalse(self.cache.check('db1', 1, 'other'))
+        self.assertFalse(self.cache.check('db1', 2, 'secret'))
+        self.assertFalse(self.cache.check('db2', 1, 'secret'))
+
+    def test_unicode(self):
+        self.cache.add('db1', 1, u'\xe9t\xe9')
+        self.assertTrue(self.cache.check('db1', 1, u'\xe9t\xe9'))
+        self.assertTrue(self.cache.check('db1', 1, '\xc3\xa9t\xc3\xa9'))
+
+    def test_hashed(self):
+        self.cache.add('db1', 1, 'secret')
+        self.assertFalse('secret' in repr(self.cache._dbs['db1'][1]))
+        # the hash depends on the uid as well
+        self.cache.add('db1', 2, 'secret')
+        self.assertNotEquals(self.cache._dbs['db1'][1][0], self.cache._dbs['db1'][2][0])
+
+    def test_expiry(self):
+        self.cache.add('db1', 1, 'secret')
+        self.clock.now += 9
+        self.assertTrue(self.cache.check('db1', 1, 'secret'))
+        self.clock.now += 2
+        self.assertFalse(self.cache.check('db1', 1, 'secret'))
+        self.assertFalse(1 in self.cache._dbs['db1'])
+        # checked again
+        self.cache.add('db1', 1, 'secret')
+        self.assertTrue(self.cache.check('db1', 1, 'secret'))
+
+    def test_size(self):
+        for uid in (1, 2, 3):
+            self.cache.add('db1', uid, 'secret')
+        self.assertFalse(self.cache.check('db1', 1, 'secret'))
+        self.assertTrue(self.cache.check('db1', 2, 'secret'))
+        self.assertTrue(self.cache.check('db1', 3, 'secret'))
+        # per database
+        self.cache.add('db2', 1, 'secret')
+        self.assertTrue(self.cache.check('db1', 3, 'secret'))
+
+    def test_invalidate(self):
+        for uid in (1, 2):
+            self.cache.add('db1', uid, 'secret')
+            self.cache.add('db2', uid, 'secret')
+        self.cache.invalidate('db1', [1, 4])
+        self.assertFalse(self.cache.check('db1', 1, 'secret'))
+        self.assertTrue(self.cache.check('db1', 2, 'secret'))
+        self.cache.invalidate('db1')
+        self.assertFalse(self.cache.check('db1', 2, 'secret'))
+        self.assertTrue(self.cache.check('db2', 1, 'secret'))
+        self.cache.invalidate('db3', [1])
+
+    def test_notified(self):
+        self.cache._size = 3
+        for uid in (1, 2, 3):
+            self.cache.add('db1', uid, 'secret')
+        self.cache.notified('db1', '1,2')
+        self.assertFalse(self.cache.check('db1', 1, 'secret'))
+        self.assertFalse(self.cache.check('db1', 2, 'secret'))
+        self.assertTrue(self.cache.check('db1', 3, 'secret'))
+        self.cache.notified('db1', '')
+        self.assertFalse(self.cache.check('db1', 3, 'secret'))
+
+    def test_notifications_lost(self):
+        self.cache.add('db1', 1, 'secret')
+        self.cache.notified('db1', None)
+        self.assertFalse(self.cache.check('db1', 1, 'secret'))
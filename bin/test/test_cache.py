@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import unittest
+import tools
+
+class FakeCursor(object):
+    def __init__(self, dbname):
+        self.dbname = dbname
+        self.notified = []
+
+    def notify(self, channel, payload=None):
+        self.notified.append((channel, payload))
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+class CacheConfig(object):
+    """ The configuration, with the caches and their notifications enabled
+        whatever it says
+    """
+    def __init__(self, config):
+        self.config = config
+
+    def get_misc(self, sect, key, default=None):
+        if sect == 'cache' and key in ('enable', 'notify'):
+            return True
+        return self.config.get_misc(sect, key, default)
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._config = tools.misc.config
+        tools.misc.config = CacheConfig(self._config)
+        self.clock = FakeClock()
+        self._time = tools.misc.time
+        tools.misc.time = self.clock
+        self.cr1 = FakeCursor('db1')
+        self.cr2 = FakeCursor('db2')
+        self.calls = []
+
+    def tearDown(self):
+        tools.cache.discard(self.cr1)
+        tools.cache.discard(self.cr2)
+        tools.misc.time = self._time
+        tools.misc.config = self._config
+
+    def make(self, **kwargs):
+        """ A cached function of (key), and its tools.cache """
+        c = tools.cache(**kwargs)
+        def double(obj, cr, key):
+            self.calls.append((cr.dbname, key))
+            return key * 2
+        return c(double), c
+
+    def make_multi(self, **kwargs):
+        """ A cached function of (uid, ids), per id, and its tools.cache """
+        c = tools.cache(skiparg=3, multi='ids', **kwargs)
+        def doubles(obj, cr, uid, ids):
+            self.calls.append((cr.dbname, tuple(sorted(ids))))
+            return dict([(id, id * 2) for id in ids])
+        return c(doubles), c
+
+    def test_hit(self):
+        double, c = self.make()
+        self.assertEquals(double(None, self.cr1, 1), 2)
+        self.assertEquals(double(None, self.cr1, 1), 2)
+        self.assertEquals(self.calls, [('db1', 1)])
+
+    def test_expiry(self):
+        double, c = self.make(timeout=10)
+        double(None, self.cr1, 1)
+        self.clock.now += 5
+        double(None, self.cr1, 2)
+        double(None, self.cr1, 1)
+        self.assertEquals(len(self.calls), 2)
+        # only the entry of key 1 is old enough
+        self.clock.now += 6
+        double(None, self.cr1, 1)
+        double(None, self.cr1, 2)
+        self.assertEquals(self.calls, [('db1', 1), ('db1', 2), ('db1', 1)])
+        self.assertEquals(c.count(), 2)
+
+    def test_no_expiry(self):
+        double, c = self.make(timeout=0)
+        double(None, self.cr1, 1)
+        self.clock.now += 10 ** 6
+        double(None, self.cr1, 1)
+        self.assertEquals(self.calls, [('db1', 1)])
+
+    def test_refresh_after_expiry(self):
+        # the entry stored again is not dropped by the expiry of the first
+        double, c = self.make(timeout=10)
+        double(None, self.cr1, 1)
+        self.clock.now += 11
+        double(None, self.cr1, 1)
+        self.clock.now += 5
+        double(None, self.cr1, 1)
+        self.assertEquals(len(self.calls), 2)
+
+    def test_clear_db(self):
+        double, c = self.make()
+        for cr in (self.cr1, self.cr2):
+            double(None, cr, 1)
+            double(None, cr, 2)
+        double.clear_cache('db1')
+        for cr in (self.cr1, self.cr2):
+            double(None, cr, 1)
+            double(None, cr, 2)
+        self.assertEquals(self.calls, [('db1', 1), ('db1', 2), ('db2', 1), ('db2', 2),
+                                       ('db1', 1), ('db1', 2)])
+
+    def test_clear_key(self):
+        double, c = self.make()
+        double(None, self.cr1, 1)
+        double(None, self.cr1, 2)
+        double(None, self.cr2, 1)
+        double.clear_cache('db1', 1)
+        double(None, self.cr1, 1)
+        double(None, self.cr1, 2)
+        double(None, self.cr2, 1)
+        self.assertEquals(self.calls, [('db1', 1), ('db1', 2), ('db2', 1), ('db1', 1)])
+
+    def test_clear_multi(self):
+        doubles, c = self.make_multi()
+        self.assertEquals(doubles(None, self.cr1, 1, [1, 2, 3]), {1: 2, 2: 4, 3: 6})
+        doubles.clear_cache('db1', 1, [2])
+        self.assertEquals(doubles(None, self.cr1, 1, [1, 2, 3]), {1: 2, 2: 4, 3: 6})
+        self.assertEquals(self.calls, [('db1', (1, 2, 3)), ('db1', (2,))])
+
+    def test_clear_all_dbs(self):
+        double, c = self.make()
+        double(None, self.cr1, 1)
+        double(None, self.cr2, 1)
+        tools.cache.clean_caches_for_db('db1')
+        double(None, self.cr1, 1)
+        double(None, self.cr2, 1)
+        self.assertEquals(self.calls, [('db1', 1), ('db2', 1), ('db1', 1)])
+
+    def test_size(self):
+        double, c = self.make(size=2)
+        double(None, self.cr1, 1)
+        double(None, self.cr1, 2)
+        double(None, self.cr1, 3)
+        # each database has its own LRU
+        double(None, self.cr2, 1)
+        double(None, self.cr1, 3)
+        double(None, self.cr1, 1)
+        self.assertEquals(self.calls, [('db1', 1), ('db1', 2), ('db1', 3), ('db2', 1),
+                                       ('db1', 1)])
+
+    def test_stats(self):
+        double, c = self.make(timeout=10, size=2)
+        double(None, self.cr1, 1)
+        double(None, self.cr1, 1)
+        double(None, self.cr1, 2)
+        double(None, self.cr1, 3)      # evicts 1
+        double.clear_cache('db1', 2)
+        self.clock.now += 11
+        double(None, self.cr1, 3)      # expired
+        self.assertEquals((c.hits, c.misses, c.miss_calls), (1, 4, 4))
+        self.assertEquals((c.cleared, c.expired), (1, 1))
+        self.assertEquals(c.count(), 1)
+        line = c.stats()
+        self.assertTrue(line.startswith(c.name + ': 1 entries in 1 db (max 2 each'), line)
+        for part in ('hits: 1 (20.0%)', 'misses: 4', 'evicted: 1', 'expired: 1', 'cleared: 1'):
+            self.assertTrue(part in line, (part, line))
+
+    def test_stats_dropped_db(self):
+        # the evictions of a cleared database are still counted
+        double, c = self.make(size=1)
+        double(None, self.cr1, 1)
+        double(None, self.cr1, 2)
+        double.clear_cache('db1')
+        self.assertEquals((c.cleared, c.count()), (1, 0))
+        self.assertTrue('evicted: 1,' in c.stats(), c.stats())
+
+    def test_all_stats(self):
+        double, c = self.make()
+        double(None, self.cr1, 1)
+        double(None, self.cr1, 1)
+        self.assertTrue(c.stats() in tools.cache.all_stats())
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2010 OpenERP S.A. http://www.openerp.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import socket
+import threading
+import unittest
+import zlib
+import tiny_socket
+
+class FramingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def roundtrip(self, data, protocol, **kwargs):
+        """ Send data from a mysocket of protocol, answer it from another
+            one, and return what both received
+        """
+        client = tiny_socket.mysocket(self.a, protocol=protocol, **kwargs)
+        server = tiny_socket.mysocket(self.b, **kwargs)
+        # the socket buffers can't hold the big messages
+        sender = threading.Thread(target=client.mysend, args=(data,))
+        sender.start()
+        received = server.myreceive()
+        sender.join()
+        sender = threading.Thread(target=server.mysend, args=(received,))
+        sender.start()
+        answer = client.myreceive()
+        sender.join()
+        return received, answer, server.protocol
+
+    def test_v1(self):
+        data = ['execute', 'db', 1, 'pwd', {'a': u'\xe9t\xe9'}]
+        received, answer, protocol = self.roundtrip(data, 1)
+        self.assertEquals(received, data)
+        self.assertEquals(answer, data)
+        self.assertEquals(protocol, 1)
+
+    def test_v2(self):
+        data = ['execute', 'db', 1, 'pwd', {'a': u'\xe9t\xe9'}]
+        received, answer, protocol = self.roundtrip(data, 2)
+        self.assertEquals(received, data)
+        self.assertEquals(answer, data)
+        self.assertEquals(protocol, 2)
+
+    def test_v2_compressed(self):
+        data = [{'id': i, 'name': 'record %d' % i} for i in range(50000)]
+        received, answer, protocol = self.roundtrip(data, 2, compress_threshold=1024)
+        self.assertEquals(received, data)
+        self.assertEquals(answer, data)
+
+    def test_v2_compressed_flag(self):
+        client = tiny_socket.mysocket(self.a, protocol=2, compress_threshold=16)
+        client.mysend('x' * 1000)
+        header = self.b.recv(1 + tiny_socket.V2_HEADER.size)
+        self.assertEquals(header[0], tiny_socket.V2_MAGIC)
+        flags, size = tiny_socket.V2_HEADER.unpack(header[1:])
+        self.assertTrue(flags & tiny_socket.V2_ZLIB)
+        self.assertTrue(size < 1000)
+
+    def test_big_message(self):
+        # more than one recv() of RECV_CHUNK, uncompressed
+        data = 'x' * (3 * tiny_socket.RECV_CHUNK + 1)
+        for protocol in (1, 2):
+            received, answer, _ = self.roundtrip(data, protocol, compress_threshold=0)
+            self.assertEquals(received, data)
+            self.assertEquals(answer, data)
+
+    def test_oversized_v1(self):
+        server = tiny_socket.mysocket(self.b, max_size=1000)
+        self.a.sendall('%8d0' % 1001)
+        self.assertRaises(tiny_socket.FrameError, server.myreceive)
+
+    def test_oversized_v2(self):
+        server = tiny_socket.mysocket(self.b, max_size=1000)
+        self.a.sendall(tiny_socket.V2_MAGIC + tiny_socket.V2_HEADER.pack(0, 2 ** 31))
+        self.assertRaises(tiny_socket.FrameError, server.myreceive)
+
+    def test_oversized_decompressed(self):
+        server = tiny_socket.mysocket(self.b, max_size=1000)
+        msg = zlib.compress('x' * 1001)
+        self.a.sendall(tiny_socket.V2_MAGIC +
+                       tiny_socket.V2_HEADER.pack(tiny_socket.V2_ZLIB, len(msg)) + msg)
+        self.assertRaises(tiny_socket.FrameError, server.myreceive)
+
+    def test_invalid_compressed(self):
+        server = tiny_socket.mysocket(self.b)
+        msg = 'not zlib'
+        self.a.sendall(tiny_socket.V2_MAGIC +
+                       tiny_socket.V2_HEADER.pack(tiny_socket.V2_ZLIB, len(msg)) + msg)
+        self.assertRaises(tiny_socket.FrameError, server.myreceive)
+
+    def test_closed(self):
+        server = tiny_socket.mysocket(self.b)
+        self.a.sendall('%8d0' % 10)
+        self.a.close()
+        self.assertRaises(socket.timeout, server.myreceive)
@@ -23,9 +23,14 @@ import socket
 import cPickle
 import cStringIO
 import marshal
+import struct
+import zlib
 
 #.apidoc title: Net-RPC classes
 
+class FrameError(socket.error):
+    """ A message that can't be received: the connection must be closed """
+
 class Myexception(Exception):
     """
     custom exception object store
@@ -39,9 +44,25 @@ class Myexception(Exception):
         self.faultString = faultString
         self.args = (faultCode, faultString)
 
+# The original framing: the payload length as 8 ascii digits, "0" or
+# "1" for exceptions, then a protocol 0 pickle.
+# The v2 framing starts with V2_MAGIC, which can't begin a v1 header,
+# followed by a binary header (flags, payload length) and a pickle of the
+# highest protocol, zlib-compressed above compress_threshold bytes.
+# A server answers each message in the framing it was sent with, so
+# clients opt in to v2 with mysocket(protocol=2).
+V2_MAGIC = '\xfe'
+V2_HEADER = struct.Struct('!BI')
+V2_EXCEPTION = 0x01
+V2_ZLIB = 0x02
+COMPRESS_THRESHOLD = 8192
+# largest message received, compressed or not (v1 can't exceed 8 digits)
+MAX_SIZE = 99999999
+RECV_CHUNK = 65536
+
 class mysocket:
 
-    def __init__(self, sock=None):
+    def __init__(self, sock=None, protocol=1, compress_threshold=COMPRESS_THRESHOLD, max_size=MAX_SIZE):
         if sock is None:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         else:
@@ -50,6 +71,10 @@ class mysocket:
         # prepare this socket for long operations: it may block for infinite
         # time, but should exit as soon as the net is down
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.protocol = protocol
+        # 0: never compress
+        self.compress_threshold = compress_threshold
+        self.max_size = max_size
         
     def connect(self, host, port=False):
         if not port:
@@ -62,28 +87,58 @@ class mysocket:
         self.sock.close()
         
     def mysend(self, msg, exception=False, traceback=None):
-        msg = cPickle.dumps([msg,traceback])
-        self.sock.sendall('%8d%s%s' % (len(msg), exception and "1" or "0", msg))
-            
-    def myreceive(self):
-        buf=''
-        while len(buf) < 8:
-            chunk = self.sock.recv(8 - len(buf))
+        if self.protocol < 2:
+            msg = cPickle.dumps([msg,traceback])
+            self.sock.sendall('%8d%s%s' % (len(msg), exception and "1" or "0", msg))
+            return
+        msg = cPickle.dumps([msg,traceback], cPickle.HIGHEST_PROTOCOL)
+        flags = exception and V2_EXCEPTION or 0
+        if self.compress_threshold and len(msg) > self.compress_threshold:
+            msg = zlib.compress(msg, 1)
+            flags |= V2_ZLIB
+        # in one send, or the payload may wait for the ack of the header
+        self.sock.sendall(V2_MAGIC + V2_HEADER.pack(flags, len(msg)) + msg)
+
+    def _recv_exact(self, size):
+        """ Read exactly size bytes, as they arrive: the size was sent by
+            the other end, it is only bounded by max_size
+        """
+        if size > self.max_size:
+            raise FrameError('Message of %d bytes, more than %d' % (size, self.max_size))
+        chunks = []
+        while size:
+            chunk = self.sock.recv(min(size, RECV_CHUNK))
             if not chunk:
                 raise socket.timeout
-            buf += chunk
-        size = int(buf)
-        buf = self.sock.recv(1)
-        if buf != "0":
-            exception = buf
+            chunks.append(chunk)
+            size -= len(chunk)
+        return ''.join(chunks)
+
+    def myreceive(self):
+        buf = self._recv_exact(1)
+        if buf == V2_MAGIC:
+            # answer in the same framing
+            self.protocol = 2
+            flags, size = V2_HEADER.unpack(self._recv_exact(V2_HEADER.size))
+            exception = flags & V2_EXCEPTION
+            msg = self._recv_exact(size)
+            if flags & V2_ZLIB:
+                decompressor = zlib.decompressobj()
+                try:
+                    msg = decompressor.decompress(msg, self.max_size)
+                except zlib.error, e:
+                    raise FrameError('Invalid compressed message: %s' % e)
+                if decompressor.unconsumed_tail:
+                    raise FrameError('Message of more than %d bytes once decompressed' % self.max_size)
         else:
-            exception = False
-        msg = ''
-        while len(msg) < size:
-            chunk = self.sock.recv(size-len(msg))
-            if not chunk:
-                raise socket.timeout
-            msg = msg + chunk
+            self.protocol = 1
+            size = int(buf + self._recv_exact(7))
+            buf = self._recv_exact(1)
+            if buf != "0":
+                exception = buf
+            else:
+                exception = False
+            msg = self._recv_exact(size)
         msgio = cStringIO.StringIO(msg)
         unpickler = cPickle.Unpickler(msgio)
         unpickler.find_global = None
@@ -24,6 +24,7 @@ class LRU:
     def __init__(self, count, pairs=[]):
         self._lock = threading.RLock()
         self.count = max(count, 1)
+        self.evicted = 0    # number of entries dropped to keep count of them
         self.d = {}
         self.first = None
         self.last = None
@@ -62,6 +63,7 @@ class LRU:
             a.next = None
             del self.d[a.me[0]]
             del a
+            self.evicted += 1
 
     @synchronized()
     def __delitem__(self, obj):
@@ -109,9 +111,23 @@ class LRU:
     def keys(self):
         return self.d.keys()
 
+    @synchronized()
+    def peek(self, key, default=None):
+        """ Return the value of key, without making it the most recent """
+        nobj = self.d.get(key)
+        if nobj is None:
+            return default
+        return nobj.me[1]
+
     @synchronized()
     def pop(self,key):
         v=self[key]
         del self[key]
         return v
 
+    @synchronized()
+    def clear(self):
+        self.d = {}
+        self.first = None
+        self.last = None
+
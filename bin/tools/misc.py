@@ -26,6 +26,7 @@
 Miscelleanous tools used by OpenERP.
 """
 
+import heapq
 import inspect
 import subprocess
 import logging
@@ -61,6 +62,7 @@ except ImportError:
 import netsvc
 from config import config
 from lru import LRU
+from safe_eval import literal_eval
 
 _logger = logging.getLogger('tools')
 
@@ -787,6 +789,23 @@ class currency(float):
     #   return str(display_value)
 
 
+# Python 2.6+
+_getsizeof = getattr(sys, 'getsizeof', None)
+
+def _approx_size(obj, depth=2):
+    """ Rough size in bytes of obj and of its items, down to depth levels
+        (requires sys.getsizeof)
+    """
+    size = _getsizeof(obj, 64)
+    if depth:
+        if isinstance(obj, dict):
+            for k, v in obj.iteritems():
+                size += _approx_size(k, depth - 1) + _approx_size(v, depth - 1)
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            for v in obj:
+                size += _approx_size(v, depth - 1)
+    return size
+
 def is_hashable(h):
     try:
         hash(h)
@@ -798,9 +817,27 @@ class cache(object):
     """
     Use it as a decorator of the function you plan to cache
     Timeout: 0 = no timeout, otherwise in seconds
+
+    The results are kept in one LRU of `size` entries per database. The
+    entries are also pushed on a heap ordered by their time of storage,
+    so that expiring them only looks at the expired ones.
+
+    The clearings are published to the other server processes when the
+    transaction of the thread that made them is committed, and made again
+    in this process only if it is rolled back (see publish(), discard() and
+    notified()), so that they can keep their caches for long.
     """
 
     __caches = []
+    __by_name = {}
+    __stats_started = False
+    #: pending: the clearings of the thread not published yet,
+    #: {dbname: {cache name: set(keys) or None (all keys)}}, or
+    #: {dbname: None} when all the caches must be cleared
+    __local = threading.local()
+    CHANNEL = 'tools_cache'
+    #: postgres rejects payloads of 8000 bytes or more
+    PAYLOAD_MAX = 7900
 
     def __init__(self, timeout=None, skiparg=2, multi=None, size=None):
         assert skiparg >= 2 , "at least self and cr must be skipped in cache"
@@ -809,20 +846,136 @@ class cache(object):
         self.fun = None
         self._debug = False
         self.__logger = None
+        self._reset_stats()
         if config.get_misc('cache', 'enable', True):
             cache.__caches.append(self)
-            self.lasttime = time.time()
-            size = size or config.get_misc('cache', 'size', 8192)
-            self.cache = LRU(size)
+            cache._start_stats_log()
+            self.size = size or config.get_misc('cache', 'size', 8192)
+            self.cache = {}     # {dbname: LRU({key: (result, time)})}
+            self._expiry = []   # heap of (time, dbname, key)
+            self._lock = threading.Lock()
             if timeout is None:
                 self.timeout = int(config.get_misc('cache','timeout', 100000))
             else:
                 self.timeout = timeout
         else:
-            self.lasttime = None
             self.cache = None # will break attempts to use it.
             self.timeout = 10
 
+    def _reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.cleared = 0
+        self.miss_calls = 0
+        self.miss_time = 0.0
+        self.evicted = 0    # by the LRU of the databases dropped since
+        for entries in (getattr(self, 'cache', None) or {}).values():
+            entries.evicted = 0
+
+    def _store(self, dbname, key, result):
+        entries = self.cache.get(dbname)
+        if entries is None:
+            entries = self.cache.setdefault(dbname, LRU(self.size))
+        now = time.time()
+        entries[key] = (result, now)
+        if self.timeout:
+            self._lock.acquire()
+            try:
+                heapq.heappush(self._expiry, (now, dbname, key))
+                if len(self._expiry) > 2 * self.size * len(self.cache) + 1024:
+                    # drop the items of the entries replaced, evicted or
+                    # cleared since
+                    self._expiry = [(entry[1], db, k) for db, dbentries in self.cache.items()
+                                        for k, entry in dbentries.iteritems()]
+                    heapq.heapify(self._expiry)
+            finally:
+                self._lock.release()
+
+    def _expire(self):
+        """ Remove the entries stored for longer than the timeout """
+        expiry = self._expiry
+        if not (self.timeout and expiry):
+            return
+        limit = time.time() - self.timeout
+        if expiry[0][0] >= limit:
+            return
+        self._lock.acquire()
+        try:
+            expiry = self._expiry
+            while expiry and expiry[0][0] < limit:
+                stored, dbname, key = heapq.heappop(expiry)
+                entries = self.cache.get(dbname)
+                if entries is None:
+                    continue
+                entry = entries.peek(key)
+                if entry is not None and entry[1] == stored:
+                    try:
+                        del entries[key]
+                        self.expired += 1
+                    except KeyError:
+                        pass
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """ Return a human-readable line of the usage of this cache
+        """
+        lookups = self.hits + self.misses
+        size = 0
+        evicted = self.evicted
+        for entries in self.cache.values():
+            evicted += entries.evicted
+            if _getsizeof is not None:
+                for value in entries.itervalues():
+                    size += _approx_size(value[0])
+        size_str = ''
+        if _getsizeof is not None:
+            size_str = ', ~%d KiB' % (size / 1024)
+        return "%s: %d entries in %d db (max %d each%s), hits: %d (%.1f%%), misses: %d, " \
+               "evicted: %d, expired: %d, cleared: %d, miss time: avg %.3fms" % \
+                (self.name, self.count(), len(self.cache), self.size, size_str,
+                 self.hits, lookups and (self.hits * 100.0 / lookups) or 0.0,
+                 self.misses, evicted, self.expired, self.cleared,
+                 self.miss_calls and (self.miss_time * 1000.0 / self.miss_calls) or 0.0)
+
+    def count(self):
+        return sum([len(entries) for entries in self.cache.values()])
+
+    @classmethod
+    def all_stats(cls):
+        """ Return a human-readable summary of all the caches, the most
+            used first
+        """
+        caches = [c for c in cls.__caches if c.fun is not None]
+        caches.sort(key=lambda c: -(c.hits + c.misses))
+        hits = sum([c.hits for c in caches])
+        misses = sum([c.misses for c in caches])
+        res = "Caches: %d, entries: %d, hits: %d (%.1f%%), misses: %d\n" % \
+                (len(caches), sum([c.count() for c in caches]), hits,
+                 (hits + misses) and (hits * 100.0 / (hits + misses)) or 0.0, misses)
+        for c in caches:
+            res += "    %s\n" % c.stats()
+        return res
+
+    @classmethod
+    def _start_stats_log(cls):
+        if cls.__stats_started:
+            return
+        interval = int(config.get_misc('cache', 'stats_interval', 3600))
+        if interval > 0:
+            cls.__stats_started = True
+            netsvc.Agent.setAlarm(cls._log_stats, time.time() + interval, None, interval)
+
+    @classmethod
+    def _log_stats(cls, interval):
+        logger = logging.getLogger('tools.cache')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(cls.all_stats())
+        else:
+            logger.info(cls.all_stats().split('\n', 1)[0])
+        netsvc.Agent.setAlarm(cls._log_stats, time.time() + interval, None, interval)
+
     def debug(self, *args, **kwargs):
         if not self._debug:
             return
@@ -869,19 +1022,123 @@ class cache(object):
             if *args and **kwargs are both empty, clear all the keys related to this database
         """
         if not args and not kwargs:
-            keys_to_del = [key for key in self.cache.keys() if key[0][1] == dbname]
+            keys = None
         else:
             kwargs2 = self._unify_args(*args, **kwargs)
-            keys_to_del = [key for key, _ in self._generate_keys(dbname, kwargs2) if key in self.cache.keys()]
+            keys = [key for key, _ in self._generate_keys(dbname, kwargs2)]
+        self._clear_keys(dbname, keys)
+        self._add_pending(dbname, self.name, keys)
+
+    def _clear_keys(self, dbname, keys=None):
+        """ Clear keys, or all the keys of dbname, in this process only """
+        if keys is None:
+            # the items of the expiry heap are dropped lazily
+            entries = self.cache.pop(dbname, None)
+            if entries is not None:
+                self.debug("Clearing cache for: %s, %s", repr(self.fun), dbname)
+                self.cleared += len(entries)
+                self.evicted += entries.evicted
+            return
 
-        self.debug("Clearing cache for: %s, %s", repr(self.fun), repr(keys_to_del))
-        for key in keys_to_del:
-            self.cache.pop(key)
+        entries = self.cache.get(dbname)
+        if entries is None:
+            return
+        self.debug("Clearing cache for: %s, %s", repr(self.fun), repr(keys))
+        for key in keys:
+            try:
+                del entries[key]
+                self.cleared += 1
+            except KeyError:
+                pass
 
     @classmethod
-    def clean_caches_for_db(cls, dbname):
+    def clean_caches_for_db(cls, dbname, publish=True):
         for c in cls.__caches:
-            c.clear(dbname)
+            c._clear_keys(dbname)
+        if publish:
+            cls._add_pending(dbname)
+        else:
+            cls._pending().pop(dbname, None)
+
+    @classmethod
+    def _pending(cls):
+        pending = getattr(cls.__local, 'pending', None)
+        if pending is None:
+            pending = cls.__local.pending = {}
+        return pending
+
+    @classmethod
+    def _add_pending(cls, dbname, name=None, keys=None):
+        if name is None:
+            cls._pending()[dbname] = None
+            return
+        pending = cls._pending().setdefault(dbname, {})
+        if pending is None:
+            return
+        if keys is None:
+            pending[name] = None
+        elif pending.get(name, ()) is not None:
+            pending.setdefault(name, set()).update(keys)
+
+    @classmethod
+    def discard(cls, cr):
+        """ Do not publish the clearings made by this thread for the database
+            of cr, whose transaction is rolled back (called by cr.rollback()),
+            but clear their keys again in this process: they may have been
+            computed since from the rows the transaction changed.
+        """
+        pending = cls._pending().pop(cr.dbname, {})
+        if pending is None:
+            for c in cls.__caches:
+                c._clear_keys(cr.dbname)
+            return
+        for name, keys in pending.items():
+            c = cls.__by_name.get(name)
+            if c is not None:
+                c._clear_keys(cr.dbname, keys)
+
+    @classmethod
+    def publish(cls, cr):
+        """ Notify the clearings made by this thread for the database of
+            cr, within its transaction (called by cr.commit())
+        """
+        pending = cls._pending().pop(cr.dbname, {})
+        if not pending and pending is not None:
+            return
+        if not config.get_misc('cache', 'notify', True):
+            return
+        if pending is None:
+            cr.notify(cls.CHANNEL, '')
+            return
+        for name, keys in pending.items():
+            payload = name
+            if keys is not None:
+                # without the leading ('dbname', ..) of each key
+                payload = '%s\n%r' % (name, [key[1:] for key in keys])
+                if len(payload) > cls.PAYLOAD_MAX:
+                    payload = name
+            cr.notify(cls.CHANNEL, payload)
+
+    @classmethod
+    def notified(cls, dbname, payload):
+        """ Apply the clearings published by another process (see
+            sql_db.listen())
+        """
+        if not payload:
+            cls.clean_caches_for_db(dbname, publish=False)
+            return
+        name, _sep, keys = payload.partition('\n')
+        c = cls.__by_name.get(name)
+        if c is None:
+            return
+        if keys:
+            try:
+                keys = [(('dbname', dbname),) + key for key in literal_eval(keys)]
+            except (ValueError, SyntaxError):
+                keys = None
+        else:
+            keys = None
+        c._clear_keys(dbname, keys)
 
     def clear_cache_stub(self, dbname, *args, **kwargs):
         pass
@@ -894,6 +1151,9 @@ class cache(object):
         if self.fun is not None:
             raise Exception("Can not use a cache instance on more than one function")
         self.fun = fn
+        # the same in all the server processes
+        self.name = '%s.%s:%d' % (fn.__module__, fn.__name__, fn.func_code.co_firstlineno)
+        cache.__by_name[self.name] = self
 
         argspec = inspect.getargspec(fn)
         self.fun_arg_names = argspec[0][self.skiparg:]
@@ -904,37 +1164,38 @@ class cache(object):
         def cached_result(self2, cr, *args, **kwargs):
             if hasattr(self2, '_debug'):
                 self._debug = self2._debug
-            if time.time()-int(self.timeout) > self.lasttime:
-                self.lasttime = time.time()
-                t = time.time()-int(self.timeout)
-                old_keys = [key for key in self.cache.keys() if self.cache[key][1] < t]
-                for key in old_keys:
-                    self.cache.pop(key)
+            self._expire()
 
             kwargs2 = self._unify_args(*args, **kwargs)
 
             result = {}
             notincache = {}
+            entries = self.cache.get(cr.dbname) or {}
             for key, id in self._generate_keys(cr.dbname, kwargs2):
-                if key in self.cache:
-                    result[id] = self.cache[key][0]
-                else:
+                try:
+                    result[id] = entries[key][0]
+                except KeyError:
                     notincache[id] = key
 
+            self.hits += len(result)
             if notincache:
+                self.misses += len(notincache)
                 if self.multi:
                     kwargs2[self.multi] = notincache.keys()
 
                 self.debug("Must call %s for keys: %s", repr(fn), repr(kwargs2))
+                t0 = time.time()
                 result2 = fn(self2, cr, *args[:self.skiparg-2], **kwargs2)
+                self.miss_calls += 1
+                self.miss_time += time.time() - t0
                 if not self.multi:
                     key = notincache[None]
-                    self.cache[key] = (result2, time.time())
+                    self._store(cr.dbname, key, result2)
                     result[None] = result2
                 else:
                     for id in result2:
                         key = notincache[id]
-                        self.cache[key] = (result2[id], time.time())
+                        self._store(cr.dbname, key, result2[id])
                     result.update(result2)
             else:
                 self.debug("Got all results for %s from cache: %s", repr(fn), repr(result))
@@ -38,7 +38,7 @@ from opcode import HAVE_ARGUMENT, opmap, opname
 from types import CodeType
 import logging
 
-__all__ = ['test_expr', 'literal_eval', 'safe_eval', 'const_eval' ]
+__all__ = ['test_expr', 'literal_eval', 'safe_eval', 'safe_compile', 'const_eval' ]
 
 # The time module is usually already provided in the safe_eval environment
 # but some code, e.g. datetime.datetime.now() (Windows/Python 2.5.2, bug
@@ -218,6 +218,30 @@ def _import(name, globals={}, locals={}, fromlist=[], level=-1):
         return __import__(name, globals, locals, level)
     raise ImportError(name)
 
+class compiled_expr(object):
+    """ An expression checked and compiled by safe_compile(), that can be
+        given to safe_eval() in place of its source
+    """
+    __slots__ = ('expr', 'mode', 'code')
+
+    def __init__(self, expr, mode, code):
+        self.expr = expr
+        self.mode = mode
+        self.code = code
+
+    def __repr__(self):
+        return '<compiled_expr %r>' % self.expr
+
+def safe_compile(expr, mode="eval"):
+    """safe_compile(expression[, mode]) -> compiled_expr
+
+    Check and compile an expression once, to evaluate it many times with
+    safe_eval(). Raise like safe_eval() does.
+    """
+    if '__subclasses__' in expr:
+       raise ValueError('expression not allowed (__subclasses__)')
+    return compiled_expr(expr, mode, test_expr(expr, _SAFE_OPCODES, mode=mode))
+
 def safe_eval(expr, globals_dict=None, locals_dict=None, mode="eval", nocopy=False):
     """safe_eval(expression[, globals[, locals[, mode[, nocopy]]]]) -> result
 
@@ -241,8 +265,12 @@ def safe_eval(expr, globals_dict=None, locals_dict=None, mode="eval", nocopy=Fal
     if isinstance(expr, CodeType):
         raise ValueError("safe_eval does not allow direct evaluation of code objects.")
 
-    if '__subclasses__' in expr:
-       raise ValueError('expression not allowed (__subclasses__)')
+    if isinstance(expr, compiled_expr):
+        code_obj = expr.code
+    else:
+        if '__subclasses__' in expr:
+           raise ValueError('expression not allowed (__subclasses__)')
+        code_obj = None
 
     if globals_dict is None:
         globals_dict = {}
@@ -282,7 +310,9 @@ def safe_eval(expr, globals_dict=None, locals_dict=None, mode="eval", nocopy=Fal
                 'set' : set
             }
     )
-    return eval(test_expr(expr,_SAFE_OPCODES, mode=mode), globals_dict, locals_dict)
+    if code_obj is None:
+        code_obj = test_expr(expr,_SAFE_OPCODES, mode=mode)
+    return eval(code_obj, globals_dict, locals_dict)
 
 import logging
 import traceback
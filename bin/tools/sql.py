@@ -25,4 +25,207 @@ def drop_view_if_exists(cr, viewname):
         cr.execute("DROP view %s" % (viewname,))
         cr.commit()
 
+class SchemaSnapshot(object):
+    """ The tables, columns, indexes and constraints of the database, plus
+        the ir_model and ir_model_fields rows, each read in one query
+
+        The orm consults it while creating or updating the tables of the
+        models, instead of querying the catalog for every column. The
+        changes it makes are recorded back (altered tables are forgotten and
+        read again at next use), so the snapshot stays valid as long as
+        nobody else alters the schema: call reset() after arbitrary DDL (eg.
+        migration scripts). Tables not in the snapshot are looked up in the
+        catalog again, because the init() of models may create views at any
+        time.
+    """
+    _nsp_clause = "IN (SELECT oid FROM pg_namespace WHERE nspname = ANY(current_schemas(false)))"
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.loaded = False
+        self.tables = {}        # relname: relkind
+        self.columns = {}       # relname: { attname: {typname, size, attnotnull ...} }
+        self.indexes = {}       # indexname: tablename
+        self.fkeys = {}         # (table, column, foreign table): (confdeltype, conname)
+        self.constraints = {}   # conname: [definitions]
+        self.models = {}        # model: ir_model id
+        self.model_fields = {}  # model: { field name: ir_model_fields row }
+        self.model_data = set() # (module, model, name, res_id) of ir.model(.fields)
+        self.data_names = set() # names of the ir.model.fields ir_model_data
+
+    def load(self, cr, model=None, table=None):
+        """ Read the whole catalog, or with model and table, only what the
+            _auto_init() of that model looks at: its table, and its rows of
+            ir_model, ir_model_fields and their ir_model_data. The other
+            tables are still looked up when asked for.
+        """
+        if self.loaded:
+            return
+        self.reset()
+        if model:
+            self._load_model(cr, model, table)
+            self.loaded = True
+            return
+        self._load_columns(cr)
+
+        cr.execute("SELECT indexname, tablename FROM pg_indexes")
+        self.indexes = dict(cr.fetchall())
+
+        cr.execute("SELECT cl1.relname, att1.attname, cl2.relname, att2.attname, "
+                    "  con.confdeltype, con.conname "
+                    "FROM pg_constraint AS con, pg_class AS cl1, pg_class AS cl2, "
+                    "  pg_attribute AS att1, pg_attribute AS att2 "
+                    "WHERE con.contype = 'f' "
+                    "  AND con.conrelid = cl1.oid AND con.confrelid = cl2.oid "
+                    "  AND cl1.relnamespace " + self._nsp_clause +
+                    "  AND cl2.relnamespace " + self._nsp_clause +
+                    "  AND array_lower(con.conkey, 1) = 1 AND con.conkey[1] = att1.attnum "
+                    "  AND att1.attrelid = cl1.oid "
+                    "  AND array_lower(con.confkey, 1) = 1 AND con.confkey[1] = att2.attnum "
+                    "  AND att2.attrelid = cl2.oid")
+        for table, column, ftable, fcolumn, deltype, conname in cr.fetchall():
+            if fcolumn == 'id':
+                self.fkeys.setdefault((table, column, ftable), (deltype, conname))
+
+        cr.execute("SELECT conname, pg_catalog.pg_get_constraintdef(oid, true) FROM pg_constraint")
+        for conname, condef in cr.fetchall():
+            self.constraints.setdefault(conname, []).append(condef)
+
+        cr.execute("SELECT model, id FROM ir_model")
+        self.models = dict(cr.fetchall())
+        cr.execute("SELECT * FROM ir_model_fields")
+        for row in cr.dictfetchall():
+            self.model_fields.setdefault(row['model'], {})[row['name']] = row
+        cr.execute("SELECT module, model, name, res_id FROM ir_model_data "
+                    "WHERE model IN ('ir.model', 'ir.model.fields')")
+        for row in cr.fetchall():
+            self.model_data.add(row)
+            if row[1] == 'ir.model.fields':
+                self.data_names.add(row[2])
+        self.loaded = True
+
+    def _load_model(self, cr, model, table):
+        self._load_columns(cr, table)
+
+        cr.execute("SELECT indexname, tablename FROM pg_indexes WHERE tablename = %s", (table,))
+        self.indexes = dict(cr.fetchall())
+
+        cr.execute("SELECT att1.attname, cl2.relname, att2.attname, "
+                    "  con.confdeltype, con.conname "
+                    "FROM pg_constraint AS con, pg_class AS cl1, pg_class AS cl2, "
+                    "  pg_attribute AS att1, pg_attribute AS att2 "
+                    "WHERE con.contype = 'f' AND cl1.relname = %s "
+                    "  AND con.conrelid = cl1.oid AND con.confrelid = cl2.oid "
+                    "  AND cl1.relnamespace " + self._nsp_clause +
+                    "  AND cl2.relnamespace " + self._nsp_clause +
+                    "  AND array_lower(con.conkey, 1) = 1 AND con.conkey[1] = att1.attnum "
+                    "  AND att1.attrelid = cl1.oid "
+                    "  AND array_lower(con.confkey, 1) = 1 AND con.confkey[1] = att2.attnum "
+                    "  AND att2.attrelid = cl2.oid", (table,))
+        for column, ftable, fcolumn, deltype, conname in cr.fetchall():
+            if fcolumn == 'id':
+                self.fkeys.setdefault((table, column, ftable), (deltype, conname))
+
+        cr.execute("SELECT con.conname, pg_catalog.pg_get_constraintdef(con.oid, true) "
+                    "FROM pg_constraint AS con, pg_class AS cl "
+                    "WHERE con.conrelid = cl.oid AND cl.relname = %s "
+                    "  AND cl.relnamespace " + self._nsp_clause, (table,))
+        for conname, condef in cr.fetchall():
+            self.constraints.setdefault(conname, []).append(condef)
+
+        cr.execute("SELECT model, id FROM ir_model WHERE model = %s", (model,))
+        self.models = dict(cr.fetchall())
+        cr.execute("SELECT * FROM ir_model_fields WHERE model = %s", (model,))
+        for row in cr.dictfetchall():
+            self.model_fields.setdefault(row['model'], {})[row['name']] = row
+        # the names of the fields of other tables may collide with ours too
+        prefix = 'field_%s_' % table
+        cr.execute("SELECT module, model, name, res_id FROM ir_model_data "
+                    "WHERE (model = 'ir.model' "
+                    "       AND res_id IN (SELECT id FROM ir_model WHERE model = %s)) "
+                    "   OR (model = 'ir.model.fields' "
+                    "       AND (res_id IN (SELECT id FROM ir_model_fields WHERE model = %s) "
+                    "            OR substr(name, 1, %s) = %s))",
+                    (model, model, len(prefix), prefix))
+        for row in cr.fetchall():
+            self.model_data.add(row)
+            if row[1] == 'ir.model.fields':
+                self.data_names.add(row[2])
+
+    def _load_columns(self, cr, table=None):
+        query = "SELECT c.relname, c.relkind, a.attname, a.attlen, a.atttypmod, " \
+                "  a.attnotnull, a.atthasdef, t.typname, " \
+                "  CASE WHEN a.attlen=-1 THEN a.atttypmod-4 ELSE a.attlen END AS size " \
+                "FROM pg_class c " \
+                "  LEFT JOIN pg_attribute a ON (a.attrelid = c.oid AND a.attnum > 0 " \
+                                                "AND NOT a.attisdropped) " \
+                "  LEFT JOIN pg_type t ON (a.atttypid = t.oid) " \
+                "WHERE c.relkind IN ('r','v') AND c.relnamespace " + self._nsp_clause
+        if table:
+            cr.execute(query + " AND c.relname = %s", (table,))
+        else:
+            cr.execute(query)
+        for row in cr.dictfetchall():
+            relname = row.pop('relname')
+            self.tables[relname] = row.pop('relkind')
+            cols = self.columns.setdefault(relname, {})
+            if row['attname']:
+                cols[row['attname']] = row
+
+    def table_columns(self, cr, table):
+        """ The columns of table, as {name: description}, or None if there
+            is no such table (or view)
+        """
+        if table not in self.tables:
+            # created or altered since the snapshot, look it up
+            self._load_columns(cr, table)
+        return self.columns.get(table)
+
+    def has_table(self, cr, table):
+        return self.table_columns(cr, table) is not None
+
+    def forget(self, table):
+        """ Have the columns of table read again at next use, once it has
+            been altered
+        """
+        self.tables.pop(table, None)
+        self.columns.pop(table, None)
+
+    def note_index(self, indexname, table, drop=False):
+        if drop:
+            self.indexes.pop(indexname, None)
+        else:
+            self.indexes[indexname] = table
+
+    def get_fkey(self, cr, table, column, ftable):
+        """ (confdeltype, conname) of the foreign key from table.column to
+            ftable.id, or None
+        """
+        res = self.fkeys.get((table, column, ftable))
+        if res and res[1] is None:
+            # added through the snapshot, Postgres chose its name
+            cr.execute("SELECT con.conname FROM pg_constraint AS con, pg_class AS cl1, "
+                        "  pg_class AS cl2, pg_attribute AS att1 "
+                        "WHERE con.contype = 'f' AND con.conrelid = cl1.oid "
+                        "  AND con.confrelid = cl2.oid AND cl1.relname = %s "
+                        "  AND cl2.relname = %s AND cl1.relnamespace " + self._nsp_clause +
+                        "  AND array_lower(con.conkey, 1) = 1 AND con.conkey[1] = att1.attnum "
+                        "  AND att1.attrelid = cl1.oid AND att1.attname = %s",
+                        (table, ftable, column))
+            row = cr.fetchone()
+            res = row and (res[0], row[0]) or None
+            self.fkeys[(table, column, ftable)] = res
+        return res
+
+    def note_fkey(self, table, column, ftable, deltype):
+        self.fkeys[(table, column, ftable)] = (deltype, None)
+
+    def note_constraint(self, conname, condef, drop=False):
+        if drop:
+            self.constraints.pop(conname, None)
+        else:
+            self.constraints[conname] = [condef]
+
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -592,8 +592,6 @@ def trans_generate(lang, modules, cr):
     query_models = query_models % query_patch
 
 
-    cr.execute(query, query_param)
-
     _to_translate = []
     def push_translation(module, type, name, id, source):
         tup = (module, source, name, id, type)
@@ -605,7 +603,13 @@ def trans_generate(lang, modules, cr):
             return s.encode('utf8')
         return s
 
-    for (xml_name,model,res_id,module) in cr.fetchall():
+    def _iter_rows(query, params):
+        # stream the ir_model_data rows, there can be many of them
+        for rows in cr.execute_iter(query, params):
+            for row in rows:
+                yield row
+
+    for (xml_name,model,res_id,module) in _iter_rows(query, query_param):
         module = encode(module)
         model = encode(model)
         xml_name = "%s.%s" % (module, encode(xml_name))
@@ -686,8 +690,7 @@ def trans_generate(lang, modules, cr):
                 push_translation(module, 'help', name, 0, encode(field_def.help))
 
             if field_def.translate:
-                ids = objmodel.search(cr, uid, [])
-                obj_values = objmodel.read(cr, uid, ids, [field_name])
+                obj_values = objmodel.search_read_iter(cr, uid, [], fields=[field_name])
                 for obj_value in obj_values:
                     res_id = obj_value['id']
                     if obj.name in ('ir.model', 'ir.ui.menu'):
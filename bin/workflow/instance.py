@@ -19,62 +19,167 @@
 #
 ##############################################################################
 
+import wkf_graph
 import wkf_logs
 import workitem
 
 import netsvc
 import pooler
+import threading
+import tools
+
+# the sets of instances processed, one per _active_instances() running in
+# the thread
+_processed = threading.local()
+
+def _process(inst_id):
+    """ Record that inst_id is processed, see _active_instances() """
+    for done in getattr(_processed, 'sets', ()):
+        done.add(inst_id)
 
 def create(cr, ident, wkf_id):
     (uid,res_type,res_id) = ident
     cr.execute('insert into wkf_instance (res_type,res_id,uid,wkf_id) values (%s,%s,%s,%s) RETURNING id', (res_type,res_id,uid,wkf_id))
     id_new = cr.fetchone()[0]
-    cr.execute('select * from wkf_activity where flow_start=True and wkf_id=%s', (wkf_id,))
-    res = cr.dictfetchall()
+    res = wkf_graph.get(cr).starts.get(wkf_id, [])
     stack = []
     workitem.create(cr, res, id_new, ident, stack=stack)
     update(cr, id_new, ident)
     return id_new
 
+def create_multi(cr, uid, res_type, res_ids, wkf_id):
+    """ Start the workflow wkf_id on each of the records res_ids, as create()
+        does for one record, with the instances inserted by one query per
+        IN_MAX records
+
+        @return the list of the new instance ids, in the order of res_ids
+    """
+    res = wkf_graph.get(cr).starts.get(wkf_id, [])
+    new_ids = []
+    for sub_ids in tools.misc.split_every(cr.IN_MAX, res_ids):
+        cr.execute("select nextval('wkf_instance_id_seq') from generate_series(1, %s)", (len(sub_ids),))
+        ids = [x[0] for x in cr.fetchall()]
+        params = []
+        for id_new, res_id in zip(ids, sub_ids):
+            params += [id_new, res_type, res_id, uid, wkf_id]
+        cr.execute('insert into wkf_instance (id,res_type,res_id,uid,wkf_id) values ' + \
+                   ','.join(['(%s,%s,%s,%s,%s)'] * len(ids)), params)
+        new_ids.extend(ids)
+    for id_new, res_id in zip(new_ids, res_ids):
+        ident = (uid, res_type, res_id)
+        stack = []
+        workitem.create(cr, res, id_new, ident, stack=stack)
+        update(cr, id_new, ident)
+    return new_ids
+
 def delete(cr, ident):
     (uid,res_type,res_id) = ident
     cr.execute('delete from wkf_instance where res_id=%s and res_type=%s', (res_id,res_type))
 
-def validate(cr, inst_id, ident, signal, force_running=False):
-    cr.execute("select * from wkf_workitem where inst_id=%s", (inst_id,))
+def validate(cr, inst_id, ident, signal, force_running=False, witems=None):
+    _process(inst_id)
+    if witems is None:
+        cr.execute("select * from wkf_workitem where inst_id=%s", (inst_id,))
+        witems = cr.dictfetchall()
     stack = []
-    for witem in cr.dictfetchall():
+    cache = {}
+    for witem in witems:
         stack = []
-        workitem.process(cr, witem, ident, signal, force_running, stack=stack)
+        workitem.process(cr, witem, ident, signal, force_running, stack=stack, cache=cache)
         # An action is returned
     _update_end(cr, inst_id, ident)
     return stack and stack[0] or False
 
-def update(cr, inst_id, ident):
-    cr.execute("select * from wkf_workitem where inst_id=%s", (inst_id,))
-    for witem in cr.dictfetchall():
+def update(cr, inst_id, ident, witems=None):
+    _process(inst_id)
+    if witems is None:
+        cr.execute("select * from wkf_workitem where inst_id=%s", (inst_id,))
+        witems = cr.dictfetchall()
+    cache = {}
+    for witem in witems:
         stack = []
-        workitem.process(cr, witem, ident, stack=stack)
+        workitem.process(cr, witem, ident, stack=stack, cache=cache)
     return _update_end(cr, inst_id, ident)
 
+def update_multi(cr, uid, res_type, res_ids):
+    """ update() the active instances of the records res_ids of res_type """
+    for inst_id, ident, witems in _active_instances(cr, uid, res_type, res_ids):
+        update(cr, inst_id, ident, witems)
+
+def validate_multi(cr, uid, res_type, res_ids, signal):
+    """ validate() signal on the active instances of the records res_ids
+
+        @return {res_id: result of validate()} for the records having an
+                active instance
+    """
+    result = {}
+    for inst_id, ident, witems in _active_instances(cr, uid, res_type, res_ids):
+        res2 = validate(cr, inst_id, ident, signal, witems=witems)
+        result[ident[2]] = result.get(ident[2]) or res2
+    return result
+
+def _active_instances(cr, uid, res_type, res_ids):
+    """ Yield (inst_id, ident, workitems) for the active instances of the
+        records res_ids, in the order of res_ids
+
+        The instances, then their workitems, are read with one query each
+        per IN_MAX records. An instance that was processed meanwhile by the
+        processing of a previous one (eg. through a subflow) has its
+        workitems read again, and is skipped if it is no longer active.
+    """
+    seen = set()
+    res_ids = [x for x in res_ids if x and not (x in seen or seen.add(x))]
+    done = set()
+    if not hasattr(_processed, 'sets'):
+        _processed.sets = []
+    _processed.sets.append(done)
+    try:
+        for sub_ids in tools.misc.split_every(cr.IN_MAX, res_ids):
+            cr.execute("select id,res_id from wkf_instance where res_id in %s and res_type=%s and state=%s order by id",
+                       (sub_ids, res_type, 'active'))
+            instances = {}
+            witems = {}
+            for inst_id, res_id in cr.fetchall():
+                instances.setdefault(res_id, []).append(inst_id)
+                witems[inst_id] = []
+            if not witems:
+                continue
+            cr.execute("select * from wkf_workitem where inst_id in %s", (tuple(witems),))
+            for witem in cr.dictfetchall():
+                witems[witem['inst_id']].append(witem)
+            done.clear()
+            for res_id in sub_ids:
+                for inst_id in instances.get(res_id, []):
+                    if inst_id in done:
+                        cr.execute("select w.* from wkf_instance i left join wkf_workitem w on (w.inst_id=i.id) where i.id=%s and i.state=%s",
+                                   (inst_id, 'active'))
+                        rows = cr.dictfetchall()
+                        if not rows:
+                            continue
+                        witems[inst_id] = [w for w in rows if w['id']]
+                    yield inst_id, (uid, res_type, res_id), witems[inst_id]
+    finally:
+        _processed.sets.remove(done)
+
 def _update_end(cr, inst_id, ident):
-    cr.execute('select wkf_id from wkf_instance where id=%s', (inst_id,))
-    wkf_id = cr.fetchone()[0]
-    cr.execute('select state,flow_stop from wkf_workitem w left join wkf_activity a on (a.id=w.act_id) where w.inst_id=%s', (inst_id,))
+    cr.execute('select state,act_id from wkf_workitem where inst_id=%s', (inst_id,))
+    witems = cr.fetchall()
+    activities = {}
+    for state, act_id in witems:
+        activities[act_id] = wkf_graph.get_activity(cr, act_id)[1]
     ok=True
-    for r in cr.fetchall():
-        if (r[0]<>'complete') or not r[1]:
+    for state, act_id in witems:
+        if (state<>'complete') or not activities[act_id]['flow_stop']:
             ok=False
             break
     if ok:
-        cr.execute('select distinct a.name from wkf_activity a left join wkf_workitem w on (a.id=w.act_id) where w.inst_id=%s', (inst_id,))
-        act_names = cr.fetchall()
+        act_names = set([activity['name'] for activity in activities.values()])
         cr.execute("update wkf_instance set state='complete' where id=%s", (inst_id,))
         cr.execute("update wkf_workitem set state='complete' where subflow_id=%s", (inst_id,))
         cr.execute("select i.id,w.osv,i.res_id from wkf_instance i left join wkf w on (i.wkf_id=w.id) where i.id IN (select inst_id from wkf_workitem where subflow_id=%s)", (inst_id,))
         for i in cr.fetchall():
             for act_name in act_names:
-                validate(cr, i[0], (ident[0],i[1],i[2]), 'subflow.'+act_name[0])
+                validate(cr, i[0], (ident[0],i[1],i[2]), 'subflow.'+act_name)
     return ok
 
 
@@ -20,41 +20,81 @@
 ##############################################################################
 
 import sys
+import weakref
 import netsvc
 import osv as base
 import pooler
-from tools.safe_eval import safe_eval as eval
+from tools.safe_eval import safe_eval as eval, safe_compile
 
 class Env(dict):
-    def __init__(self, cr, uid, model, ids):
+    """ The names a workflow expression sees: the fields and methods of the
+        record ids[0], browsed once, on the first of them looked up
+
+        cache is the browse cache of the record, shared by the Envs of the
+        steps of an instance (see workitem.process()).
+    """
+    def __init__(self, cr, uid, model, ids, cache=None):
         self.cr = cr
         self.uid = uid
         self.model = model
         self.ids = ids
         self.obj = pooler.get_pool(cr.dbname).get(model)
-        self.columns = self.obj._columns.keys() + self.obj._inherit_fields.keys()
+        self.cache = cache
+        self.record = None
 
     def __getitem__(self, key):
-        if (key in self.columns) or (key in dir(self.obj)):
-            res = self.obj.browse(self.cr, self.uid, self.ids[0])
-            return res[key]
+        if key in self.obj._columns or key in self.obj._inherit_fields \
+                or key in _attributes(self.obj):
+            if self.record is None:
+                self.record = self.obj.browse(self.cr, self.uid, self.ids[0], cache=self.cache)
+            return self.record[key]
         else:
             return super(Env, self).__getitem__(key)
 
-def _eval_expr(cr, ident, workitem, action):
-    ret=False
-    assert action, 'You used a NULL action in a workflow, use dummy node instead.'
+_obj_attributes = weakref.WeakKeyDictionary()   # {object: frozenset(dir(object))}
+
+def _attributes(obj):
+    names = _obj_attributes.get(obj)
+    if names is None:
+        names = _obj_attributes[obj] = frozenset(dir(obj))
+    return names
+
+def compile_expr(action):
+    """ Compile the lines of a workflow expression (see _eval_expr()):
+        True, False or their compiled expression.
+
+        The lines that do not compile are kept as they are, to raise
+        when they are evaluated.
+    """
+    lines = []
     for line in action.split('\n'):
         line = line.strip()
-        uid=ident[0]
-        model=ident[1]
-        ids=[ident[2]]
         if line =='True':
-            ret=True
+            lines.append(True)
         elif line =='False':
-            ret=False
+            lines.append(False)
+        else:
+            try:
+                lines.append(safe_compile(line))
+            except Exception:
+                lines.append(line)
+    return tuple(lines)
+
+def _eval_expr(cr, ident, workitem, action, env=None):
+    """ Evaluate the lines of action, a string or the result of
+        compile_expr(), in env (by default an Env of the record of ident)
+        and return the value of the last one
+    """
+    ret=False
+    assert action, 'You used a NULL action in a workflow, use dummy node instead.'
+    if isinstance(action, basestring):
+        action = compile_expr(action)
+    for line in action:
+        if line is True or line is False:
+            ret = line
         else:
-            env = Env(cr, uid, model, ids)
+            if env is None:
+                env = Env(cr, ident[0], ident[1], [ident[2]])
             ret = eval(line, env, nocopy=True)
     return ret
 
@@ -65,20 +105,19 @@ def execute_action(cr, ident, workitem, activity):
     return result
 
 def execute(cr, ident, workitem, activity):
-    return _eval_expr(cr, ident, workitem, activity['action'])
+    return _eval_expr(cr, ident, workitem, activity.get('action_code') or activity['action'])
 
-def check(cr, workitem, ident, transition, signal):
+def check(cr, workitem, ident, transition, signal, env=None):
     if transition['signal'] and signal != transition['signal']:
         return False
 
     uid = ident[0]
     if transition['group_id'] and uid != 1:
         pool = pooler.get_pool(cr.dbname)
-        user_groups = pool.get('res.users').read(cr, uid, [uid], ['groups_id'])[0]['groups_id']
-        if not transition['group_id'] in user_groups:
+        if transition['group_id'] not in pool.get('ir.model.access').get_user_groups(cr, uid):
             return False
 
-    return _eval_expr(cr, ident, workitem, transition['condition'])
+    return _eval_expr(cr, ident, workitem, transition.get('condition_code') or transition['condition'], env)
 
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#    
+#    OpenERP, Open Source Management Solution
+#    Copyright (C) 2004-2009 Tiny SPRL (<http://tiny.be>).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.     
+#
+##############################################################################
+
+#.apidoc title: Compiled workflow definitions
+
+import sql_db
+import tools
+import wkf_expr
+
+class workflow_graph(object):
+    """ The workflows of a database, with their activities and transitions,
+        loaded at once and kept in memory (see get())
+
+        The activities and transitions are the dicts of their rows, plus
+        the compiled expressions of their 'action', 'condition' and
+        'trigger_expr_id'. They are shared: never modify them.
+    """
+    def __init__(self, cr):
+        #: {osv: [wkf_id]} of the workflows started on create
+        self.on_create = {}
+        #: {wkf_id: osv}
+        self.osv = {}
+        #: {act_id: activity}
+        self.activities = {}
+        #: {wkf_id: [activity]} of the flow_start activities
+        self.starts = {}
+        #: {trans_id: transition}
+        self.transitions = {}
+        #: {act_id: [transition]} leaving each activity
+        self.outgoing = {}
+        #: {act_id: [trans_id]} reaching each activity
+        self.incoming = {}
+
+        cr.execute('SELECT id, osv, on_create FROM wkf ORDER BY id')
+        for wkf_id, osv, on_create in cr.fetchall():
+            self.osv[wkf_id] = osv
+            if on_create:
+                self.on_create.setdefault(osv, []).append(wkf_id)
+
+        cr.execute('SELECT * FROM wkf_activity ORDER BY id')
+        for act in cr.dictfetchall():
+            act['action_code'] = act['action'] and wkf_expr.compile_expr(act['action'])
+            self.activities[act['id']] = act
+            if act['flow_start']:
+                self.starts.setdefault(act['wkf_id'], []).append(act)
+
+        cr.execute('SELECT * FROM wkf_transition ORDER BY id')
+        for trans in cr.dictfetchall():
+            trans['condition_code'] = trans['condition'] and wkf_expr.compile_expr(trans['condition'])
+            trans['trigger_expr_code'] = trans['trigger_expr_id'] and \
+                    wkf_expr.compile_expr(trans['trigger_expr_id'])
+            self.transitions[trans['id']] = trans
+            self.outgoing.setdefault(trans['act_from'], []).append(trans)
+            self.incoming.setdefault(trans['act_to'], []).append(trans['id'])
+
+_graphs = {}   # {dbname: workflow_graph}
+
+def get(cr):
+    """ The workflow_graph of the database of cr
+
+        The transactions which changed the workflows (see clear()) get
+        their own graph, kept on the cursor until the transaction ends,
+        so that the shared one only ever holds committed workflows.
+    """
+    graph = getattr(cr, 'workflow_graph', None)
+    if graph is not None:
+        if graph is False:
+            graph = cr.workflow_graph = workflow_graph(cr)
+        return graph
+    graph = _graphs.get(cr.dbname)
+    if graph is None:
+        if cr.dbname not in _graphs and tools.config.get_misc('cache', 'notify', True):
+            # the workflows changed by the other processes
+            sql_db.listen(cr.dbname, 'workflow_graph', _notified)
+        graph = _graphs[cr.dbname] = workflow_graph(cr)
+    return graph
+
+def get_activity(cr, act_id):
+    """ The workflow_graph of the database of cr, and the activity act_id
+
+        The graph is loaded again if the activity was created since.
+    """
+    graph = get(cr)
+    activity = graph.activities.get(act_id)
+    if activity is None:
+        graph = _reload(cr)
+        activity = graph.activities[act_id]
+    return graph, activity
+
+def get_transition(cr, trans_id):
+    """ The workflow_graph of the database of cr, and the transition
+        trans_id
+
+        The graph is loaded again if the transition was created since.
+    """
+    graph = get(cr)
+    transition = graph.transitions.get(trans_id)
+    if transition is None:
+        graph = _reload(cr)
+        transition = graph.transitions[trans_id]
+    return graph, transition
+
+def _reload(cr):
+    if getattr(cr, 'workflow_graph', None) is not None:
+        cr.workflow_graph = False
+    else:
+        _graphs[cr.dbname] = None
+    return get(cr)
+
+def clear(cr):
+    """ Forget the workflow_graph of the database of cr, after workflows,
+        activities or transitions changed (in all the server processes,
+        once the transaction is committed)
+
+        Until then, the transaction of cr uses a graph of its own.
+    """
+    _graphs[cr.dbname] = None
+    cr.workflow_graph = False
+    cr.notify('workflow_graph')
+
+def _notified(dbname, payload):
+    if dbname in _graphs:
+        _graphs[dbname] = None
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
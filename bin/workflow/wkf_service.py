@@ -19,6 +19,7 @@
 #
 ##############################################################################
 
+import wkf_graph
 import wkf_logs
 import workitem
 import instance
@@ -34,12 +35,14 @@ class workflow_service(netsvc.Service):
         self.exportMethod(self.trg_create)
         self.exportMethod(self.trg_validate)
         self.exportMethod(self.trg_redirect)
+        self.exportMethod(self.trg_write_multi)
+        self.exportMethod(self.trg_create_multi)
+        self.exportMethod(self.trg_validate_multi)
         self.exportMethod(self.trg_trigger)
         self.exportMethod(self.clear_cache)
-        self.wkf_on_create_cache={}
 
     def clear_cache(self, cr, uid):
-        self.wkf_on_create_cache[cr.dbname]={}
+        wkf_graph.clear(cr)
 
     def trg_write(self, uid, res_type, res_id, cr):
         ident = (uid,res_type,res_id)
@@ -47,6 +50,12 @@ class workflow_service(netsvc.Service):
         for (id,) in cr.fetchall():
             instance.update(cr, id, ident)
 
+    def trg_write_multi(self, uid, res_type, res_ids, cr):
+        """ trg_write() on each of res_ids, reading their active instances
+            and the workitems of these at once
+        """
+        instance.update_multi(cr, uid, res_type, res_ids)
+
     def trg_trigger(self, uid, res_type, res_id, cr):
         cr.execute('select instance_id from wkf_triggers where res_id=%s and model=%s', (res_id,res_type))
         res = cr.fetchall()
@@ -61,16 +70,15 @@ class workflow_service(netsvc.Service):
 
     def trg_create(self, uid, res_type, res_id, cr):
         ident = (uid,res_type,res_id)
-        self.wkf_on_create_cache.setdefault(cr.dbname, {})
-        if res_type in self.wkf_on_create_cache[cr.dbname]:
-            wkf_ids = self.wkf_on_create_cache[cr.dbname][res_type]
-        else:
-            cr.execute('select id from wkf where osv=%s and on_create=True', (res_type,))
-            wkf_ids = cr.fetchall()
-            self.wkf_on_create_cache[cr.dbname][res_type] = wkf_ids
-        for (wkf_id,) in wkf_ids:
+        for wkf_id in wkf_graph.get(cr).on_create.get(res_type, []):
             instance.create(cr, ident, wkf_id)
 
+    def trg_create_multi(self, uid, res_type, res_ids, cr):
+        """ trg_create() on each of res_ids, inserting their instances at once """
+        res_ids = list(res_ids)
+        for wkf_id in wkf_graph.get(cr).on_create.get(res_type, []):
+            instance.create_multi(cr, uid, res_type, res_ids, wkf_id)
+
     def trg_validate(self, uid, res_type, res_id, signal, cr):
         result = False
         ident = (uid,res_type,res_id)
@@ -81,6 +89,16 @@ class workflow_service(netsvc.Service):
             result = result or res2
         return result
 
+    def trg_validate_multi(self, uid, res_type, res_ids, signal, cr):
+        """ trg_validate() signal on each of res_ids, reading their active
+            instances and the workitems of these at once
+
+            @return {res_id: result of trg_validate()}
+        """
+        result = dict.fromkeys(res_ids, False)
+        result.update(instance.validate_multi(cr, uid, res_type, res_ids, signal))
+        return result
+
     # make all workitems which are waiting for a (subflow) workflow instance
     # for the old resource point to the (first active) workflow instance for
     # the new resource
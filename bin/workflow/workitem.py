@@ -28,9 +28,10 @@ import netsvc
 import instance
 
 import wkf_expr
+import wkf_graph
 import wkf_logs
 
-def create(cr, act_datas, inst_id, ident, stack):
+def create(cr, act_datas, inst_id, ident, stack, cache=None):
     for act in act_datas:
         cr.execute("select nextval('wkf_workitem_id_seq')")
         id_new = cr.fetchone()[0]
@@ -38,35 +39,49 @@ def create(cr, act_datas, inst_id, ident, stack):
         cr.execute('select * from wkf_workitem where id=%s',(id_new,))
         res = cr.dictfetchone()
         wkf_logs.log(cr,ident,act['id'],'active')
-        process(cr, res, ident, stack=stack)
+        process(cr, res, ident, stack=stack, cache=cache)
 
-def process(cr, workitem, ident, signal=None, force_running=False, stack=None):
+def process(cr, workitem, ident, signal=None, force_running=False, stack=None, cache=None):
+    """ Run the activity of workitem if it is active, then follow the
+        transitions leaving it if it is complete
+
+        cache is the browse cache the conditions of the transitions are
+        evaluated with: pass the same dict for all the workitems of an
+        instance, to browse its record once. It is emptied after each
+        activity run, as the activities may modify the record.
+    """
     if stack is None:
         raise RuntimeError('No stack!')
+    if cache is None:
+        cache = {}
     result = True
-    cr.execute('select * from wkf_activity where id=%s', (workitem['act_id'],))
-    activity = cr.dictfetchone()
+    graph, activity = wkf_graph.get_activity(cr, workitem['act_id'])
 
     triggers = False
     if workitem['state']=='active':
         triggers = True
-        result = _execute(cr, workitem, activity, ident, stack)
+        try:
+            result = _execute(cr, workitem, activity, ident, stack)
+        finally:
+            cache.clear()
         if not result:
             return False
 
     if workitem['state']=='running':
         pass
 
+    env = wkf_expr.Env(cr, ident[0], ident[1], [ident[2]], cache)
     if workitem['state']=='complete' or force_running:
-        ok = _split_test(cr, workitem, activity['split_mode'], ident, signal, stack)
+        ok = _split_test(cr, workitem, activity['split_mode'], ident, signal, stack, env, cache)
         triggers = triggers and not ok
 
     if triggers:
-        cr.execute('select * from wkf_transition where act_from=%s', (workitem['act_id'],))
-        alltrans = cr.dictfetchall()
-        for trans in alltrans:
+        # the activities that _split_test() ran may have emptied the cache,
+        # leaving the record of env with its former data
+        env = wkf_expr.Env(cr, ident[0], ident[1], [ident[2]], cache)
+        for trans in graph.outgoing.get(workitem['act_id'], []):
             if trans['trigger_model']:
-                ids = wkf_expr._eval_expr(cr,ident,workitem,trans['trigger_expr_id'])
+                ids = wkf_expr._eval_expr(cr,ident,workitem,trans['trigger_expr_code'],env)
                 for res_id in ids:
                     cr.execute('select nextval(\'wkf_triggers_id_seq\')')
                     id =cr.fetchone()[0]
@@ -144,16 +159,15 @@ def _execute(cr, workitem, activity, ident, stack):
 
     return result
 
-def _split_test(cr, workitem, split_mode, ident, signal=None, stack=None):
+def _split_test(cr, workitem, split_mode, ident, signal=None, stack=None, env=None, cache=None):
     if stack is None:
         raise 'Error !!!'
-    cr.execute('select * from wkf_transition where act_from=%s', (workitem['act_id'],))
     test = False
     transitions = []
-    alltrans = cr.dictfetchall()
+    alltrans = wkf_graph.get(cr).outgoing.get(workitem['act_id'], [])
     if split_mode=='XOR' or split_mode=='OR':
         for transition in alltrans:
-            if wkf_expr.check(cr, workitem, ident, transition,signal):
+            if wkf_expr.check(cr, workitem, ident, transition,signal,env):
                 test = True
                 transitions.append((transition['id'], workitem['inst_id']))
                 if split_mode=='XOR':
@@ -161,7 +175,7 @@ def _split_test(cr, workitem, split_mode, ident, signal=None, stack=None):
     else:
         test = True
         for transition in alltrans:
-            if not wkf_expr.check(cr, workitem, ident, transition,signal):
+            if not wkf_expr.check(cr, workitem, ident, transition,signal,env):
                 test = False
                 break
             cr.execute('select count(*) from wkf_witm_trans where trans_id=%s and inst_id=%s', (transition['id'], workitem['inst_id']))
@@ -171,30 +185,29 @@ def _split_test(cr, workitem, split_mode, ident, signal=None, stack=None):
         cr.executemany('insert into wkf_witm_trans (trans_id,inst_id) values (%s,%s)', transitions)
         cr.execute('delete from wkf_workitem where id=%s', (workitem['id'],))
         for t in transitions:
-            _join_test(cr, t[0], t[1], ident, stack)
+            _join_test(cr, t[0], t[1], ident, stack, cache)
         return True
     return False
 
-def _join_test(cr, trans_id, inst_id, ident, stack):
-    cr.execute('select * from wkf_activity where id=(select act_to from wkf_transition where id=%s)', (trans_id,))
-    activity = cr.dictfetchone()
+def _join_test(cr, trans_id, inst_id, ident, stack, cache=None):
+    graph, transition = wkf_graph.get_transition(cr, trans_id)
+    activity = graph.activities[transition['act_to']]
     if activity['join_mode']=='XOR':
-        create(cr,[activity], inst_id, ident, stack)
+        create(cr,[activity], inst_id, ident, stack, cache)
         cr.execute('delete from wkf_witm_trans where inst_id=%s and trans_id=%s', (inst_id,trans_id))
     else:
-        cr.execute('select id from wkf_transition where act_to=%s', (activity['id'],))
-        trans_ids = cr.fetchall()
+        trans_ids = graph.incoming.get(activity['id'], [])
         ok = True
-        for (id,) in trans_ids:
+        for id in trans_ids:
             cr.execute('select count(*) from wkf_witm_trans where trans_id=%s and inst_id=%s', (id,inst_id))
             res = cr.fetchone()[0]
             if not res:
                 ok = False
                 break
         if ok:
-            for (id,) in trans_ids:
+            for id in trans_ids:
                 cr.execute('delete from wkf_witm_trans where trans_id=%s and inst_id=%s', (id,inst_id))
-            create(cr, [activity], inst_id, ident, stack)
+            create(cr, [activity], inst_id, ident, stack, cache)
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
 